@@ -0,0 +1,158 @@
+#Copyright (C) Systems & Technology Research
+#Use of this software is subject to the restrictions in license.txt
+#Distribution A: Approved for Public Release, Distribution Unlimited
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from tqdm import tqdm
+
+import edge_weight
+import h_index_finder.h_index_finder as h_index_finder
+import instrumentation
+from pmid_metadata import PmidMetadata, PmidMetadataBuilder
+from pmid_store import PmidStore, DEFAULT_STORE_PATH
+from refresh_policy import RefreshPolicy
+
+
+'''
+Calculate edge weights for many subgraphs at once
+
+1. Stream all subgraphs (see subgraph_stream.py) and collect the unique pmids of the whole batch
+2. Collect metadata for the unique pmids (PMID store / NCBI) and h-indexes for the unique authors, once
+3. Compute and write the weights of every subgraph in a process pool (no NCBI calls in the workers)
+
+Stage timings, NCBI calls and cache hits of the whole batch are written to {output_dir}/batch_metrics.json
+
+Usage:
+python batch_edge_weights.py ./subgraphs_folder other_subgraph.json --email john.doe@email.com --processes 8
+'''
+
+
+# List the subgraph json files of a list of files and/or folders
+def find_subgraph_files(paths):
+    if isinstance(paths, str):
+        paths = [paths]
+
+    json_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            json_paths.extend(sorted(glob.glob(os.path.join(path, '*.json'))))
+        else:
+            json_paths.append(path)
+    return json_paths
+
+
+# Name of the output folder of a subgraph: the json file name without extension
+def subgraph_name(json_path):
+    return os.path.splitext(os.path.basename(json_path))[0]
+
+
+# Worker: compute and write the weights of one subgraph from already collected metadata
+def _write_subgraph_weights(json_path, email, api_key, output_dir, pmid_meta, author_2_h_index):
+    calculator = edge_weight.EdgeWeightCalculator.from_json_file(json_path, email, subgraph_name(json_path), api_key,
+                                                                 output_dir=output_dir)
+    calculator.pmid_dict = pmid_meta
+    calculator.write_pmid_metadata()
+    calculator.write_edge_weights(author_2_h_index)
+    return calculator.output_dir
+
+
+# START HERE
+'''
+This is the public function to calculate edge weights for a batch of subgraphs
+
+Args:
+subgraph_paths: subgraph json file(s) and/or folder(s) containing subgraph json files
+email: a valid email for api calls
+apikey: optional NCBI api key
+output_dir: folder in which an output folder is created for every subgraph (named after the json file)
+processes: number of worker processes for the weight calculation (None for one per CPU)
+store_path: path to the PMID metadata store shared by all subgraphs (None to disable)
+refresh_policy: optional RefreshPolicy, stale PMID metadata and h-indexes are fetched again
+
+Returns:
+list of output folders, one per subgraph
+'''
+def calculate_edge_weights_batch(subgraph_paths, email, apikey=None, output_dir='.', processes=None, store_path=DEFAULT_STORE_PATH,
+                                refresh_policy=None):
+    with instrumentation.run('batch', os.path.join(output_dir, 'batch_metrics.json')):
+        return _calculate_edge_weights_batch(subgraph_paths, email, apikey, output_dir, processes, store_path, refresh_policy)
+
+
+def _calculate_edge_weights_batch(subgraph_paths, email, apikey, output_dir, processes, store_path, refresh_policy):
+    json_paths = find_subgraph_files(subgraph_paths)
+
+    print(f'Reading {len(json_paths)} Subgraphs')
+
+    # pmids of every subgraph and unique pmids of the whole batch
+    subgraph_pmids = []
+    all_pmids = dict()
+    with instrumentation.stage('batch.read_subgraphs'):
+        for json_path in tqdm(json_paths):
+            calculator = edge_weight.EdgeWeightCalculator.from_json_file(json_path, email, subgraph_name(json_path), apikey,
+                                                                         output_dir=output_dir)
+            subgraph_pmids.append(calculator.all_pmids)
+            all_pmids.update(dict.fromkeys(calculator.all_pmids))
+
+    print('-'*20)
+    print(f'Collecting PMID Metadata for {len(all_pmids)} Unique PMIDs')
+
+    pmid_store = None
+    if store_path is not None:
+        pmid_store = PmidStore(store_path)
+    try:
+        with instrumentation.stage('batch.collect_NCBI'):
+            collected = edge_weight.collect_pmid_metadata(list(all_pmids), email, apikey, pmid_store,
+                                                          pmid_dict=PmidMetadataBuilder(), refresh_policy=refresh_policy)
+            pmid_meta = collected.build()
+            del collected
+            if pmid_store is not None:
+                pmid_store.count_uses(all_pmids)
+    finally:
+        if pmid_store is not None:
+            pmid_store.close()
+
+    print('-'*20)
+    print('Collecting H-Index for All Unique Authors using h_index_finder.py')
+
+    with instrumentation.stage('batch.h_indexes'):
+        author_2_h_index = h_index_finder.find_h_index(email, list(pmid_meta.authors), apikey, refresh_policy=refresh_policy)
+
+    print('-'*20)
+    print('Calculating and Dumping Edge Weights')
+
+    with instrumentation.stage('batch.weights'), ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = []
+        for json_path, pmids in zip(json_paths, subgraph_pmids):
+            sub_pmid_meta = PmidMetadata.concat([pmid_meta], pmids)
+            sub_author_2_h_index = {author: author_2_h_index[author] for author in sub_pmid_meta.authors if author in author_2_h_index}
+            futures.append(executor.submit(_write_subgraph_weights, json_path, email, apikey, output_dir,
+                                           sub_pmid_meta, sub_author_2_h_index))
+
+        return [future.result() for future in tqdm(futures)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Calculate edge weights for a batch of BLENDER subgraphs')
+    parser.add_argument('subgraphs', nargs='+', help='subgraph json files and/or folders of subgraph json files')
+    parser.add_argument('--email', required=True, help='a valid email for api calls')
+    parser.add_argument('--api-key', default=None, help='NCBI api key')
+    parser.add_argument('--output-dir', default='.', help='folder in which the per-subgraph output folders are created')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--store-path', default=DEFAULT_STORE_PATH, help='path to the PMID metadata store')
+    parser.add_argument('--no-store', action='store_true', help='do not use the PMID metadata store')
+    parser.add_argument('--max-age', type=float, default=None, help='fetch again stored results older than this many days')
+    parser.add_argument('--retry-zero', action='store_true', help='fetch again stored pmids without citations and h-indexes of 0')
+    parser.add_argument('--refresh-top-n', type=int, default=0, help='fetch again the n most used stored pmids and h-indexes')
+    args = parser.parse_args()
+
+    refresh_policy = None
+    if args.max_age is not None or args.retry_zero or args.refresh_top_n > 0:
+        if args.no_store:
+            parser.error('--max-age, --retry-zero and --refresh-top-n need the PMID metadata store (drop --no-store)')
+        refresh_policy = RefreshPolicy(args.max_age, args.retry_zero, args.refresh_top_n)
+
+    calculate_edge_weights_batch(args.subgraphs, args.email, args.api_key, args.output_dir, args.processes,
+                                 None if args.no_store else args.store_path, refresh_policy)
@@ -0,0 +1,173 @@
+#Copyright (C) Systems & Technology Research
+#Use of this software is subject to the restrictions in license.txt
+#Distribution A: Approved for Public Release, Distribution Unlimited
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from Bio import Entrez
+from Bio import Medline
+
+import eutils_parse
+
+
+'''
+Microbenchmarks of eutils_parse.py against the parsers it replaces, on synthetic responses shaped like
+the ones NCBI returns for one batch of edge_weight.py / one author of h_index_finder.py.
+Every benchmark first checks that both parsers return the same values.
+
+Usage:
+python benchmarks/bench_eutils_parse.py --records 200 --repeat 5
+'''
+
+
+def medline_text(n_records, rng):
+    lines = []
+    for i in range(n_records):
+        pmid = 30000000 + i
+        lines.append(f'PMID- {pmid}')
+        lines.append('OWN - NLM')
+        lines.append('STAT- MEDLINE')
+        lines.append(f'DCOM- 2019{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}')
+        lines.append('TI  - ' + ' '.join(f'word{rng.randint(0, 999)}' for _ in range(12)))
+        lines.append('      ' + ' '.join(f'word{rng.randint(0, 999)}' for _ in range(8)))
+        lines.append('AB  - ' + ' '.join(f'word{rng.randint(0, 999)}' for _ in range(14)))
+        for _ in range(15):
+            lines.append('      ' + ' '.join(f'word{rng.randint(0, 999)}' for _ in range(14)))
+        for a in range(rng.randint(1, 12)):
+            lines.append(f'FAU - Surname{rng.randint(0, 9999)}, Name{a}')
+            lines.append(f'AU  - Surname{a} N')
+            lines.append(f'AD  - Department {a}, University of Somewhere, Some City,')
+            lines.append('      Some Country.')
+        for _ in range(rng.randint(0, 3)):
+            lines.append(f'GR  - R01 GM{rng.randint(10000, 99999)}/GM/NIGMS NIH HHS/United States')
+        for _ in range(rng.randint(5, 15)):
+            lines.append(f'MH  - Term{rng.randint(0, 999)}/metabolism')
+        if rng.random() < .5:
+            lines.append(f'PMC - PMC{rng.randint(1000000, 9999999)}')
+        lines.append('SO  - Some Journal. 2019 Jan;1(2):3-4.')
+        lines.append('')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def esearch_xml(ids):
+    return ('<?xml version="1.0" encoding="UTF-8" ?>\n'
+            '<!DOCTYPE eSearchResult PUBLIC "-//NLM//DTD esearch 20060628//EN" '
+            '"https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20060628/esearch.dtd">\n'
+            f'<eSearchResult><Count>{len(ids)}</Count><RetMax>{len(ids)}</RetMax><RetStart>0</RetStart><IdList>'
+            + ''.join(f'<Id>{i}</Id>' for i in ids) +
+            '</IdList><TranslationSet/><QueryTranslation>author</QueryTranslation></eSearchResult>').encode('utf-8')
+
+
+def esearch_json(ids):
+    return json.dumps({'header': {'type': 'esearch', 'version': '0.3'},
+                       'esearchresult': {'count': str(len(ids)), 'retmax': str(len(ids)), 'retstart': '0',
+                                         'idlist': [str(i) for i in ids]}}).encode('utf-8')
+
+
+def elink_xml(links, scores=False):
+    parts = ['<?xml version="1.0" encoding="UTF-8" ?>\n'
+             '<!DOCTYPE eLinkResult PUBLIC "-//NLM//DTD elink 20101123//EN" '
+             '"https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20101123/elink.dtd">\n<eLinkResult>']
+    for pmid, citers in links.items():
+        parts.append(f'<LinkSet><DbFrom>pubmed</DbFrom><IdList><Id>{pmid}</Id></IdList>')
+        if len(citers) > 0:
+            parts.append('<LinkSetDb><DbTo>pmc</DbTo><LinkName>pubmed_pmc_refs</LinkName>')
+            for citer in citers:
+                score = f'<Score>{pmid}</Score>' if scores else ''
+                parts.append(f'<Link><Id>{citer}</Id>{score}</Link>')
+            parts.append('</LinkSetDb>')
+        parts.append('</LinkSet>')
+    parts.append('</eLinkResult>')
+    return ''.join(parts).encode('utf-8')
+
+
+def elink_json(links):
+    link_sets = []
+    for pmid, citers in links.items():
+        link_set = {'dbfrom': 'pubmed', 'ids': [str(pmid)]}
+        if len(citers) > 0:
+            link_set['linksetdbs'] = [{'dbto': 'pmc', 'linkname': 'pubmed_pmc_refs', 'links': [str(c) for c in citers]}]
+        link_sets.append(link_set)
+    return json.dumps({'header': {'type': 'elink', 'version': '0.3'}, 'linksets': link_sets}).encode('utf-8')
+
+
+# Parsers used before eutils_parse.py
+def old_medline(data):
+    return {record['PMID']: record for record in Medline.parse(io.StringIO(data.decode('utf-8'))) if 'PMID' in record}
+
+def new_medline(data):
+    return {record['PMID']: record for record in eutils_parse.parse_medline(data, eutils_parse.PMID_RECORD_KEYS)}
+
+def old_esearch(data):
+    return [id_.get_text() for id_ in BeautifulSoup(data, 'xml').find_all('Id', {})]
+
+def old_elink(data):
+    link_dict = dict()
+    for link_set in Entrez.read(io.BytesIO(data)):
+        if len(link_set['IdList']) == 0 or len(link_set['LinkSetDb']) == 0:
+            continue
+        link_dict[str(link_set['IdList'][0])] = [str(link['Id']) for link in link_set['LinkSetDb'][0]['Link']]
+    return link_dict
+
+def new_elink(data):
+    return {link_set['ids'][0]: link_set['links'] for link_set in eutils_parse.elink_linksets(data)
+            if len(link_set['ids']) > 0 and link_set['links'] is not None}
+
+def old_elink_scores(data):
+    return [(str(link['Id']), str(link['Score'])) for rr in Entrez.read(io.BytesIO(data)) if len(rr['LinkSetDb']) > 0
+            for link in rr['LinkSetDb'][0]['Link']]
+
+def new_elink_scores(data):
+    return [pair for rr in eutils_parse.elink_linksets(data) if rr['links'] is not None
+            for pair in zip(rr['links'], rr['scores'])]
+
+
+def same_medline(old, new):
+    keys = eutils_parse.PMID_RECORD_KEYS
+    return old.keys() == new.keys() and all(
+        {k: v for k, v in old[pmid].items() if k in keys} == new[pmid] for pmid in old)
+
+
+def bench(name, old_parser, new_parser, old_data, new_data, repeat, same=lambda a, b: a == b):
+    if not same(old_parser(old_data), new_parser(new_data)):
+        raise AssertionError(f'{name}: parsers disagree')
+
+    old_time = min(timeit.repeat(lambda: old_parser(old_data), number=1, repeat=repeat))
+    new_time = min(timeit.repeat(lambda: new_parser(new_data), number=1, repeat=repeat))
+    print(f'{name:<28} old {old_time*1000:9.2f} ms   new {new_time*1000:9.2f} ms   speedup {old_time/new_time:6.1f}x')
+
+
+def main(records, repeat, seed):
+    rng = random.Random(seed)
+
+    medline = medline_text(records, rng)
+    ids = [rng.randint(1000000, 35000000) for _ in range(500)]
+    links = {30000000 + i: [rng.randint(1000000, 9999999) for _ in range(rng.choice([0, 0, 3, 20, 150]))]
+             for i in range(records)}
+
+    print(f'{records} records / link sets per response, best of {repeat}')
+    bench('efetch medline', old_medline, new_medline, medline, medline, repeat, same_medline)
+    bench('esearch (xml -> json)', old_esearch, eutils_parse.esearch_ids, esearch_xml(ids), esearch_json(ids), repeat)
+    bench('esearch (xml -> xml)', old_esearch, eutils_parse.esearch_ids, esearch_xml(ids), esearch_xml(ids), repeat)
+    bench('elink (xml -> json)', old_elink, new_elink, elink_xml(links), elink_json(links), repeat)
+    bench('elink (xml -> xml)', old_elink, new_elink, elink_xml(links), elink_xml(links), repeat)
+    bench('elink neighbor_score (xml)', old_elink_scores, new_elink_scores, elink_xml(links, True),
+          elink_xml(links, True), repeat)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark eutils_parse.py against Bio.Medline, Bio.Entrez and BeautifulSoup')
+    parser.add_argument('--records', type=int, default=200, help='records / link sets per response')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per parser, the best one is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    main(args.records, args.repeat, args.seed)
@@ -0,0 +1,166 @@
+#Copyright (C) Systems & Technology Research
+#Use of this software is subject to the restrictions in license.txt
+#Distribution A: Approved for Public Release, Distribution Unlimited
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import edge_weight
+import get_pmids
+import synthetic
+
+
+'''
+Offline benchmark of the weight pipeline on synthetic subgraphs
+
+For every size, a synthetic subgraph and Knowledge Graph folder are generated and each stage is timed
+separately (wall time, and peak Python/numpy memory from tracemalloc in a second run):
+get_pmids (KG csvs, KG cache build, cached KG), subgraph indexing, each get_*_weights, write_edge_weights
+(edge stats, csv, Arrow tables and state file), the csv dump on its own and plot_subgraph. NCBI is replaced by benchmarks/synthetic.FakeNCBI.
+
+plot_subgraph needs holoviews/datashader/bokeh, it is skipped if they are not installed (or with --no-plot).
+
+Usage:
+python benchmarks/bench_pipeline.py --sizes 1000,10000,100000 --json report.json
+'''
+
+
+# EdgeWeightCalculator with h-indexes from FakeNCBI instead of h_index_finder
+class BenchCalculator(edge_weight.EdgeWeightCalculator):
+
+    def __init__(self, *args, fake_ncbi=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fake_ncbi = fake_ncbi
+
+    def collect_author_h_indexes(self, known_h_indexes=None):
+        return self.fake_ncbi.h_indexes(self.pmid_metadata().authors)
+
+
+# Run fn twice: once for the wall time (s), once under tracemalloc for the peak memory (bytes)
+'''
+tracemalloc slows down allocation heavy code, so the two are measured in separate runs.
+Returns the result of the timed run, wall time and peak memory
+'''
+def measure(fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def plot_available():
+    try:
+        import plot_subgraph.plot_subgraph # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def run_size(n_edges, args, work_dir):
+    n_nodes = max(3, int(n_edges * args.nodes_per_edge))
+    fake_ncbi = synthetic.FakeNCBI(args.mean_citations, args.citation_tail, seed=args.seed)
+
+    print(f'Generating {n_nodes} nodes / {n_edges} edges')
+    subgraph = synthetic.generate_subgraph(n_nodes, n_edges, args.pmids_per_edge, seed=args.seed)
+    name = f'synthetic_{n_edges}'
+    kg_path = os.path.join(work_dir, f'kg_{n_edges}')
+    json_path = os.path.join(work_dir, f'{name}.json')
+    synthetic.write_knowledge_graph(subgraph, kg_path, args.kg_noise, seed=args.seed)
+    synthetic.write_subgraph(synthetic.strip_pmids(subgraph), json_path)
+
+    results = []
+    def stage(stage_name, fn):
+        result, elapsed, peak = measure(fn)
+        results.append({'edges': n_edges, 'nodes': n_nodes, 'stage': stage_name, 'seconds': elapsed, 'peak_bytes': peak})
+        print(f'{n_edges:>9} {stage_name:<36} {elapsed:9.3f} s {peak / 2**20:10.1f} MiB')
+        return result
+
+    cache_dir = os.path.join(work_dir, f'kg_cache_{n_edges}')
+    stage('get_pmids (KG csvs)', lambda: get_pmids.get_pmids([json_path], kg_path, use_cache=False))
+    def build_kg_cache():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        get_pmids.get_pmids([json_path], kg_path, cache_dir=cache_dir)
+    stage('get_pmids (build KG cache)', build_kg_cache)
+    stage('get_pmids (cached KG)', lambda: get_pmids.get_pmids([json_path], kg_path, cache_dir=cache_dir))
+
+    sub_graph_json = json.dumps(subgraph)
+    calculator = stage('index subgraph', lambda: BenchCalculator(sub_graph_json, 'bench@example.com', name,
+                                                                 output_dir=work_dir, fake_ncbi=fake_ncbi))
+    calculator.pmid_dict = fake_ncbi.pmid_dict(calculator.all_pmids)
+
+    stage('get_original_edge_weights', calculator.get_original_edge_weights)
+    stage('get_citation_edge_weights', calculator.get_citation_edge_weights)
+    stage('get_unique_citation_edge_weights', calculator.get_unique_citation_edge_weights)
+    stage('get_publication_edge_weights', calculator.get_publication_edge_weights)
+    stage('get_publication_citation_weights', calculator.get_publication_citation_weights)
+    stage('get_h_index_weights', calculator.get_h_index_weights)
+
+    author_2_h_index = calculator.collect_author_h_indexes()
+    df = stage('write_edge_weights (all outputs)', lambda: calculator.write_edge_weights(author_2_h_index))
+    stage('csv dump', lambda: df.to_csv(os.path.join(calculator.output_dir, f'{name}.csv'), index=False))
+
+    if not args.no_plot and n_edges <= args.max_plot_edges:
+        import plot_subgraph.plot_subgraph as ps
+        csv_path = os.path.join(calculator.output_dir, f'{name}.csv')
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            stage('plot_subgraph', lambda: ps.plot_subgraph(csv_path, name))
+        finally:
+            os.chdir(cwd)
+
+    return results
+
+
+def main(args):
+    if not args.no_plot and not plot_available():
+        print('plot_subgraph dependencies are not installed, skipping plot_subgraph')
+        args.no_plot = True
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for n_edges in sizes:
+            print('-'*20)
+            results.extend(run_size(n_edges, args, work_dir))
+
+    print('-'*20)
+    print(f'{"edges":>9} {"stage":<36} {"wall":>11} {"peak memory":>14}')
+    for r in results:
+        print(f'{r["edges"]:>9} {r["stage"]:<36} {r["seconds"]:9.3f} s {r["peak_bytes"] / 2**20:10.1f} MiB')
+
+    if args.json is not None:
+        with open(args.json, 'w') as output:
+            output.write(json.dumps({'config': vars(args), 'results': results}, indent=1))
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the edge weight pipeline on synthetic subgraphs')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='comma separated numbers of edges')
+    parser.add_argument('--nodes-per-edge', type=float, default=.2, help='number of nodes per edge')
+    parser.add_argument('--pmids-per-edge', type=float, default=3., help='mean number of pmids per edge')
+    parser.add_argument('--mean-citations', type=float, default=10., help='mean number of citations per pmid')
+    parser.add_argument('--citation-tail', type=float, default=1.5, help='Pareto tail index of the citation counts')
+    parser.add_argument('--kg-noise', type=int, default=5, help='unrelated KG relations per subgraph link')
+    parser.add_argument('--no-plot', action='store_true', help='do not time plot_subgraph')
+    parser.add_argument('--max-plot-edges', type=int, default=20000, help='largest size plot_subgraph is timed for')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help='also write the results to this json file')
+    main(parser.parse_args())
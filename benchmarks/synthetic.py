@@ -0,0 +1,180 @@
+#Copyright (C) Systems & Technology Research
+#Use of this software is subject to the restrictions in license.txt
+#Distribution A: Approved for Public Release, Distribution Unlimited
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from get_pmids import ENTITY_TABLES, RELATION_TABLES
+
+
+'''
+Synthetic BLENDER subgraphs, Knowledge Graph folders and NCBI results for offline benchmarks
+
+generate_subgraph: subgraph json with pmids in the edgetypes, as produced by get_pmids.py
+write_knowledge_graph: KG csvs from which get_pmids.py recovers the pmids of a subgraph
+FakeNCBI: deterministic pmid_dict entries and author h-indexes, instead of calls to NCBI
+'''
+
+# the KG tables are those get_pmids.py reads
+CATEGORIES = list(ENTITY_TABLES)
+
+FIRST_PMID = 10000000
+# First pmid of the papers citing the subgraph pmids
+CITER_PMID = 20000000
+
+
+# Subgraph json (as a dictionary) with n_nodes nodes and n_edges links between nodes of different categories
+'''
+Every link gets a Poisson number of pmids (mean pmids_per_edge, at least one) drawn from n_pmids pmids
+(default: n_edges), so popular pmids are shared between edges as in real subgraphs.
+'''
+def generate_subgraph(n_nodes, n_edges, pmids_per_edge=3., n_pmids=None, seed=0):
+    rng = np.random.default_rng(seed)
+    if n_pmids is None:
+        n_pmids = n_edges
+
+    node_categories = rng.integers(0, len(CATEGORIES), n_nodes)
+    nodes = [{'id': i, 'name': f'{CATEGORIES[c].lower()}_{i}', 'category': int(c)} for i, c in enumerate(node_categories)]
+
+    by_category = [np.flatnonzero(node_categories == c) for c in range(len(CATEGORIES))]
+    pairs = [(CATEGORIES.index(a), CATEGORIES.index(b)) for a, b in RELATION_TABLES if len(by_category[CATEGORIES.index(a)]) > 0
+             and len(by_category[CATEGORIES.index(b)]) > 0]
+
+    # zipf-like pmid popularity
+    popularity = 1. / np.arange(1, n_pmids + 1) ** .8
+    popularity /= popularity.sum()
+
+    links = []
+    pair_of_link = rng.integers(0, len(pairs), n_edges)
+    n_link_pmids = np.maximum(rng.poisson(pmids_per_edge, n_edges), 1)
+    for pair, k in zip(pair_of_link, n_link_pmids):
+        a, b = pairs[pair]
+        source = int(rng.choice(by_category[a]))
+        target = int(rng.choice(by_category[b]))
+        if rng.random() < .5:
+            source, target = target, source
+        pmids = FIRST_PMID + rng.choice(n_pmids, k, p=popularity)
+        edgetype = 'related_to\nsource:' + ''.join(f'{pmid},' for pmid in pmids)
+        links.append({'source': source, 'target': target, 'edgetype': edgetype})
+
+    return {
+        'categories': [{'name': name} for name in CATEGORIES],
+        'nodes': nodes,
+        'links': links,
+    }
+
+
+# Copy of a subgraph without the pmids in the edgetypes (the input of get_pmids.py)
+def strip_pmids(subgraph):
+    stripped = dict(subgraph)
+    stripped['links'] = [dict(link, edgetype=link['edgetype'].split('\nsource:')[0]) for link in subgraph['links']]
+    return stripped
+
+
+# Write KG csvs from which get_pmids.py recovers the pmids of subgraph
+'''
+noise: number of extra relations (per subgraph link) between entities that are not in the subgraph,
+so the KG is larger than the subgraph as it is in practice
+'''
+def write_knowledge_graph(subgraph, kg_path, noise=5, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(kg_path, exist_ok=True)
+
+    category_names = [category['name'] for category in subgraph['categories']]
+    names = {category: [] for category in CATEGORIES}
+    for node in subgraph['nodes']:
+        names[category_names[node['category']]].append(node['name'])
+
+    # entities of the subgraph plus as many unrelated ones
+    n_extra = max(1, noise * len(subgraph['nodes']) // len(CATEGORIES))
+    for category in CATEGORIES:
+        names[category] = names[category] + [f'extra_{category.lower()}_{i}' for i in range(n_extra)]
+        file_name, name_column, id_column = ENTITY_TABLES[category]
+        pd.DataFrame({name_column: names[category], id_column: [f'{category[0]}{i}' for i in range(len(names[category]))]}).to_csv(
+            os.path.join(kg_path, file_name), sep='\t', index=False)
+    ids = {category: {name: f'{category[0]}{i}' for i, name in enumerate(names[category])} for category in CATEGORIES}
+
+    rows = {pair: [] for pair in RELATION_TABLES}
+    for link in subgraph['links']:
+        source = subgraph['nodes'][link['source']]
+        target = subgraph['nodes'][link['target']]
+        source_category = category_names[source['category']]
+        target_category = category_names[target['category']]
+        pmids = link['edgetype'].split('\nsource:')[1].rstrip(',').replace(',', '|')
+        if (source_category, target_category) in RELATION_TABLES:
+            rows[(source_category, target_category)].append((ids[source_category][source['name']], ids[target_category][target['name']], pmids))
+        else:
+            rows[(target_category, source_category)].append((ids[target_category][target['name']], ids[source_category][source['name']], pmids))
+
+    for (a, b), file_name in RELATION_TABLES.items():
+        n_noise = noise * max(len(rows[(a, b)]), 1)
+        extra_a = rng.choice(names[a][-n_extra:], n_noise)
+        extra_b = rng.choice(names[b][-n_extra:], n_noise)
+        noise_pmids = FIRST_PMID + rng.integers(0, 10 ** 7, n_noise)
+        noise_rows = [(ids[a][x], ids[b][y], str(p)) for x, y, p in zip(extra_a, extra_b, noise_pmids)]
+        df = pd.DataFrame(rows[(a, b)] + noise_rows, columns=[f'{a}ID', f'{b}ID', 'pmids'])
+        df.to_csv(os.path.join(kg_path, file_name), sep='\t', index=False)
+
+
+def write_subgraph(subgraph, json_path):
+    with open(json_path, 'w') as f:
+        f.write(json.dumps(subgraph))
+
+
+# Deterministic stand-in for the NCBI metadata and h-index lookups
+'''
+Citation counts follow a Pareto (heavy tailed) distribution with the given mean and tail index,
+authors are drawn from a pool of n_authors names with zipf-like popularity. Citing pmids are drawn
+uniformly from a pool of n_citers pmids (default: mean_citations per paper), so papers share few citers.
+'''
+class FakeNCBI:
+
+    def __init__(self, mean_citations=10., citation_tail=1.5, authors_per_paper=5, n_authors=None, n_citers=None, seed=0):
+        self.mean_citations = mean_citations
+        self.n_citers = n_citers
+        self.citation_tail = citation_tail
+        self.authors_per_paper = authors_per_paper
+        self.n_authors = n_authors
+        self.seed = seed
+
+    # pmid_dict entries (as built by edge_weight.build_pmid_entry) for a list of pmids
+    def pmid_dict(self, pmids):
+        rng = np.random.default_rng(self.seed)
+        n = len(pmids)
+        n_authors = self.n_authors or max(n, 1)
+        n_citers = self.n_citers or max(int(n * self.mean_citations), 1)
+
+        # Pareto with mean mean_citations: scale * tail / (tail - 1)
+        scale = self.mean_citations * (self.citation_tail - 1) / self.citation_tail
+        n_citations = np.floor(scale * (1 + rng.pareto(self.citation_tail, n))).astype(np.int64)
+        years = rng.integers(1990, 2021, n)
+        popularity = 1. / np.arange(1, n_authors + 1) ** .8
+        popularity /= popularity.sum()
+        n_paper_authors = np.maximum(rng.poisson(self.authors_per_paper, n), 1)
+        authors = rng.choice(n_authors, int(n_paper_authors.sum()), p=popularity)
+        # citers of all papers, numbered after the subgraph pmids
+        citers = CITER_PMID + rng.integers(0, n_citers, int(n_citations.sum()))
+
+        pmid_dict = dict()
+        start = 0
+        citer_start = 0
+        for i, pmid in enumerate(pmids):
+            paper_authors = authors[start:start + n_paper_authors[i]]
+            start += n_paper_authors[i]
+            paper_citers = np.unique(citers[citer_start:citer_start + n_citations[i]])
+            citer_start += n_citations[i]
+            pmid_dict[pmid] = {
+                'pmcid_number': '', 'pmcid': False,
+                'authors': [f'Author {a}' for a in paper_authors],
+                'affiliations': '', 'grants': '',
+                'pub_date': f'{years[i]}0101',
+                'citations': [str(c) for c in paper_citers],
+            }
+        return pmid_dict
+
+    # author -> h-index for a list of authors
+    def h_indexes(self, authors):
+        return {author: int(sum(ord(c) for c in author) % 60) for author in authors}
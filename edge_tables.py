@@ -0,0 +1,81 @@
+#Copyright (C) Systems & Technology Research
+#Use of this software is subject to the restrictions in license.txt
+#Distribution A: Approved for Public Release, Distribution Unlimited
+import os
+
+import numpy as np
+import pyarrow as pa
+
+
+'''
+Typed edge and node tables of a subgraph, written next to the csv as Arrow IPC files
+
+{rel_name}_edges.arrow: one row per link of the subgraph json, in json order
+    edge_id: position of the link in the json
+    source, target: node ids
+    n_pmids: number of pmids of the edge
+    one float64 column per weight (weight_engine.weights_from_stats)
+{rel_name}_nodes.arrow: one row per node of the subgraph json
+    node_id, name
+    category: category name (dictionary encoded)
+    category_id: category index in the json
+
+Unlike the csv, edges are keyed by node ids, so parallel edges and nodes sharing a name are kept apart.
+The files are memory mapped when read, so loading them does not copy or parse anything.
+'''
+
+
+def table_paths(output_dir, rel_name):
+    return os.path.join(output_dir, f'{rel_name}_edges.arrow'), os.path.join(output_dir, f'{rel_name}_nodes.arrow')
+
+
+# Edges table of a SubgraphIndex and its weight columns
+def edges_table(index, weights):
+    node_ids = np.asarray(index.node_ids, dtype=np.int64)
+    columns = {
+        'edge_id': pa.array(np.arange(index.n_edges, dtype=np.int64)),
+        'source': pa.array(node_ids[index.edge_source]),
+        'target': pa.array(node_ids[index.edge_target]),
+        'n_pmids': pa.array(np.diff(index.edge_ptr)),
+    }
+    for column, values in weights.items():
+        columns[column] = pa.array(np.asarray(values, dtype=np.float64))
+    return pa.table(columns)
+
+
+# Nodes table of a SubgraphIndex, category_names: names of the json categories (category index -> name)
+def nodes_table(index, category_names=None):
+    category_ids = np.asarray(index.node_categories, dtype=np.int64)
+    if category_names is None:
+        category_names = [str(i) for i in range(int(category_ids.max(initial=-1)) + 1)]
+    categories = pa.DictionaryArray.from_arrays(pa.array(category_ids.astype(np.int32)), pa.array(list(category_names), pa.string()))
+    return pa.table({
+        'node_id': pa.array(np.asarray(index.node_ids, dtype=np.int64)),
+        'name': pa.array(index.node_names, pa.string()),
+        'category': categories,
+        'category_id': pa.array(category_ids),
+    })
+
+
+def _write_arrow(path, table):
+    # write and rename, so readers never map a partially written file
+    with pa.OSFile(f'{path}.tmp', 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(f'{path}.tmp', path)
+
+
+# Write {rel_name}_edges.arrow and {rel_name}_nodes.arrow to output_dir
+def write_edge_tables(index, weights, output_dir, rel_name, category_names=None):
+    edges_path, nodes_path = table_paths(output_dir, rel_name)
+    _write_arrow(nodes_path, nodes_table(index, category_names))
+    _write_arrow(edges_path, edges_table(index, weights))
+    return edges_path, nodes_path
+
+
+# Memory mapped (edges, nodes) tables of a subgraph, None if they were not written
+def read_edge_tables(output_dir, rel_name):
+    edges_path, nodes_path = table_paths(output_dir, rel_name)
+    if not (os.path.exists(edges_path) and os.path.exists(nodes_path)):
+        return None
+    return tuple(pa.ipc.open_file(pa.memory_map(path, 'r')).read_all() for path in (edges_path, nodes_path))
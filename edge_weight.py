@@ -2,434 +2,630 @@
 #Use of this software is subject to the restrictions in license.txt
 #Distribution A: Approved for Public Release, Distribution Unlimited
 import json
-import pandas as pd
 from tqdm import tqdm
-from datetime import datetime
 import numpy as np
 import os
+import asyncio
 
-from Bio import Entrez
-from Bio.Entrez import efetch, read
-from Bio import Medline
-
-import networkx as nx
 import h_index_finder.h_index_finder as h_index_finder
+from pmid_store import PmidStore, PmidJournal, DEFAULT_STORE_PATH
+from pmid_metadata import PmidMetadata, PmidMetadataBuilder
+from eutils_client import EutilsClient, run_sync
+import eutils_parse
+import weight_engine
+import graph_layout
+import instrumentation
+import edge_tables
+import subgraph_stream
 
-import holoviews as hv
-from holoviews import opts
-import matplotlib.pyplot as plt
-import datashader as ds
-import datashader.transfer_functions as tf
-from datashader.layout import random_layout, circular_layout, forceatlas2_layout
-from datashader.bundling import connect_edges, hammer_bundle
 
-from fa2 import ForceAtlas2
+# Blotzman Function
+boltzman = weight_engine.boltzman
 
-import seaborn as sns
 
+# Edge weight calculator for one subgraph
+'''
+Owns all state of one run (json data, pmid list, pmid metadata, subgraph index), so several subgraphs
+can be processed at the same time, e.g. from a thread pool. Calculators can share one PmidStore (and
+with it all PMID metadata collected so far); NCBI calls of all calculators share one rate limit.
 
-#from sqlalchemy import create_engine
-hv.extension('bokeh')
+Args:
+sub_graph_json: a json object already read in from a file (see from_json_file to stream it from the file instead)
+email: a valid email for api calls
+json_name: name of json file or relationship, output is written to {output_dir}/{json_name}
+apikey: optional NCBI api key
+pmid_store: optional PmidStore shared between calculators
+output_dir: folder the {json_name} output folder is created in
+refresh_policy: optional RefreshPolicy, stale PMID metadata and h-indexes are fetched again (default: never)
+subgraph: optional (json data without links, SubgraphIndex) of an already read subgraph, used instead of sub_graph_json
+
+Only the subgraph index (edge_index) is kept of the links, json_data holds the other members of the json.
+PMID metadata is kept in compact form only (pmid_meta, a pmid_metadata.PmidMetadata), entries are rebuilt
+as dictionaries when they are looked up.
+'''
+class EdgeWeightCalculator:
 
-from bokeh.models import HoverTool
+    def __init__(self, sub_graph_json, email, json_name, apikey=None, pmid_store=None, output_dir='.', refresh_policy=None,
+                 subgraph=None):
+        self.email = email
+        self.rel_name = json_name
+        self.api_key = apikey
+        self.pmid_store = pmid_store
+        self.refresh_policy = refresh_policy
+        self.output_dir = os.path.join(output_dir, json_name)
 
+        if subgraph is None:
+            json_data = json.loads(sub_graph_json)
+            subgraph = (json_data, weight_engine.SubgraphIndex(json_data['nodes'], json_data.pop('links')))
 
-# Global Variables
-id_2_name_dict = None
-id_2_category_dict = None
-all_pmids = None 
-json_data = None 
-pmid_dict = None
-rel_name = None
-api_key = None
+        self.json_data, self.edge_index = subgraph
+        self.pmid_meta = PmidMetadata.concat([])
 
+        # Book-Keeping of Node Attributes
+        self.id_2_name_dict = dict()
+        self.id_2_category_dict = dict()
+        for node in self.json_data['nodes']:
+            self.id_2_name_dict[node['id']] = node['name']
+            self.id_2_category_dict[node['id']] = node['category']
 
-# Blotzman Function
-def boltzman(x, xmid, tau):
-    return 1. / (1. + np.exp(-(x-xmid)/tau))
+        # All pmids from json file
+        self.all_pmids = self.edge_index.all_pmids
 
+        os.makedirs(self.output_dir, exist_ok=True)
 
-# Collect required information from NCBI database to calculate all different ways of edge weights
-'''
-Following information are collected:
-Author names
-Authors' affiliations
-Publication date of paper/pmid-pmcid
-All pmids citing this paper
-Grants used to publish this paper
-
-Note: If a pmid refers to pmcid, use pmcid to collect information since it has more details (e.g., full author 
-names rather than first initial and last name)
-'''
+    # Calculator of a subgraph json file, streamed from the file so the whole document is never held in memory
+    '''
+    json_name defaults to the file name without extension, other arguments are those of EdgeWeightCalculator
+    '''
+    @classmethod
+    def from_json_file(cls, json_path, email, json_name=None, *args, **kwargs):
+        if json_name is None:
+            json_name = os.path.splitext(os.path.basename(json_path))[0]
+        return cls(None, email, json_name, *args, subgraph=subgraph_stream.read_subgraph_index(json_path), **kwargs)
 
-def collect_NCBI():
-    global all_pmids
-    global pmid_dict
-
-    if os.path.exists(f'./{rel_name}/{rel_name}_pmid_dict.json'):
-        with open(f'./{rel_name}/{rel_name}_pmid_dict.json', 'r') as f:
-            jd = f.read()
-            temp_dict = json.loads(jd)
-        pmid_dict.update(temp_dict)
-        return pmid_dict
-    
-    for idx in tqdm(range(len(all_pmids))):
-        pmid = all_pmids[idx]
-        # get records for each pmid
-        fetch_records_handle1 = efetch(db="pubmed", id=str(pmid), rettype="medline",retmode="text")
-        # parse fetched records
-        records1 = Medline.parse(fetch_records_handle1)
-
-        # Need to iterate over records to extract information
-        for record1 in records1:
-            # try except check to be sure that NCBI is not returning empty result
-            try:
-                # let's get pmcid if exists
-                id2 = record1['PMC'][3:]
-                #print('PMC',id2)
-
-                # get records for pmcid
-                fetch_records_handle2 = efetch(db="pubmed", id=str(id2),
-                                               rettype="medline",retmode="text")    
-                # parse records for pmcid
-                records2 = Medline.parse(fetch_records_handle2)
-
-                # Need to iterate over records to extract information
-                '''
-                Collect following information: authors, authors' affiliations, publication date, citations, grants
-                Store all these information in an dictionary (pmid_dict)
-                '''
-                for record2 in records2:
-                    authors = record2['FAU']
-                    affiliations = record2['AD']
-                    pub_date = record2['DCOM']
-                    citations = get_links_id(pmid)
-                    grants = record2['GR']
-                    pmid_dict[pmid] = {'pmcid_number':id2,'pmcid':True,'authors':authors,'affiliations':affiliations,'grants':grants,'pub_date':pub_date,'citations':citations}
-            except:
-                authors = record1['FAU']
-                try:
-                    affiliations = record1['AD']
-                except:
-                    affiliations = ''
-                try:
-                    pub_date = record1['DCOM']
-                except:
-                    pub_date = ''
-                try:                
-                    citations = get_links_id(pmid)
-                except:
-                    citations = ''
-                try:
-                    grants = record1['GR']
-                except:
-                    grants = ''
-                pmid_dict[pmid] = {'pmcid_number':'','pmcid':False,'authors':authors,'affiliations':affiliations,'grants':grants,'pub_date':pub_date,'citations':citations}
-
-
-    with open(f'./{rel_name}/{rel_name}_pmid_dict.json', 'w') as output:
-        output.write(json.dumps(pmid_dict))                
-    
-    return pmid_dict
+    # PMID metadata as a read-only mapping pmid -> entry (entries are rebuilt on access)
+    '''
+    Setting it to a dictionary pmid -> entry (e.g. metadata collected for a whole batch) replaces pmid_meta
+    with its compact form.
+    '''
+    @property
+    def pmid_dict(self):
+        return self.pmid_meta
 
-# Let's get citations from pmid
-'''
-This function gets all pmids citing a given pmid
-'''
-def get_links_id(pmid):
-    link_list = []
-    links = Entrez.elink(dbfrom="pubmed", id=pmid, linkname="pubmed_pmc_refs")
-    
-    record = Entrez.read(links)
-    records = record[0][u'LinkSetDb'][0][u'Link']
-    
-    for link in records:
-        link_list.append(link[u'Id'])
+    @pmid_dict.setter
+    def pmid_dict(self, pmid_dict):
+        if not isinstance(pmid_dict, PmidMetadata):
+            pmid_dict = PmidMetadata.from_pmid_dict(pmid_dict)
+        self.pmid_meta = pmid_dict
 
-    return link_list
+    # Compact PMID metadata (see pmid_metadata.py) the weights are computed from
+    def pmid_metadata(self):
+        return self.pmid_meta
 
+    # Collect required information from NCBI database to calculate all different ways of edge weights
+    '''
+    Following information are collected:
+    Author names
+    Authors' affiliations
+    Publication date of paper/pmid-pmcid
+    All pmids citing this paper
+    Grants used to publish this paper
+
+    Note: If a pmid refers to pmcid, use pmcid to collect information since it has more details (e.g., full author 
+    names rather than first initial and last name)
+
+    Metadata of a previous run over this subgraph is read from its compact form ({rel_name}_pmid_meta, memory
+    mapped) if there is one, and from a legacy {rel_name}_pmid_dict.json otherwise. Metadata found in the store
+    or fetched from NCBI is converted to compact form batch by batch and merged with it, entries are never
+    all held as dictionaries.
+
+    Fetched records are appended to {rel_name}_pmid_dict.journal as they arrive. If a run is interrupted,
+    the next one replays the journal and only fetches the remaining pmids. Once all pmids are collected
+    the metadata is written to {rel_name}_pmid_meta and the journal is removed.
+    '''
+    def collect_NCBI(self, batch_size=200):
+        rel_name = self.rel_name
+        parts = []
+
+        # Metadata collected by a previous run over this subgraph
+        previous = PmidMetadata.load(f'{self.output_dir}/{rel_name}_pmid_meta')
+        if previous is None and os.path.exists(f'{self.output_dir}/{rel_name}_pmid_dict.json'):
+            with open(f'{self.output_dir}/{rel_name}_pmid_dict.json', 'r') as f:
+                temp_dict = json.load(f)
+            previous = PmidMetadata.from_pmid_dict({pmid: temp_dict[pmid] for pmid in self.all_pmids if pmid in temp_dict})
+            del temp_dict
+        if previous is not None:
+            parts.append(previous)
+
+        # Metadata fetched by an interrupted run
+        journal = PmidJournal(f'{self.output_dir}/{rel_name}_pmid_dict.journal')
+        journal_dict = journal.replay()
+        if len(journal_dict) > 0:
+            print(f'Resuming from journal with {len(journal_dict)} PMIDs')
+        parts.append(PmidMetadata.from_pmid_dict({pmid: journal_dict[pmid] for pmid in self.all_pmids if pmid in journal_dict}))
+        del journal_dict
+
+        # stale pmids (over all pmids of the subgraph) are fetched again even if a previous run has them
+        stale = set()
+        if self.refresh_policy is not None and self.pmid_store is not None:
+            stale = self.pmid_store.stale(self.refresh_policy, self.all_pmids)
+            print(f'Refreshing {len(stale)} stale PMIDs ({self.refresh_policy})')
+        known = {pmid for pmid in self.all_pmids if pmid not in stale and any(pmid in part for part in parts)}
+        print(f'{len(known)} PMIDs known from previous runs over this subgraph')
+
+        fetched = PmidMetadataBuilder()
+        try:
+            collect_pmid_metadata([pmid for pmid in self.all_pmids if pmid not in known], self.email, self.api_key,
+                                  self.pmid_store, batch_size, fetched, journal, self.refresh_policy, stale)
+        finally:
+            journal.close()
+        if self.pmid_store is not None:
+            self.pmid_store.count_uses(self.all_pmids)
+
+        # a stale pmid NCBI has no record for anymore is dropped
+        parts.append(fetched.build())
+        self.pmid_meta = PmidMetadata.concat(parts, [pmid for pmid in self.all_pmids if pmid not in stale or pmid in fetched])
+        self.write_pmid_metadata()
+        journal.remove()
+
+        return self.pmid_meta
+
+    # Write the PMID metadata in compact form to {rel_name}_pmid_meta
+    def write_pmid_metadata(self):
+        self.pmid_meta.save(f'{self.output_dir}/{self.rel_name}_pmid_meta')
+
+    # Edge Weights
+    '''
+    All weights are computed by weight_engine from edge_index, the subgraph index built once per 
+    calculator. The get_*_weights methods return a dictionary "source-->target" -> weight.
+    '''
 
-# Edge Weight Based on Citations
-'''
-Get all citation information from pmid_dict
-'''
+    # Edge Weight Based on Citations
+    def get_citation_edge_weights(self):
+        stats = weight_engine.edge_stats(self.edge_index, weight_engine.pmid_arrays(self.edge_index, self.pmid_metadata()))
+        max_length_citations = weight_engine.max_citation_length(self.pmid_metadata())
+        return weight_engine.weights_dict(self.edge_index, weight_engine.citation_weights(self.edge_index, stats, max_length_citations))
 
-def get_citation_edge_weights():
-    global pmid_dict
-    global json_data
-
-    all_citations = []
-    # let's track the max # of citations
-    max_length_citations = 0
-    for key in pmid_dict.keys():
-        citations = pmid_dict[key]['citations']
-        if len(citations) > 1: # double check for length of number of citations
-            if len(citations) > max_length_citations:
-                # update length of max. # of citations
-                max_length_citations = len(citations)
-
-            # collect all citations in a lit
-            for citation in citations:
-                all_citations.append(int(citation))
-        elif len(citations) == 1:
-            all_citations.append(int(citations[0]))
-
-    citation_weights = dict()
-    
-    for idx in range(len(json_data['links'])):
-        cnt = 0 #TODO, maybe this should be 1? No PMIDS = 0 edgeweight right now
-
-        # get all pmids from original json file (edges have more than one pmids)
-        if json_data['links'][idx]['edgetype'].split(':')[1] != '':
-            pmids = json_data['links'][idx]['edgetype'].split(':')[1].split(',')
-
-            for pmid in pmids:
-                if pmid == '':
-                    continue
-                cnt += len(pmid_dict[pmid]['citations'])
-
-        # calculate edge weight based on # of citations normalized by max # of citations
-        w = cnt/(max_length_citations+1)
-        
-        t_str = json_data['nodes'][json_data['links'][idx]['source']]['name']+'-->'+json_data['nodes'][json_data['links'][idx]['target']]['name']
-        citation_weights[t_str] = w
-    
-    return citation_weights
-
-# Edge Weight Based on Paper Publication Date
-
-def get_publication_edge_weights():
-    global pmid_dict
-    global json_data
-
-    # Parse publication date as datetime (it should be added into the loop where we create pmid_dict to hold all information)
-    pmid_dict_year = dict()
-    for pmid in pmid_dict.keys():
-        if pmid_dict[pmid]['pub_date'] != '':
-            pmid_dict_year[pmid] = datetime.strptime(pmid_dict[pmid]['pub_date'],'%Y%m%d').year    
-        else:
-            pmid_dict_year[pmid] = -np.infty
-
-    # Calculate publication edge weight
-    edge_weights_from_pub_year = dict()
-    for idx in range(len(json_data['links'])):
-
-        # let's find the oldest publication in an edge for all given edge-pmids 
-        oldest_pub_year = -np.infty
-
-        if json_data['links'][idx]['edgetype'].split(':')[1] != '':
-            pmids = json_data['links'][idx]['edgetype'].split(':')[1].split(',')
-            for pmid in pmids:
-                if pmid == '':
-                    continue
-                if pmid_dict_year[pmid] > oldest_pub_year:
-                    oldest_pub_year = pmid_dict_year[pmid]
-
-            # calculate edge weight assume that mid and tau are 10 and 2, respectively 
-            w = (1-boltzman(2020-oldest_pub_year, 10, 3))/(1-boltzman(0, 10, 3))
-        else:
-            w = 0 # there is no pmids so this should be edge weight of 0
-        t_str = json_data['nodes'][json_data['links'][idx]['source']]['name']+'-->'+json_data['nodes'][json_data['links'][idx]['target']]['name']
-        edge_weights_from_pub_year[t_str] = w
-
-    return edge_weights_from_pub_year
-
-# Let create an edge weight based on fusing publication year and # of citations edge weights (equally weight)
-'''
-w = 0.5 * weight from pub_year + 0.5 * weight from # of citations
+    # Edge Weight Based on the Number of Distinct Papers Citing the Edge
+    '''
+    Unlike the citation weight, a paper citing several pmids of the edge is counted once
+    '''
+    def get_unique_citation_edge_weights(self):
+        stats = weight_engine.edge_stats(self.edge_index, weight_engine.pmid_arrays(self.edge_index, self.pmid_metadata()))
+        max_length_citations = weight_engine.max_citation_length(self.pmid_metadata())
+        return weight_engine.weights_dict(self.edge_index, weight_engine.unique_citation_weights(self.edge_index, stats, max_length_citations))
 
-it might be good idea to provide user adjustable weights
-'''
+    # Edge Weight Based on Paper Publication Date
+    def get_publication_edge_weights(self):
+        stats = weight_engine.edge_stats(self.edge_index, weight_engine.pmid_arrays(self.edge_index, self.pmid_metadata()))
+        return weight_engine.weights_dict(self.edge_index, weight_engine.publication_weights(self.edge_index, stats))
 
-def get_publication_citation_weights():
-    global pmid_dict
-    global json_data
+    # Let create an edge weight based on fusing publication year and # of citations edge weights (equally weight)
+    '''
+    w = 0.5 * weight from pub_year + 0.5 * weight from # of citations
 
-    # Parse publication date as datetime (it should be added into the loop where we create pmid_dict to hold all information)
-    pmid_dict_year = dict()
-    for pmid in pmid_dict.keys():
-        if pmid_dict[pmid]['pub_date'] != '':
-            pmid_dict_year[pmid] = datetime.strptime(pmid_dict[pmid]['pub_date'],'%Y%m%d').year    
-        else:
-            pmid_dict_year[pmid] = -np.infty
-    
+    it might be good idea to provide user adjustable weights
+    '''
+    def get_publication_citation_weights(self):
+        stats = weight_engine.edge_stats(self.edge_index, weight_engine.pmid_arrays(self.edge_index, self.pmid_metadata()))
+        return weight_engine.weights_dict(self.edge_index, weight_engine.publication_citation_weights(self.edge_index, stats))
 
-    edge_weights_from_pub_year_and_citation = dict()
-    for idx in range(len(json_data['links'])):
+    # Collect H-Index for all authors for a given subgraph
+    '''
+    known_h_indexes: h-indexes of a previous run (incremental mode), only the other authors are looked up
+    '''
+    def collect_author_h_indexes(self, known_h_indexes=None):
+        print('Loading all Authors into List...')
 
+        # authors of every pmid, in order and with repeats, as h_index_finder expects them
+        authors = self.pmid_meta.author_list()
 
-        if json_data['links'][idx]['edgetype'].split(':')[1] != '':
-            # find the oldest publication for a given edge
-            oldest_pub_year = -np.infty
+        if known_h_indexes is None:
+            print('Collecting H-Index for All Authors using h_index_finder.py')
 
+            return h_index_finder.find_h_index(self.email, authors, self.api_key, refresh_policy=self.refresh_policy)
 
-            pmids = json_data['links'][idx]['edgetype'].split(':')[1].split(',')
-            for pmid in pmids:
-                if pmid == '':
-                    continue
-                if pmid_dict_year[pmid] > oldest_pub_year:
-                    oldest_pub_year = pmid_dict_year[pmid]
+        new_authors = [author for author in authors if author not in known_h_indexes]
+        print(f'Collecting H-Index for {len(new_authors)} New Authors using h_index_finder.py')
 
-            # find # of citations for a given edge
-            cnt = 1
+        author_2_h_index = {author: known_h_indexes[author] for author in authors if author in known_h_indexes}
+        if len(new_authors) > 0:
+            author_2_h_index.update(h_index_finder.find_h_index(self.email, new_authors, self.api_key))
+        return author_2_h_index
 
+    # Let's create an edge weight based on h-index
+    '''
+    The idea is that the highest h-index will be used for edge-weight calculation.  
+    '''
+    def get_h_index_weights(self):
+        author_2_h_index = self.collect_author_h_indexes()
+        stats = weight_engine.edge_stats(self.edge_index, weight_engine.pmid_arrays(self.edge_index, self.pmid_metadata(), author_2_h_index))
+        return weight_engine.weights_dict(self.edge_index, weight_engine.h_index_weights(self.edge_index, stats))
 
-            pmids = json_data['links'][idx]['edgetype'].split(':')[1].split(',')
-            for pmid in pmids:
-                if pmid == '':
-                    continue
-                cnt += len(pmid_dict[pmid]['citations'])
+    # Get Original Edge weights
+    def get_original_edge_weights(self):
+        return weight_engine.weights_dict(self.edge_index, weight_engine.original_weights(self.edge_index))
 
-            # calculte edge weight
-            w = (1-boltzman(2020-oldest_pub_year, 10, 3))/(1-boltzman(0, 10, 3))*0.5+(1-boltzman(cnt, 15, 3))*0.5
-        else:
-            w = 0 # no pmids = edge of 0
-        t_str = json_data['nodes'][json_data['links'][idx]['source']]['name']+'-->'+json_data['nodes'][json_data['links'][idx]['target']]['name']
-        edge_weights_from_pub_year_and_citation[t_str] = w
+    # Boltzmann weights for grids of their parameters, from already collected metadata (no NCBI calls)
+    '''
+    grids: weight_engine.WEIGHT_PARAMETERS name -> list of values, e.g. year_mid=[5, 10, 15], alpha=[.25, .5, .75]
+    Uses the metadata in pmid_meta, or the compact metadata written by a previous run if pmid_meta is empty, and
+    the h-indexes of author_2_h_index, or of the previous run's state if None (no h-index weight without either).
 
-    return edge_weights_from_pub_year_and_citation
+    Returns the parameter combinations (weight_engine.parameter_grid) and a dictionary column -> array of
+    edges x combinations, with edges in the order of the json links (edge_id of {rel_name}_edges.arrow)
+    '''
+    def sweep_weights(self, author_2_h_index=None, **grids):
+        metadata = None
+        if len(self.pmid_meta) == 0:
+            metadata = PmidMetadata.load(f'{self.output_dir}/{self.rel_name}_pmid_meta')
+        if metadata is None:
+            metadata = self.pmid_metadata()
+
+        if author_2_h_index is None:
+            state = self.read_state()
+            if state is not None:
+                author_2_h_index = state['author_2_h_index']
+
+        params = weight_engine.parameter_grid(**grids)
+        stats = weight_engine.edge_stats(self.edge_index, weight_engine.pmid_arrays(self.edge_index, metadata, author_2_h_index))
+        return params, weight_engine.sweep_weights(self.edge_index, stats, params)
+
+    # Calculate nodes' positions with forceatlas
+    '''
+    Positions are cached in {output_dir}/layouts keyed by a hash of the edge set, so repeated runs and 
+    plot_subgraph.py reuse them instead of recomputing. Nodes are keyed by node id (as in the edge tables),
+    so nodes sharing a name get their own positions.
+    '''
+    def get_forceatlas2_layout(self, recompute=False):
+        index = self.edge_index
+        node_ids = np.asarray(index.node_ids, dtype=np.int64)
+        edges = zip(node_ids[index.edge_source].tolist(), node_ids[index.edge_target].tolist())
+        return graph_layout.get_layout(edges, f'{self.output_dir}/layouts', 'forceatlas2', recompute, node_key='id')
 
+    # Run all stages and dump the edge weights to {output_dir}/{rel_name}.csv
+    '''
+    incremental: reuse the state of the previous run over this subgraph ({rel_name}_state.json), so only
+    new pmids and authors are looked up and only edges with new or changed pmids are recomputed. The
+    output is the same as a full run. Falls back to a full run if there is no state or a refresh_policy is set.
 
-def get_h_index_weights(email):
-    global json_data
-    global pmid_dict
-    global id_2_category_dict
-    global id_2_name_dict
-    global api_key
+    Stage timings, NCBI calls and cache hits of the run are written to {rel_name}_metrics.json (see instrumentation.py)
+    '''
+    def calculate(self, layout=False, incremental=False):
+        with instrumentation.run(self.rel_name, f'{self.output_dir}/{self.rel_name}_metrics.json'):
+            return self._calculate(layout, incremental)
 
-    # Collect H-Index for all authors for a given subgraph
+    def _calculate(self, layout, incremental):
+        state = None
+        if incremental:
+            state = self.read_state()
+            if state is not None and self.refresh_policy is not None:
+                print('Refresh policy set, ignoring the state of the previous run')
+                state = None
+            print('No previous run, running a full calculation' if state is None else 'Updating the previous run')
 
-    print('Loading all Authors into List...')
+        # Collect required information from NCBI database
+        print('Collecting PMID Metadata from NCBI')
 
-    author_2_h_index = dict()
-    authors = list()
-    for key in tqdm(pmid_dict.keys()):
-        for item in pmid_dict[key]['authors']:
-            authors.append(item)
+        with instrumentation.stage('edge_weight.collect_NCBI'):
+            self.collect_NCBI()
 
+        # Collect H-Index for all authors (H-Index Weight)
+        print('-'*20)
+        print('Collecting Author H-Indexes...')
 
-    print('Collecting H-Index for All Authors using h_index_finder.py')
+        with instrumentation.stage('edge_weight.h_indexes'):
+            author_2_h_index = self.collect_author_h_indexes(None if state is None else state['author_2_h_index'])
 
-    temp_author_dict = h_index_finder.find_h_index(email, authors, api_key)
-    author_2_h_index.update(temp_author_dict)
+        # Node positions for plotting (optional, cached)
+        if layout:
+            print('-'*20)
+            print('Calculating ForceAtlas2 Layout...')
 
-    # Let's create an edge weight based on h-index
+            with instrumentation.stage('edge_weight.layout'):
+                self.get_forceatlas2_layout()
+
+        return self.write_edge_weights(author_2_h_index, state)
+
+    # Compute all weights from the collected metadata and dump them to {output_dir}/{rel_name}.csv
     '''
-    The idea is that the highest h-index will be used for edge-weight calculation.  
+    The same weights are written with one row per link, keyed by node ids, to {rel_name}_edges.arrow and
+    {rel_name}_nodes.arrow (see edge_tables.py).
+
+    With the state of a previous run, the raw statistics of edges whose pmids did not change are reused.
+    The normalizers (number of pmids, longest citation list) are always computed over the whole subgraph.
     '''
-    G_h_index = nx.Graph()
-    source = []
-    target = []
-    edge_weights_from_h_index = dict()
-    for idx in range(len(json_data['links'])):
-        # get source(s) and target(t) nodes
-        s = json_data['links'][idx]['source']
-        t = json_data['links'][idx]['target']
+    def write_edge_weights(self, author_2_h_index, state=None):
+        # Original, Boltzmann Citation, Publication Year, Publication Year and Citation and H-Index Weights
+        print('-'*20)
+        print('Calculating Edge Weights...')
+
+        with instrumentation.stage('edge_weight.edge_stats'):
+            if state is None:
+                stats = weight_engine.edge_stats(self.edge_index, weight_engine.pmid_arrays(self.edge_index, self.pmid_metadata(), author_2_h_index))
+            else:
+                stats = self.update_edge_stats(state, author_2_h_index)
+
+        with instrumentation.stage('edge_weight.weights'):
+            weights = weight_engine.weights_from_stats(self.edge_index, stats, weight_engine.max_citation_length(self.pmid_metadata()))
         
-        # create an edge
-        e = (s,t)
+        # Dump edge weights into CSV file
+        print('-'*20)
+        print('Dumping Edge Weights to CSV File...')
+
+        with instrumentation.stage('edge_weight.write_csv'):
+            df = weight_engine.weights_dataframe(self.edge_index, weights)
+            
+            df.to_csv(f'{self.output_dir}/{self.rel_name}.csv',index=False)
+
+        with instrumentation.stage('edge_weight.write_tables'):
+            category_names = None
+            if 'categories' in self.json_data:
+                category_names = [category['name'] for category in self.json_data['categories']]
+            edge_tables.write_edge_tables(self.edge_index, weights, self.output_dir, self.rel_name, category_names)
+
+        with instrumentation.stage('edge_weight.write_state'):
+            self.write_state(stats, author_2_h_index)
         
-        # add nodes into the graph
-        G_h_index.add_node(s,name = id_2_name_dict[s], 
-                        categories=id_2_category_dict[json_data['links'][idx]['source']])
-        G_h_index.add_node(t,name=id_2_name_dict[t], 
-                        categories=id_2_category_dict[json_data['links'][idx]['target']])
-        
-        max_h_index = -1
-        # find the highest h-index for a given edge
-        if json_data['links'][idx]['edgetype'].split(':')[1] != '':
-            pmids = json_data['links'][idx]['edgetype'].split(':')[1].split(',')
-            for pmid in pmids:
-                if pmid == '':
-                    continue
-                authors = pmid_dict[pmid]['authors']
-                max_h_index = -1
-                for author in authors:
-                    if author_2_h_index[author] > max_h_index:
-                        max_h_index = author_2_h_index[author]
-                        
-            # calculte edge weight by mapping maximum h-index to Boltzmann function
-            w = boltzman(max_h_index,20,2)
-        else:
-            w = 0 # no pmids = edgeweight of 0
-        
-        t_str = json_data['nodes'][json_data['links'][idx]['source']]['name']+'-->'+json_data['nodes'][json_data['links'][idx]['target']]['name']
-        edge_weights_from_h_index[t_str] = w
+        return df
+
+    # Incremental State
+    '''
+    {rel_name}_state.json holds what a later run needs to update this one:
+    pmids: fingerprint of the metadata of every pmid (PmidMetadata.fingerprint, None if NCBI had no record)
+    edge_stats: raw statistics (weight_engine.edge_stats) keyed by the pmid list of the edge (SubgraphIndex.edge_pmid_keys)
+    author_2_h_index: h-indexes of all authors
+    '''
 
-        # create an edge
-        G_h_index.add_edge(*e,value=w)
-        source.append(s)
-        target.append(t)
+    def read_state(self):
+        path = f'{self.output_dir}/{self.rel_name}_state.json'
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            state = json.load(f)
+        if state.get('version') != STATE_VERSION:
+            return None
+        return state
+
+    def pmid_fingerprint(self, pmid):
+        if pmid not in self.pmid_meta:
+            return None
+        return self.pmid_meta.fingerprint(pmid)
+
+    def write_state(self, stats, author_2_h_index):
+        edge_stats = dict()
+        for i, pmid_key in enumerate(self.edge_index.edge_pmid_keys()):
+            edge_stats[pmid_key] = [float(stats[column][i]) for column in STATE_STATS]
+
+        state = {
+            'version': STATE_VERSION,
+            'pmids': {pmid: self.pmid_fingerprint(pmid) for pmid in self.edge_index.pmids},
+            'edge_stats': edge_stats,
+            'author_2_h_index': author_2_h_index,
+        }
+
+        path = f'{self.output_dir}/{self.rel_name}_state.json'
+        with open(f'{path}.tmp', 'w') as output:
+            output.write(json.dumps(state))
+        os.replace(f'{path}.tmp', path)
+
+    # Raw edge statistics, recomputed only for edges with a new pmid list or with new or changed pmids
+    def update_edge_stats(self, state, author_2_h_index):
+        index = self.edge_index
+        changed = np.array([state['pmids'].get(pmid, '') != self.pmid_fingerprint(pmid) for pmid in index.pmids], dtype=bool)
+        edge_changed = index.segment_max(changed.astype(np.float64), 0.) > 0
+
+        previous = state['edge_stats']
+        affected = []
+        stats = {column: np.empty(index.n_edges) for column in STATE_STATS}
+        for i, pmid_key in enumerate(index.edge_pmid_keys()):
+            if pmid_key not in previous or edge_changed[i]:
+                affected.append(i)
+            if pmid_key in previous:
+                for column, value in zip(STATE_STATS, previous[pmid_key]):
+                    stats[column][i] = value
+
+        print(f'{int(changed.sum())} new or changed PMIDs, recomputing {len(affected)} of {index.n_edges} edges')
+
+        if len(affected) > 0:
+            sub_index = self.edge_index.subset(affected)
+            sub_stats = weight_engine.edge_stats(sub_index, weight_engine.pmid_arrays(sub_index, self.pmid_metadata(), author_2_h_index))
+            for column in STATE_STATS:
+                stats[column][affected] = sub_stats[column]
+
+        return stats
+
+
+# Version of the {rel_name}_state.json layout, states of other versions are ignored
+STATE_VERSION = 4
+
+# weight_engine.edge_stats columns kept in the state
+STATE_STATS = ('citation_sum', 'unique_citers', 'newest_year', 'last_max_h_index')
+
+
+# Collect metadata for a list of pmids, from the PMID store if possible and otherwise from NCBI
+'''
+Found and fetched entries are added to pmid_dict (a new dictionary if None), which is returned. pmid_dict can also be
+a pmid_metadata.PmidMetadataBuilder, which converts the entries to compact form batch by batch.
+Fetched entries are also appended to journal (a PmidJournal) batch by batch, if given.
+With a refresh_policy, pmids that are stale in the store are fetched again even if pmid_dict has them.
+stale_pmids can be given when the caller already computed them (e.g. over more pmids than it fetches),
+so staleness is decided once per run. Staleness is only tracked by the store, so a refresh_policy without
+a pmid_store raises a ValueError.
+
+Uses of the pmids are not counted here (see PmidStore.count_uses), callers count every pmid they read.
+'''
+def collect_pmid_metadata(pmids, email, api_key=None, pmid_store=None, batch_size=200, pmid_dict=None, journal=None,
+                          refresh_policy=None, stale_pmids=None):
+    if refresh_policy is not None and pmid_store is None:
+        raise ValueError('A refresh_policy needs a PMID store (store_path=None only keeps per-subgraph metadata, '
+                         'which has no fetch times)')
+
+    if pmid_dict is None:
+        pmid_dict = dict()
+
+    # Metadata collected by runs over any subgraph
+    if pmid_store is not None:
+        if stale_pmids is None:
+            stale_pmids = set()
+            if refresh_policy is not None:
+                stale_pmids = pmid_store.stale(refresh_policy, pmids)
+                print(f'Refreshing {len(stale_pmids)} stale PMIDs ({refresh_policy})')
+        for pmid in stale_pmids:
+            pmid_dict.pop(pmid, None)
+        pmid_dict.update(pmid_store.get_many([pmid for pmid in pmids if pmid not in pmid_dict and pmid not in stale_pmids]))
+
+    missing_pmids = [pmid for pmid in pmids if pmid not in pmid_dict]
+    print(f'{len(pmids) - len(missing_pmids)} PMIDs found in cache, fetching {len(missing_pmids)} from NCBI')
+
+    with instrumentation.stage('edge_weight.fetch_pmids'):
+        run_sync(fetch_pmid_batches(missing_pmids, email, api_key, pmid_store, batch_size, pmid_dict, journal=journal))
+
+    return pmid_dict
 
-    # edge_weights_from_h_index = pd.DataFrame({'source':source,'target':target})
-    G_h_index.number_of_nodes(),G_h_index.number_of_edges()
+# Fetch pmids in batches with several batches in flight, NCBI rate limit is enforced by EutilsClient
+async def fetch_pmid_batches(pmids, email, api_key, pmid_store, batch_size, pmid_dict, max_in_flight=10, journal=None):
+    async with EutilsClient(email, api_key, max_in_flight=max_in_flight) as client:
+        tasks = [asyncio.ensure_future(fetch_pmid_batch(client, pmids[start:start + batch_size]))
+                 for start in range(0, len(pmids), batch_size)]
+
+        try:
+            for task in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+                batch_dict = await task
+
+                # store the batch right away so an interrupted run keeps what was fetched
+                pmid_dict.update(batch_dict)
+                if pmid_store is not None:
+                    pmid_store.put_many(batch_dict)
+                if journal is not None:
+                    journal.append(batch_dict)
+        finally:
+            # if a batch failed, stop the others (the next run resumes from what was stored)
+            for task in tasks:
+                task.cancel()
+
+# Fetch one batch: one efetch for the pmids of the batch, then one for their pmcids and one elink for citations
+async def fetch_pmid_batch(client, batch):
+    # get records for all pmids in the batch
+    records1 = await fetch_medline_records(client, batch)
+
+    # let's get pmcid if exists
+    pmcids = dict()
+    for pmid in batch:
+        if pmid in records1 and 'PMC' in records1[pmid]:
+            pmcids[pmid] = records1[pmid]['PMC'][3:]
+
+    # get records for all pmcids and all pmids citing the pmids in the batch
+    records2, citations = await asyncio.gather(
+        fetch_medline_records(client, list(pmcids.values())),
+        get_links_ids(client, [pmid for pmid in batch if pmid in records1]))
+
+    batch_dict = dict()
+    for pmid in batch:
+        # NCBI returned no record for this pmid
+        if pmid not in records1:
+            continue
+
+        record2 = None
+        if pmid in pmcids:
+            record2 = records2.get(pmcids[pmid])
+
+        batch_dict[pmid] = build_pmid_entry(records1[pmid], record2, citations.get(pmid))
+
+    return batch_dict
+
+# Fetch medline records for a list of ids with a single efetch call
+'''
+NCBI returns all records in one multi-record Medline stream, so route each record back 
+to the id it was requested with using its PMID field
+'''
+async def fetch_medline_records(client, ids):
+    records = dict()
+    if len(ids) == 0:
+        return records
 
-    return edge_weights_from_h_index
+    data = await client.efetch(db="pubmed", id=[str(i) for i in ids], rettype="medline", retmode="text")
+    for record in eutils_parse.parse_medline(data, eutils_parse.PMID_RECORD_KEYS):
+        if 'PMID' in record:
+            records[record['PMID']] = record
 
-def get_original_edge_weights():
-    global json_data
-    global id_2_category_dict
-    global id_2_name_dict
+    return records
 
-    # Get Original Edge weights
-    G = nx.Graph()
-
-    # extract source nodes, target nodes, and edges from json data
-    source = []
-    target = []
-    edge_weights_from_original = dict()
-    for idx in range(len(json_data['links'])):
-        s = json_data['links'][idx]['source']
-        t = json_data['links'][idx]['target']
-        e = (s,t)
-        G.add_node(s,name = id_2_name_dict[s], categories=id_2_category_dict[json_data['links'][idx]['source']])
-        G.add_node(t,name=id_2_name_dict[t], categories=id_2_category_dict[json_data['links'][idx]['target']])
-        w = 0
-        if json_data['links'][idx]['edgetype'].split(':')[1] != '':
-            w = len(json_data['links'][idx]['edgetype'].split(':')[1].split(','))/len(all_pmids)
-        t_str = json_data['nodes'][json_data['links'][idx]['source']]['name']+'-->'+json_data['nodes'][json_data['links'][idx]['target']]['name']
-        edge_weights_from_original[t_str] = w
-        G.add_edge(*e,value=w)
-        source.append(s)
-        target.append(t)
-    edges = pd.DataFrame({'source':source,'target':target})
-    G.number_of_nodes(),G.number_of_edges()
-
-    # initiate forceatlas algorithm to calculate node positions
-    forceatlas2 = ForceAtlas2(
-                            # Behavior alternatives
-                            outboundAttractionDistribution=True,  # Dissuade hubs
-                            linLogMode=False,  # NOT IMPLEMENTED
-                            adjustSizes=False,  # Prevent overlap (NOT IMPLEMENTED)
-                            edgeWeightInfluence=10.0,
-
-                            # Performance
-                            jitterTolerance=10.0,  # Tolerance
-                            barnesHutOptimize=True,
-                            barnesHutTheta=1.2,
-                            multiThreaded=False,  # NOT IMPLEMENTED
-
-                            # Tuning
-                            scalingRatio=15.0,
-                            strongGravityMode=False,
-                            gravity=50,
-
-                            # Log
-                            verbose=True)
-
-    # calculate nodes' positions
-    positions = forceatlas2.forceatlas2_networkx_layout(G, pos=None, iterations=10000)
-
-    # let's plot the same graph via holoviews
-    '''
-    click on nodes to see the details
-    '''
-    hv.Graph.from_networkx(G,positions,kwargs={'weight':'weight'}).opts(directed=True,node_size=10,arrowhead_length=0.009,tools=['hover']).options(color_index='categories', cmap='Category10')
+# Build the pmid_dict entry of a pmid from its pubmed record (record1) and its pmcid record (record2)
+'''
+Collect following information: authors, authors' affiliations, publication date, citations, grants
 
-    # return original edge weights
-    return edge_weights_from_original
+citations is the list of citing pmids from get_links_ids, or None if there are none.
+If the pmcid record is missing or incomplete, fall back to the pubmed record
+'''
+def build_pmid_entry(record1, record2=None, citations=None):
+    # try except check to be sure that NCBI is not returning empty result
+    if record2 is not None and citations is not None:
+        try:
+            authors = record2['FAU']
+            affiliations = record2['AD']
+            pub_date = record2['DCOM']
+            grants = record2['GR']
+            return {'pmcid_number':record1['PMC'][3:],'pmcid':True,'authors':authors,'affiliations':affiliations,'grants':grants,'pub_date':pub_date,'citations':citations}
+        except:
+            pass
+
+    authors = record1.get('FAU', [])
+    try:
+        affiliations = record1['AD']
+    except:
+        affiliations = ''
+    try:
+        pub_date = record1['DCOM']
+    except:
+        pub_date = ''
+    if citations is None:
+        citations = ''
+    try:
+        grants = record1['GR']
+    except:
+        grants = ''
+    return {'pmcid_number':'','pmcid':False,'authors':authors,'affiliations':affiliations,'grants':grants,'pub_date':pub_date,'citations':citations}
+
+# Let's get citations from pmids
+'''
+This function gets all pmids citing each of the given pmids
 
+elink returns one LinkSet per id when ids are passed as a list, so many pmids can be resolved 
+with one call. pmids are sent in chunks that stay under max_ids ids and max_chars characters of 
+encoded "&id=" parameters so requests stay within NCBI's URL/POST limits.
 
+Returns a dictionary pmid -> list of citing pmids, pmids without any citation are left out
+'''
+async def get_links_ids(client, pmids, max_ids=200, max_chars=4000):
+    link_dict = dict()
+
+    chunks = list(chunk_ids(pmids, max_ids, max_chars))
+    results = await asyncio.gather(*[client.elink(dbfrom="pubmed", id=chunk, linkname="pubmed_pmc_refs", retmode="json") for chunk in chunks])
+
+    for data in results:
+        for link_set in eutils_parse.elink_linksets(data):
+            if len(link_set['ids']) == 0 or link_set['links'] is None:
+                continue
+            link_dict[link_set['ids'][0]] = link_set['links']
+
+    return link_dict
+
+# Split ids into chunks bounded by number of ids and by length of the encoded id parameters
+def chunk_ids(ids, max_ids, max_chars):
+    chunk = []
+    chunk_chars = 0
+    for i in ids:
+        i = str(i)
+        id_chars = len(i) + 4 # "&id="
+        if len(chunk) > 0 and (len(chunk) >= max_ids or chunk_chars + id_chars > max_chars):
+            yield chunk
+            chunk = []
+            chunk_chars = 0
+        chunk.append(i)
+        chunk_chars += id_chars
+    if len(chunk) > 0:
+        yield chunk
 
 
 # START HERE
@@ -440,110 +636,62 @@ Args:
 sub_graph_json: a json object already read in from a file
 email: a valid email for api calls
 json_name: name of json file or relationship
+apikey: optional NCBI api key
+store_path: path to the PMID metadata store shared by all subgraphs (None to disable)
+layout: also compute (or load from cache) ForceAtlas2 node positions for plot_subgraph.py
+refresh_policy: optional RefreshPolicy, stale PMID metadata and h-indexes are fetched again
+incremental: update the previous run over this subgraph, only new pmids, authors and edges are processed
 
 Returns:
 dataframe: dataframe containing each relationship and the various edge weights
-Also creates a csv from the dataframe save to a folder called {json_name}
+Also creates a csv from the dataframe save to a folder called {json_name}, and a json report of the run
+({json_name}_metrics.json: stage timings, NCBI calls, retries, cache hits, peak memory)
 '''
 
-def calculate_edge_weights(sub_graph_json, email, json_name, apikey=None):
-    global id_2_name_dict
-    global id_2_category_dict
-    global all_pmids
-    global json_data
-    global pmid_dict
-    global rel_name
-    global api_key
-
-    rel_name = json_name
-    api_key = apikey
-
-    id_2_name_dict = dict()
-    id_2_category_dict = dict()
-    all_pmids = []
-    json_data = dict()
-    pmid_dict = dict()
-
-
-    json_data = json.loads(sub_graph_json)
-    Entrez.email = email
-
-    if not (os.path.exists(f'./{rel_name}')):
-        os.mkdir(f'./{rel_name}')
-    
-    # Book-Keeping of Node Attributes
-
-    for idx in range(len(json_data['nodes'])):
-        id_2_name_dict[json_data['nodes'][idx]['id']] = json_data['nodes'][idx]['name']
-        id_2_category_dict[json_data['nodes'][idx]['id']] = json_data['nodes'][idx]['category']
-
-    # List all pmids from json file
-
-
-    print('Creating a List of All PMIDS in Subgraph')
-
-    for idx1 in range(len(json_data['links'])):
-        if json_data['links'][idx1]['edgetype'].split(':')[1] != '':
-            pmids = json_data['links'][idx1]['edgetype'].split(':')[1].split(',')
-            for idx2 in range(len(pmids)):
-                pmid = pmids[idx2]
-                if pmid not in all_pmids and (len(pmid) > 1):
-                    all_pmids.append(pmid)
-
-    
-    # Collect required information from NCBI database
-
-    print('Collecting PMID Metadata from NCBI')
-
-    collect_NCBI()
-
-    # Edge weight based on original calculation
-    print('-'*20)
-    print('Calculating Original Edge Weights...')
-
-    edge_weight_original = get_original_edge_weights()
-
-    # Edge weight based on # of citations (Boltzmann Citation Weight)
-    print('-'*20) 
-    print('Calculating Citation Edge Weights...')
-
-    edge_weight_citations = get_citation_edge_weights()
-    
-    # Edge weight based on paper publication date (Publication Year Weight)
-    print('-'*20)
-    print('Calculating Publication-Data Edge Weights...')
-
-    edge_weight_publications = get_publication_edge_weights()
-    
-    # Combine above methods (Publication Year and Citation Weight)
-    print('-'*20)
-    print('Calculating Combo Citation/Publication Edge Weights...')
-
-    edge_weight_citation_and_pub = get_publication_citation_weights()
-    
-    # Edge weight based on h-index of author (H-Index Weight)
-    print('-'*20)
-    print('Calculating Author H-Index Edge Weights...')
-
-    edge_weight_h_index = get_h_index_weights(email)
-    
-    # Dump edge weights into CSV file
-    print('-'*20)
-    print('Dumping Edge Weights to CSV File...')
-
-    keys = edge_weight_citation_and_pub.keys()
-    edge,w_original, w_citation,w_pub_year,w_citation_pub_year,w_h_index = [],[],[],[],[],[]
-    for key in keys:
-        edge.append(key)
-        w_original.append(float(edge_weight_original[key]))
-        w_citation.append(float(edge_weight_citations[key]))
-        w_pub_year.append(float(edge_weight_publications[key]))
-        w_citation_pub_year.append(float(edge_weight_citation_and_pub[key]))
-        w_h_index.append(float(edge_weight_h_index[key]))
-    
-    df = pd.DataFrame({'Edge':edge, 'Original_Weight':w_original, 'Boltzmann_Citation_Weight':w_citation,
-                   'Publication_Year_Weight':w_pub_year,'Publication_Year_and_Citation_Weight':w_citation_pub_year, 'H_Index_Weight': w_h_index})
-    
-    df.to_csv(f'./{rel_name}/{rel_name}.csv',index=False)
-    
-    return df
+def calculate_edge_weights(sub_graph_json, email, json_name, apikey=None, store_path=DEFAULT_STORE_PATH, layout=False,
+                           refresh_policy=None, incremental=False):
+    pmid_store = None
+    if store_path is not None:
+        pmid_store = PmidStore(store_path)
+
+    try:
+        calculator = EdgeWeightCalculator(sub_graph_json, email, json_name, apikey, pmid_store, refresh_policy=refresh_policy)
+        return calculator.calculate(layout, incremental)
+    finally:
+        if pmid_store is not None:
+            pmid_store.close()
+
+
+# Same as calculate_edge_weights, for a subgraph json file that is streamed instead of read as a whole
+'''
+The links are parsed one at a time into the subgraph index, so peak memory is bounded by the index rather
+than by the size of the json. json_name defaults to the file name without extension.
+'''
+def calculate_edge_weights_from_file(json_path, email, json_name=None, apikey=None, store_path=DEFAULT_STORE_PATH, layout=False,
+                                     refresh_policy=None, incremental=False):
+    pmid_store = None
+    if store_path is not None:
+        pmid_store = PmidStore(store_path)
+
+    try:
+        calculator = EdgeWeightCalculator.from_json_file(json_path, email, json_name, apikey, pmid_store, refresh_policy=refresh_policy)
+        return calculator.calculate(layout, incremental)
+    finally:
+        if pmid_store is not None:
+            pmid_store.close()
+
+
+# Fetch again every stale entry of the PMID metadata store, in bulk
+'''
+Returns the number of refreshed pmids
+'''
+def refresh_pmid_store(email, refresh_policy, apikey=None, store_path=DEFAULT_STORE_PATH, batch_size=200):
+    pmid_store = PmidStore(store_path)
+    try:
+        stale_pmids = sorted(pmid_store.stale(refresh_policy))
+        print(f'Refreshing {len(stale_pmids)} stale PMIDs in {store_path}')
+        collect_pmid_metadata(stale_pmids, email, apikey, pmid_store, batch_size, refresh_policy=refresh_policy,
+                              stale_pmids=set(stale_pmids))
+    finally:
+        pmid_store.close()
+    return len(stale_pmids)
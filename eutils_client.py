@@ -0,0 +1,191 @@
+#Copyright (C) Systems & Technology Research
+#Use of this software is subject to the restrictions in license.txt
+#Distribution A: Approved for Public Release, Distribution Unlimited
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import aiohttp
+
+import instrumentation
+
+
+EUTILS_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+TOOL = 'biopython'
+
+# NCBI allows 3 requests per second without an api key and 10 with one
+RATE_WITHOUT_KEY = 3
+RATE_WITH_KEY = 10
+
+# NCBI asks for POST once the encoded parameters get longer than this
+MAX_GET_CHARS = 1000
+
+
+# Token bucket shared by every caller in the process
+'''
+Tokens refill at `rate` per second up to `capacity`. A caller reserves a token under a thread lock
+and then sleeps until its slot comes up, so the same bucket can be used from several threads and
+event loops at once while the total request rate stays under the NCBI limit.
+
+The default capacity of 1 spaces requests 1/rate seconds apart. A larger capacity allows bursts of
+`capacity` requests (starting with a full bucket), which can exceed the NCBI limit within one second.
+'''
+class TokenBucket:
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Take a token and return how many seconds to wait before using it
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.
+            return -self.tokens / self.rate
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            instrumentation.count('rate_limit_sleep_seconds', 'eutils', delay)
+            await asyncio.sleep(delay)
+
+
+_rate_limiters = dict()
+_rate_limiters_lock = threading.Lock()
+
+# One bucket per kind of access (with or without api key), shared by all clients
+def get_rate_limiter(api_key=None):
+    rate = RATE_WITH_KEY if api_key else RATE_WITHOUT_KEY
+    with _rate_limiters_lock:
+        if rate not in _rate_limiters:
+            _rate_limiters[rate] = TokenBucket(rate)
+        return _rate_limiters[rate]
+
+
+class RetryableError(Exception):
+    pass
+
+
+# asyncio E-utilities client
+'''
+Keeps one pooled keep-alive HTTP session, lets up to max_in_flight requests run at the same time
+and draws every request from the shared token bucket. A request takes its in-flight slot before its
+token, so the token is spent when the request is actually sent and never while it waits for a connection. Failed requests (network errors, 429, 5xx)
+are retried with exponential backoff.
+
+Every attempt is counted in the current instrumentation run (api_calls, api_seconds, api_bytes by
+E-utility), as are retries and the time slept before them (api_retries, retry_sleep_seconds).
+
+Usage:
+    async with EutilsClient(email, api_key) as client:
+        data = await client.esearch(db='pubmed', term='...')
+
+Sync code can run a coroutine that uses the client with run_sync(...)
+'''
+class EutilsClient:
+
+    def __init__(self, email, api_key=None, tool=TOOL, max_in_flight=10, max_tries=6,
+                 backoff=2., max_backoff=120., timeout=120.):
+        self.email = email
+        self.api_key = api_key
+        self.tool = tool
+        self.max_in_flight = max_in_flight
+        self.max_tries = max_tries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.rate_limiter = get_rate_limiter(api_key)
+        self.session = None
+        self.in_flight = None
+
+    async def __aenter__(self):
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+
+    # Send a request to an E-utility (e.g. 'efetch') and return the raw response body
+    '''
+    params is a dict; list values (e.g. several ids) are sent as repeated parameters unless
+    join_ids is True, in which case an id list is sent comma separated as one parameter
+    '''
+    async def request(self, utility, params, join_ids=True):
+        params = dict(params)
+        if join_ids and isinstance(params.get('id'), (list, tuple)):
+            params['id'] = ','.join(str(i) for i in params['id'])
+        params['tool'] = self.tool
+        if self.email:
+            params['email'] = self.email
+        if self.api_key:
+            params['api_key'] = self.api_key
+
+        url = f'{EUTILS_URL}{utility}.fcgi'
+        body = urlencode(params, doseq=True)
+
+        for attempt in range(self.max_tries):
+            try:
+                async with self.in_flight:
+                    await self.rate_limiter.acquire()
+                    instrumentation.count('api_calls', utility)
+                    start = time.perf_counter()
+                    if len(body) > MAX_GET_CHARS:
+                        response = await self.session.post(url, data=body,
+                                                           headers={'Content-Type': 'application/x-www-form-urlencoded'})
+                    else:
+                        response = await self.session.get(f'{url}?{body}')
+                    async with response:
+                        if response.status == 429 or response.status >= 500:
+                            raise RetryableError(f'{utility} returned HTTP {response.status}')
+                        response.raise_for_status()
+                        data = await response.read()
+                instrumentation.count('api_seconds', utility, time.perf_counter() - start)
+                instrumentation.count('api_bytes', utility, len(data))
+                return data
+            except (RetryableError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                instrumentation.count('api_seconds', utility, time.perf_counter() - start)
+                if attempt == self.max_tries - 1:
+                    raise
+                delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+                instrumentation.count('api_retries', utility)
+                instrumentation.count('retry_sleep_seconds', utility, delay)
+                print(f'Error calling {utility} ({e})... Waiting {delay:.0f} seconds before re-trying')
+                await asyncio.sleep(delay)
+
+    async def esearch(self, **params):
+        return await self.request('esearch', params)
+
+    async def efetch(self, **params):
+        return await self.request('efetch', params)
+
+    # elink returns one LinkSet per id only when ids are sent as repeated parameters
+    async def elink(self, **params):
+        return await self.request('elink', params, join_ids=False)
+
+
+# Run a coroutine from sync code, also when called from inside a running event loop (e.g. a notebook)
+'''
+The coroutine runs in the caller's context, so it records into the caller's instrumentation run
+'''
+def run_sync(coro):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(contextvars.copy_context().run, asyncio.run, coro).result()
@@ -0,0 +1,164 @@
+#Copyright (C) Systems & Technology Research
+#Use of this software is subject to the restrictions in license.txt
+#Distribution A: Approved for Public Release, Distribution Unlimited
+import io
+import json
+import xml.etree.ElementTree as ET
+
+
+# Parsing of NCBI E-utilities responses
+'''
+One parsing layer for edge_weight.py and h_index_finder.py:
+esearch and elink are requested with retmode=json where NCBI offers it and parsed with json,
+XML responses (elink with cmd=neighbor_score, or any response without retmode=json) are parsed with a
+streaming ElementTree parser, and efetch Medline text is parsed with a line parser that only keeps the
+fields it is asked for.
+
+Parsers accept the raw response bytes and detect JSON vs XML from the first character.
+
+Benchmarks against Bio.Medline / Bio.Entrez / BeautifulSoup: benchmarks/bench_eutils_parse.py
+'''
+
+
+# Medline fields whose lines are joined into one string (same as Bio.Medline)
+MEDLINE_TEXT_KEYS = frozenset(['ID', 'PMID', 'SO', 'RF', 'NI', 'JC', 'TA', 'IS', 'CY', 'TT', 'CA', 'IP', 'VI', 'DP',
+                               'YR', 'PG', 'LID', 'DA', 'LR', 'OWN', 'STAT', 'DCOM', 'PUBM', 'DEP', 'PL', 'JID', 'SB',
+                               'PMC', 'EDAT', 'MHDA', 'PST', 'AB', 'EA', 'TI', 'JT'])
+
+# Medline fields whose continuation lines extend the last entry instead of adding one (same as Bio.Medline)
+MEDLINE_APPEND_KEYS = frozenset(['MH', 'AD'])
+
+# Medline fields used by edge_weight.py
+PMID_RECORD_KEYS = ('PMID', 'PMC', 'FAU', 'AD', 'DCOM', 'GR')
+
+
+def _is_json(data):
+    return data.lstrip()[:1] in (b'{', '{')
+
+
+def _xml_stream(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return io.BytesIO(data)
+
+
+# Records of a multi-record Medline text response
+'''
+Yields one dictionary per record with the same values as Bio.Medline.parse. With keys, only those
+fields are kept (PMID is always kept so records can be routed back to their ids), which skips the
+abstract, MeSH terms, etc. of every record.
+'''
+def parse_medline(data, keys=None):
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    if keys is not None:
+        keys = frozenset(keys) | {'PMID'}
+
+    key = ''
+    values = None
+    record = dict()
+    for line in data.split('\n'):
+        if line[:6] == '      ': # continuation line
+            if values is None:
+                continue
+            line = line.rstrip()
+            if line == '':
+                # blank continuation lines are new lines (as in Bio.Medline)
+                line = '      \n'
+            if key in MEDLINE_APPEND_KEYS:
+                values[-1] += line[5:]
+            else:
+                values.append(line[6:])
+        elif line != '' and line != '\r':
+            line = line.rstrip()
+            key = line[:4].rstrip()
+            if keys is not None and key not in keys:
+                values = None
+                continue
+            values = record.get(key)
+            if values is None:
+                values = record[key] = []
+            values.append(line[6:])
+        elif record:
+            # End of the record
+            yield _join_text_keys(record)
+            record = dict()
+            values = None
+    if record:
+        yield _join_text_keys(record)
+
+
+def _join_text_keys(record):
+    for key in record:
+        if key in MEDLINE_TEXT_KEYS:
+            record[key] = ' '.join(record[key])
+    return record
+
+
+# Ids of an esearch response, in order
+def esearch_ids(data):
+    if _is_json(data):
+        return list(json.loads(data).get('esearchresult', {}).get('idlist', []))
+
+    ids = []
+    for _, element in ET.iterparse(_xml_stream(data)):
+        if element.tag == 'Id':
+            ids.append(element.text)
+    return ids
+
+
+# Link sets of an elink response
+'''
+Returns one dictionary per LinkSet with
+ids: the ids the links were requested for
+links: ids of the first LinkSetDb (None if there is no LinkSetDb)
+scores: scores of those links (cmd=neighbor_score XML only, otherwise empty)
+
+Raises RuntimeError if NCBI returned an error instead of link sets (as Bio.Entrez.read does)
+'''
+def elink_linksets(data):
+    if _is_json(data):
+        result = json.loads(data)
+        if 'ERROR' in result:
+            raise RuntimeError(result['ERROR'])
+
+        link_sets = []
+        for link_set in result.get('linksets', []):
+            link_set_dbs = link_set.get('linksetdbs', [])
+            links = None
+            if len(link_set_dbs) > 0:
+                links = [str(link) for link in link_set_dbs[0].get('links', [])]
+            link_sets.append({'ids': [str(i) for i in link_set.get('ids', [])], 'links': links, 'scores': []})
+        return link_sets
+
+    link_sets = []
+    link_set = None
+    n_link_set_dbs = 0
+    path = []
+    for event, element in ET.iterparse(_xml_stream(data), events=('start', 'end')):
+        if event == 'start':
+            path.append(element.tag)
+            if element.tag == 'LinkSet':
+                link_set = {'ids': [], 'links': None, 'scores': []}
+                n_link_set_dbs = 0
+            elif element.tag == 'LinkSetDb':
+                n_link_set_dbs += 1
+                if n_link_set_dbs == 1:
+                    link_set['links'] = []
+            continue
+
+        path.pop()
+        parent = path[-1] if len(path) > 0 else None
+        if element.tag == 'Id' and parent == 'IdList':
+            link_set['ids'].append(element.text)
+        elif n_link_set_dbs == 1 and parent == 'Link':
+            if element.tag == 'Id':
+                link_set['links'].append(element.text)
+            elif element.tag == 'Score':
+                link_set['scores'].append(element.text)
+        elif element.tag == 'LinkSet':
+            link_sets.append(link_set)
+            element.clear()
+        elif element.tag == 'ERROR' and parent == 'eLinkResult':
+            raise RuntimeError(element.text)
+    return link_sets
@@ -3,199 +3,431 @@
 #Distribution A: Approved for Public Release, Distribution Unlimited
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import contextlib
 import json
+import multiprocessing
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 
+import instrumentation
+import subgraph_stream
+
+
+# BLENDER Knowledge Graph tables
 '''
-Takes in a list of json file paths and converts jsons to contain pmids for each relationship
-Highly recommended that if you are planning to convert many json files, only call this function once, 
-because it takes extra time to load each of the csvs to dataframes at the beginning
+Entity tables: category -> (csv file, name column, id column)
+Relation tables: (category a, category b) -> csv file with columns {a}ID, {b}ID and pmids ("|" separated)
+'''
+ENTITY_TABLES = {
+    'Chemical': ('chemicals.csv', 'ChemicalName', 'ChemicalID'),
+    'Disease': ('diseases.csv', 'DiseaseName', 'DiseaseID'),
+    'Gene': ('genes.csv', 'GeneName', 'GeneID'),
+}
 
-Creates new files using {json_path}_with_pmids.json naming
+RELATION_TABLES = {
+    ('Chemical', 'Gene'): 'chem_gene_ixns_relation.csv',
+    ('Chemical', 'Disease'): 'chemicals_diseases_relation.csv',
+    ('Gene', 'Disease'): 'genes_diseases_relation.csv',
+}
+
+
+# Lookup index over the BLENDER Knowledge Graph
+'''
+name_to_id: category -> {entity name: entity id} (first id listed for a name)
+relations: (category a, category b) -> {(id a, id b): "|" separated pmids of all matching rows}
+
+Every link is then answered with two name lookups and one pair lookup, for any pair of categories
+listed in RELATION_TABLES (in either direction)
 '''
-def get_pmids(json_path_list, knowledge_graph_folder_path):
-    
+class KGIndex:
+
+    def __init__(self, entity_dfs, relation_dfs):
+        self.name_to_id = dict()
+        for category, df in entity_dfs.items():
+            _, name_column, id_column = ENTITY_TABLES[category]
+            df = df.drop_duplicates(name_column)
+            self.name_to_id[category] = dict(zip(df[name_column], df[id_column]))
+
+        self.relations = dict()
+        for (category_a, category_b), df in relation_dfs.items():
+            df = df.dropna(subset=['pmids'])
+            grouped = df['pmids'].astype(str).groupby([df[f'{category_a}ID'], df[f'{category_b}ID']], sort=False).agg('|'.join)
+            self.relations[(category_a, category_b)] = dict(zip(grouped.index, grouped.values))
+
+    # pmids of the relation between two entities, None if the categories are not related in the KG
+    def lookup_pmids(self, src_category, src_name, trg_category, trg_name):
+        if (src_category, trg_category) in self.relations:
+            pair = (src_category, trg_category)
+            key = (self.name_to_id[src_category][src_name], self.name_to_id[trg_category][trg_name])
+        elif (trg_category, src_category) in self.relations:
+            pair = (trg_category, src_category)
+            key = (self.name_to_id[trg_category][trg_name], self.name_to_id[src_category][src_name])
+        else:
+            return None
+
+        pmids = self.relations[pair].get(key)
+        if pmids is None:
+            return []
+        return pmids.split('|')
+
+
+# Load the BLENDER Knowledge Graph CSVs and index them
+def load_kg_index(knowledge_graph_folder_path):
     KG_path = knowledge_graph_folder_path
 
     print('Loading BLENDER Knowledge Graph CSVs to Pandas Dataframe')
-    chemicals_df = pd.read_csv(f'{KG_path}/chemicals.csv', delimiter = "	")
-    diseases_df = pd.read_csv(f'{KG_path}/diseases.csv', delimiter = "	")
-    genes_df = pd.read_csv(f'{KG_path}/genes.csv', delimiter = "	")
-
-    chem_to_gene_df = pd.read_csv(f'{KG_path}/chem_gene_ixns_relation.csv', delimiter = "	")
-    chem_to_disease_df = pd.read_csv(f'{KG_path}/chemicals_diseases_relation.csv', delimiter = "	")
-    gene_to_disease_df = pd.read_csv(f'{KG_path}/genes_diseases_relation.csv', delimiter = "	")
-    
-    for json_path in tqdm(json_path_list):
-        jd = None
-        with open(f'{json_path}') as f:
-            jd = f.read()
-
-        sample_subgraph = json.loads(jd)
-
-        # Load a categories array (this assues that ids are presented in numerical order)
-
-        category_arr = list()
-        for category in sample_subgraph['categories']:
-            category_arr.append(category['name'])
-
-        # Load a nodes array (same assumption as above)
-        nodes_arr = list()
-        for node in sample_subgraph['nodes']:
-            nodes_arr.append({'name': node['name'], 'category': category_arr[node['category']]})
-
-
-
-        print('-'*20)
-        print('-'*20)
-        print('Looping through edges and collecting all PMIDS')
-
-        # Loop through links and collect desired pmids
-        links_arr = list()
-        for link in tqdm(sample_subgraph['links']):
-            src_node = nodes_arr[link['source']]['name']
-            src_category = nodes_arr[link['source']]['category']
-            trg_node = nodes_arr[link['target']]['name']
-            trg_category = nodes_arr[link['target']]['category']
-
-            
-            if src_category == "Chemical" and trg_category == "Disease":
-            
-            # Find src_id in chemicals_df
-                src_id = list(chemicals_df[chemicals_df['ChemicalName'] == src_node]['ChemicalID'])[0]
-
-            # Find target_id in diseases_df
-                trg_id = list(diseases_df[diseases_df['DiseaseName'] == trg_node]['DiseaseID'])[0]
-
-            # Search chem_to_disease_df
-
-                # Search Chemicals that match src_id
-                all_chems = chem_to_disease_df[chem_to_disease_df['ChemicalID'] == src_id]
-                
-                # Search Diseases that match trg_id
-                pmids = list(all_chems[all_chems['DiseaseID'] == trg_id]['pmids'].dropna())
-                pmids_list = [x for xs in pmids for x in xs.split('|')]
-                
-                edgetype_string = link['edgetype']
-                new_edgetype_string = edgetype_string + '\nsource:'
-                for pmid in pmids_list:
-                    new_edgetype_string += pmid + ","
-                link['edgetype'] = new_edgetype_string
-                
-
-            elif src_category == "Disease" and trg_category == "Chemical":
-            # Find src_id in diseases_df
-                src_id = list(diseases_df[diseases_df['DiseaseName'] == src_node]['DiseaseID'])[0]
-
-            # Find target_id in chemicals_df
-                trg_id = list(chemicals_df[chemicals_df['ChemicalName'] == trg_node]['ChemicalID'])[0]
-
-            # Search chem_to_disease_df
-                # Search Chemicals that match src_id
-                all_chems = chem_to_disease_df[chem_to_disease_df['ChemicalID'] == trg_id]
-                
-                # Search Diseases that match trg_id
-                pmids = list(all_chems[all_chems['DiseaseID'] == src_id]['pmids'].dropna())
-                pmids_list = [x for xs in pmids for x in xs.split('|')]
-                
-                edgetype_string = link['edgetype']
-                new_edgetype_string = edgetype_string + '\nsource:'
-                for pmid in pmids_list:
-                    new_edgetype_string += pmid + ","
-                link['edgetype'] = new_edgetype_string
-
-
-            elif src_category == "Gene" and trg_category == "Chemical":
-
-            # Find src_id in genes_df
-                src_id = list(genes_df[genes_df['GeneName'] == src_node]['GeneID'])[0]
-                
-            # Find target_id in chemicals_df
-                trg_id = list(chemicals_df[chemicals_df['ChemicalName'] == trg_node]['ChemicalID'])[0]
-
-            # Search chem_to_gene_df
-                
-                # Search for Chemical in ChemicalID
-                all_chems = chem_to_gene_df[chem_to_gene_df['ChemicalID'] == trg_id]
-
-                # Search for Gene in GeneID
-                pmids = list(all_chems[all_chems['GeneID'] == src_id]['pmids'].dropna())
-                
-                pmids_list = [x for xs in pmids for x in xs.split('|')]
-
-                edgetype_string = link['edgetype']
-                new_edgetype_string = edgetype_string + '\nsource:'
-                for pmid in pmids_list:
-                    new_edgetype_string += pmid + ","
-                link['edgetype'] = new_edgetype_string
-
-            elif src_category == "Chemical" and trg_category == "Gene":
-
-            # Find src_id in chemicals_df
-                src_id = list(chemicals_df[chemicals_df['ChemicalName'] == src_node]['ChemicalID'])[0]
-                
-            # Find target_id in genes_df
-                trg_id = list(genes_df[genes_df['GeneName'] == trg_node]['GeneID'])[0]
-
-            # Search chem_to_gene_df
-                # Search for Chemical in ChemicalID
-                all_chems = chem_to_gene_df[chem_to_gene_df['ChemicalID'] == src_id]
-
-                # Search for Gene in GeneID
-                pmids = list(all_chems[all_chems['GeneID'] == trg_id]['pmids'].dropna())
-                
-                pmids_list = [x for xs in pmids for x in xs.split('|')]
-                
-                edgetype_string = link['edgetype']
-                new_edgetype_string = edgetype_string + '\nsource:'
-                for pmid in pmids_list:
-                    new_edgetype_string += pmid + ","
-                link['edgetype'] = new_edgetype_string
-
-
-            elif src_category == "Disease" and trg_category == "Gene":
-            # Find src_id in diseases_df
-                src_id = list(diseases_df[diseases_df['DiseaseName'] == src_node]['DiseaseID'])[0]
-
-            # Find target_id in genes_df
-                trg_id = list(genes_df[genes_df['GeneName'] == trg_node]['GeneID'])[0]
-
-            # Search gene_to_disease_df
-                all_genes = gene_to_disease_df[gene_to_disease_df['GeneID'] == trg_id]
-                pmids = list(all_genes[all_genes['DiseaseID'] == src_id]['pmids'].dropna())
-
-                pmids_list = [x for xs in pmids for x in xs.split('|')]
-
-                edgetype_string = link['edgetype']
-                new_edgetype_string = edgetype_string + '\nsource:'
-                for pmid in pmids_list:
-                    new_edgetype_string += pmid + ","
-                link['edgetype'] = new_edgetype_string
-
-            elif src_category == "Gene" and trg_category == "Disease":
-
-            # Find src_id in genes_df
-                src_id = list(genes_df[genes_df['GeneName'] == src_node]['GeneID'])[0]
-
-            # Find target_id in diseases_df
-                trg_id = list(diseases_df[diseases_df['DiseaseName'] == trg_node]['DiseaseID'])[0]
-
-            # Search gene_to_disease_df
-                all_genes = gene_to_disease_df[gene_to_disease_df['GeneID'] == src_id]
-                pmids = list(all_genes[all_genes['DiseaseID'] == trg_id]['pmids'].dropna())
-                
-                pmids_list = [x for xs in pmids for x in xs.split('|')]
-                
-                edgetype_string = link['edgetype']
-                new_edgetype_string = edgetype_string + '\nsource:'
-                for pmid in pmids_list:
-                    new_edgetype_string += pmid + ","
-                link['edgetype'] = new_edgetype_string
-    
-        # Save sample_subgraph to a new json file
-        # Get just the path without .json ending
-        new_json_path = json_path.replace('.json', '_with_pmids.json')
-        with open(f'{new_json_path}', "w") as f:
-            f.write(json.dumps(sample_subgraph))
+    entity_dfs = dict()
+    for category, (file_name, _, _) in ENTITY_TABLES.items():
+        entity_dfs[category] = pd.read_csv(f'{KG_path}/{file_name}', delimiter = "	")
+
+    relation_dfs = dict()
+    for pair, file_name in RELATION_TABLES.items():
+        relation_dfs[pair] = pd.read_csv(f'{KG_path}/{file_name}', delimiter = "	")
+
+    print('Indexing BLENDER Knowledge Graph')
+    return KGIndex(entity_dfs, relation_dfs)
+
+
+# Names of the entities used by a list of subgraphs: category -> set of names
+def subgraph_entity_names(json_path_list):
+    entity_names = {category: set() for category in ENTITY_TABLES}
+    for json_path in json_path_list:
+        for node in subgraph_nodes(*read_subgraph_nodes(json_path)):
+            if node['category'] in entity_names:
+                entity_names[node['category']].add(node['name'])
+    return entity_names
+
+
+# Categories and nodes of a subgraph json, streamed and without reading past them
+def read_subgraph_nodes(json_path):
+    sections = {'categories': [], 'nodes': []}
+    remaining = set(sections)
+    with open(json_path, 'rb') as f:
+        for kind, key, value in subgraph_stream.iter_subgraph(f):
+            if kind == 'item' and key in sections:
+                sections[key].append(value)
+            elif kind == 'end':
+                remaining.discard(key)
+                if len(remaining) == 0:
+                    break
+    return sections['categories'], sections['nodes']
+
+
+# Load and index only the parts of the Knowledge Graph used by a list of subgraphs
+'''
+The subgraphs are scanned for the entity names they use first, then the CSVs are streamed in chunks of
+chunksize rows and only rows of those entities are kept, so peak memory is bounded by the chunk size and
+the matching rows rather than by the size of the relation tables
+'''
+def load_filtered_kg_index(knowledge_graph_folder_path, json_path_list, chunksize=1000000):
+    KG_path = knowledge_graph_folder_path
 
+    print('Collecting entity names used by the subgraphs')
+    entity_names = subgraph_entity_names(json_path_list)
+
+    print('Streaming BLENDER Knowledge Graph CSVs (subgraph entities only)')
+    entity_dfs = dict()
+    entity_ids = dict()
+    for category, (file_name, name_column, id_column) in ENTITY_TABLES.items():
+        chunks = []
+        for chunk in pd.read_csv(f'{KG_path}/{file_name}', delimiter = "	", usecols=[name_column, id_column], chunksize=chunksize):
+            chunks.append(chunk[chunk[name_column].isin(entity_names[category])])
+        entity_dfs[category] = pd.concat(chunks, ignore_index=True)
+        entity_ids[category] = set(entity_dfs[category].drop_duplicates(name_column)[id_column])
+
+    relation_dfs = dict()
+    for (category_a, category_b), file_name in RELATION_TABLES.items():
+        id_column_a, id_column_b = f'{category_a}ID', f'{category_b}ID'
+        chunks = []
+        for chunk in tqdm(pd.read_csv(f'{KG_path}/{file_name}', delimiter = "	", usecols=[id_column_a, id_column_b, 'pmids'], chunksize=chunksize)):
+            keep = chunk[id_column_a].isin(entity_ids[category_a]) & chunk[id_column_b].isin(entity_ids[category_b])
+            chunks.append(chunk[keep])
+        relation_dfs[(category_a, category_b)] = pd.concat(chunks, ignore_index=True)
+
+    print('Indexing BLENDER Knowledge Graph')
+    return KGIndex(entity_dfs, relation_dfs)
+
+
+# Columnar cache of the Knowledge Graph index
+'''
+The KGIndex is written once as uncompressed Arrow IPC files that are memory-mapped when loaded, so
+loading takes milliseconds and processes reading the same cache share the same pages.
+
+{category}_entities.arrow: entity names (sorted) and the code of their entity id
+{category_a}_{category_b}_relations.arrow: sorted key = code a * number of b codes + code b, and the
+"|" separated pmids of the pair
+
+manifest.json records size and modification time of the CSVs the cache was built from, the cache is
+rebuilt when they change
+'''
+KG_CACHE_VERSION = 1
 
+
+def kg_csv_signature(knowledge_graph_folder_path):
+    signature = {'version': KG_CACHE_VERSION}
+    for file_name in [table[0] for table in ENTITY_TABLES.values()] + list(RELATION_TABLES.values()):
+        stat = os.stat(os.path.join(knowledge_graph_folder_path, file_name))
+        signature[file_name] = [stat.st_size, stat.st_mtime]
+    return signature
+
+
+def _write_arrow(path, table):
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def _read_arrow(path):
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def write_kg_cache(kg_index, cache_dir, signature):
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # entity id codes
+    id_codes = dict()
+    for category, name_to_id in kg_index.name_to_id.items():
+        codes = dict()
+        for entity_id in name_to_id.values():
+            codes.setdefault(entity_id, len(codes))
+        id_codes[category] = codes
+
+        names = sorted(name for name in name_to_id.keys() if isinstance(name, str))
+        _write_arrow(os.path.join(cache_dir, f'{category}_entities.arrow'), pa.table({
+            'name': pa.array(names, pa.string()),
+            'code': pa.array([codes[name_to_id[name]] for name in names], pa.int64()),
+        }))
+
+    # relation pairs of entities that can be looked up by name
+    for (category_a, category_b), relation in kg_index.relations.items():
+        codes_a, codes_b = id_codes[category_a], id_codes[category_b]
+        keys, pmids = [], []
+        for (id_a, id_b), pair_pmids in relation.items():
+            if id_a in codes_a and id_b in codes_b:
+                keys.append(codes_a[id_a] * len(codes_b) + codes_b[id_b])
+                pmids.append(pair_pmids)
+        keys = np.asarray(keys, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        _write_arrow(os.path.join(cache_dir, f'{category_a}_{category_b}_relations.arrow'), pa.table({
+            'key': pa.array(keys[order]),
+            'pmids': pa.array([pmids[i] for i in order], pa.string()),
+        }, metadata={'n_codes_b': str(len(codes_b))}))
+
+    # manifest last, so an interrupted build is not picked up as a valid cache
+    with open(os.path.join(cache_dir, 'manifest.json'), 'w') as output:
+        output.write(json.dumps(signature))
+
+
+# Knowledge Graph index backed by the memory-mapped columnar cache, same lookups as KGIndex
+'''
+The name -> code dictionary of a category is built from the mapped columns on its first lookup, once
+per process, so every later link costs two dictionary lookups and one binary search over the keys.
+'''
+class ColumnarKGIndex:
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.entities = dict()
+        self.name_codes = dict()
+        for category in ENTITY_TABLES:
+            self.entities[category] = _read_arrow(os.path.join(cache_dir, f'{category}_entities.arrow'))
+
+        self.keys = dict()
+        self.pmids = dict()
+        self.n_codes_b = dict()
+        for pair in RELATION_TABLES:
+            table = _read_arrow(os.path.join(cache_dir, f'{pair[0]}_{pair[1]}_relations.arrow'))
+            self.keys[pair] = table.column('key').to_numpy()
+            self.pmids[pair] = table.column('pmids').combine_chunks()
+            self.n_codes_b[pair] = int(table.schema.metadata[b'n_codes_b'])
+
+    # code of the entity id of a name (raises KeyError for unknown names, as KGIndex does)
+    def entity_code(self, category, name):
+        name_codes = self.name_codes.get(category)
+        if name_codes is None:
+            table = self.entities[category]
+            name_codes = dict(zip(table.column('name').to_pylist(), table.column('code').to_pylist()))
+            self.name_codes[category] = name_codes
+        return name_codes[name]
+
+    def lookup_pmids(self, src_category, src_name, trg_category, trg_name):
+        if (src_category, trg_category) in self.keys:
+            pair = (src_category, trg_category)
+            code_a, code_b = self.entity_code(src_category, src_name), self.entity_code(trg_category, trg_name)
+        elif (trg_category, src_category) in self.keys:
+            pair = (trg_category, src_category)
+            code_a, code_b = self.entity_code(trg_category, trg_name), self.entity_code(src_category, src_name)
+        else:
+            return None
+
+        key = code_a * self.n_codes_b[pair] + code_b
+        keys = self.keys[pair]
+        i = int(np.searchsorted(keys, key))
+        if i == len(keys) or keys[i] != key:
+            return []
+        return self.pmids[pair][i].as_py().split('|')
+
+
+# Load the Knowledge Graph index from the columnar cache, building the cache from the CSVs first if needed
+def load_cached_kg_index(knowledge_graph_folder_path, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(knowledge_graph_folder_path, 'kg_cache')
+
+    signature = kg_csv_signature(knowledge_graph_folder_path)
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+
+    cached_signature = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            cached_signature = json.load(f)
+
+    if cached_signature != json.loads(json.dumps(signature)):
+        instrumentation.cache_lookup('kg_cache', 0, 1)
+        kg_index = load_kg_index(knowledge_graph_folder_path)
+        print(f'Writing BLENDER Knowledge Graph cache to {cache_dir}')
+        with instrumentation.stage('get_pmids.write_kg_cache'):
+            write_kg_cache(kg_index, cache_dir, signature)
+    else:
+        instrumentation.cache_lookup('kg_cache', 1, 0)
+
+    print(f'Loading BLENDER Knowledge Graph cache from {cache_dir}')
+    return ColumnarKGIndex(cache_dir)
+
+
+# Nodes of a subgraph as {'name', 'category': category name}
+# (this assumes that categories and nodes are presented in numerical order of their ids)
+def subgraph_nodes(categories, nodes):
+    category_arr = [category['name'] for category in categories]
+    return [{'name': node['name'], 'category': category_arr[node['category']]} for node in nodes]
+
+
+# Add the pmids of a link to its edgetype ("{edgetype}\nsource:pmid1,pmid2,"), nodes_arr: subgraph_nodes
+def annotate_link(link, nodes_arr, kg_index):
+    src_node = nodes_arr[link['source']]
+    trg_node = nodes_arr[link['target']]
+
+    pmids_list = kg_index.lookup_pmids(src_node['category'], src_node['name'], trg_node['category'], trg_node['name'])
+    if pmids_list is not None:
+        link['edgetype'] = link['edgetype'] + '\nsource:' + ''.join(pmid + ',' for pmid in pmids_list)
+    return link
+
+
+# Annotate one subgraph json and save it to {json_path}_with_pmids.json
+'''
+The json is streamed: links are read, annotated and written one at a time (see subgraph_stream.py), so only
+the categories and nodes are held in memory. The output is the same as json.dumps of the annotated subgraph.
+'''
+def annotate_subgraph_file(json_path, kg_index):
+    # Get just the path without .json ending
+    new_json_path = json_path.replace('.json', '_with_pmids.json')
+
+    # write and rename, so an interrupted run never leaves a partial output
+    with open(f'{json_path}', 'rb') as f, open(f'{new_json_path}.tmp', 'w') as output:
+        stream = subgraph_stream.SubgraphStream(f)
+        writer = subgraph_stream.SubgraphWriter(output)
+        nodes_arr = None
+        for kind, key, value in stream:
+            if kind == 'item' and key == 'links':
+                if nodes_arr is None:
+                    nodes_arr = subgraph_nodes(stream.categories, stream.nodes)
+                annotate_link(value, nodes_arr, kg_index)
+            writer.write(kind, key, value)
+        writer.close()
+    os.replace(f'{new_json_path}.tmp', new_json_path)
+
+    return new_json_path
+
+
+# KG index of a worker process, set once by _init_worker
+_worker_kg_index = None
+
+
+def _init_worker(kg_index=None, cache_dir=None):
+    global _worker_kg_index
+    if cache_dir is not None:
+        _worker_kg_index = ColumnarKGIndex(cache_dir)
+    elif kg_index is not None:
+        _worker_kg_index = kg_index
+
+
+def _annotate_subgraph_file_worker(json_path):
+    return annotate_subgraph_file(json_path, _worker_kg_index)
+
+
+# Annotate many subgraph jsons in a process pool sharing one read-only KG index
+'''
+A columnar (cached) index is memory mapped again by every worker, so all workers share the same pages of
+the cache files. Any other index is inherited through fork (copy on write), without being pickled. Where
+fork is not available (Windows, and not safe on macOS) it is written to a temporary columnar cache instead.
+'''
+def annotate_subgraph_files_parallel(json_path_list, kg_index, processes=None):
+    global _worker_kg_index
+
+    with contextlib.ExitStack() as stack:
+        if not isinstance(kg_index, ColumnarKGIndex) and not _can_fork():
+            cache_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix='kg_cache_'))
+            print(f'Writing BLENDER Knowledge Graph index to {cache_dir} for the worker processes')
+            write_kg_cache(kg_index, cache_dir, {'version': KG_CACHE_VERSION})
+            kg_index = ColumnarKGIndex(cache_dir)
+
+        if isinstance(kg_index, ColumnarKGIndex):
+            executor = ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(None, kg_index.cache_dir))
+        else:
+            _worker_kg_index = kg_index
+            executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('fork'))
+
+        try:
+            with executor:
+                return list(tqdm(executor.map(_annotate_subgraph_file_worker, json_path_list, chunksize=4), total=len(json_path_list)))
+        finally:
+            _worker_kg_index = None
+
+
+# fork is only offered on POSIX systems, and is unsafe on macOS (where spawn is the default)
+def _can_fork():
+    return 'fork' in multiprocessing.get_all_start_methods() and sys.platform != 'darwin'
+
+
+'''
+Takes in a list of json file paths and converts jsons to contain pmids for each relationship
+
+The first call converts the Knowledge Graph CSVs into a columnar cache ({knowledge_graph_folder_path}/kg_cache
+unless cache_dir is given), later calls load the cache in well under a second. use_cache=False reads
+and indexes the CSVs directly.
+
+low_memory=True skips the cache and streams the CSVs, keeping only the rows of entities used by the
+subgraphs in json_path_list (for machines that cannot hold the full relation tables in memory)
+
+processes > 1 (or None for one per CPU) annotates the subgraphs in a process pool, the KG index is built once
+and shared read-only with the workers
+
+metrics_path: optional path of a json report of the run (stage timings, cache hits, see instrumentation.py)
+
+Creates new files using {json_path}_with_pmids.json naming
+'''
+def get_pmids(json_path_list, knowledge_graph_folder_path, cache_dir=None, use_cache=True, low_memory=False, processes=1,
+              metrics_path=None):
+
+    with instrumentation.run('get_pmids', metrics_path):
+        with instrumentation.stage('get_pmids.load_kg_index'):
+            if low_memory:
+                kg_index = load_filtered_kg_index(knowledge_graph_folder_path, json_path_list)
+            elif use_cache:
+                kg_index = load_cached_kg_index(knowledge_graph_folder_path, cache_dir)
+            else:
+                kg_index = load_kg_index(knowledge_graph_folder_path)
+
+        with instrumentation.stage('get_pmids.annotate_subgraphs'):
+            if processes == 1:
+                for json_path in tqdm(json_path_list):
+                    print('-'*20)
+                    print('-'*20)
+                    print('Looping through edges and collecting all PMIDS')
+
+                    annotate_subgraph_file(json_path, kg_index)
+            else:
+                annotate_subgraph_files_parallel(json_path_list, kg_index, processes)
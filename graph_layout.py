@@ -0,0 +1,121 @@
+#Copyright (C) Systems & Technology Research
+#Use of this software is subject to the restrictions in license.txt
+#Distribution A: Approved for Public Release, Distribution Unlimited
+import hashlib
+import json
+import os
+
+import networkx as nx
+
+import instrumentation
+
+
+# Node layouts of a subgraph, cached on disk
+'''
+Layouts are keyed by a hash of the set of "source-->target" node pairs, so edge_weight.py (which knows
+the json) and plot_subgraph.py (which reads its output) find the same cached positions.
+
+Nodes are given either by name (node_key='name', all plot_subgraph.py has with a csv) or by node id
+(node_key='id', from the json or the edge tables, so nodes sharing a name get their own positions).
+Positions are stored as {node: [x, y]} in {cache_dir}/{algorithm}_{hash}.json for names and in
+{cache_dir}/{algorithm}_ids_{hash}.json for node ids.
+'''
+
+NODE_KEYS = ('name', 'id')
+
+
+# Hash of an edge set given as (source name, target name) pairs
+def edge_set_hash(edges):
+    h = hashlib.sha1()
+    for s, t in sorted(set(edges)):
+        h.update(f'{s}-->{t}\n'.encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def _graph(edges):
+    G = nx.Graph()
+    G.add_edges_from(edges)
+    return G
+
+
+def forceatlas2_positions(edges, iterations=10000):
+    from fa2 import ForceAtlas2
+
+    # initiate forceatlas algorithm to calculate node positions
+    forceatlas2 = ForceAtlas2(
+                            # Behavior alternatives
+                            outboundAttractionDistribution=True,  # Dissuade hubs
+                            linLogMode=False,  # NOT IMPLEMENTED
+                            adjustSizes=False,  # Prevent overlap (NOT IMPLEMENTED)
+                            edgeWeightInfluence=10.0,
+
+                            # Performance
+                            jitterTolerance=10.0,  # Tolerance
+                            barnesHutOptimize=True,
+                            barnesHutTheta=1.2,
+                            multiThreaded=False,  # NOT IMPLEMENTED
+
+                            # Tuning
+                            scalingRatio=15.0,
+                            strongGravityMode=False,
+                            gravity=50,
+
+                            # Log
+                            verbose=True)
+
+    # calculate nodes' positions
+    return forceatlas2.forceatlas2_networkx_layout(_graph(edges), pos=None, iterations=iterations)
+
+
+def fruchterman_reingold_positions(edges):
+    return nx.layout.fruchterman_reingold_layout(_graph(edges), .5)
+
+
+LAYOUT_ALGORITHMS = {
+    'forceatlas2': forceatlas2_positions,
+    'fruchterman_reingold': fruchterman_reingold_positions,
+}
+
+
+def layout_path(edges, cache_dir, algorithm, node_key='name'):
+    if node_key not in NODE_KEYS:
+        raise ValueError(f'Unknown node_key {node_key!r}, expected one of {NODE_KEYS}')
+    prefix = algorithm if node_key == 'name' else f'{algorithm}_ids'
+    return os.path.join(cache_dir, f'{prefix}_{edge_set_hash(edges)}.json')
+
+
+# Return cached positions of the first algorithm with a cached layout for this edge set, None if there is none
+def load_layout(edges, cache_dir, algorithms=('forceatlas2', 'fruchterman_reingold'), node_key='name'):
+    for algorithm in algorithms:
+        path = layout_path(edges, cache_dir, algorithm, node_key)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                positions = {node: tuple(xy) for node, xy in json.load(f).items()}
+            # json keys are strings
+            if node_key == 'id':
+                positions = {int(node): xy for node, xy in positions.items()}
+            instrumentation.cache_lookup('layout_cache', 1, 0)
+            return positions
+    return None
+
+
+# Return positions for this edge set, computing and caching them if needed
+def get_layout(edges, cache_dir, algorithm='forceatlas2', recompute=False, node_key='name'):
+    edges = list(edges)
+    if node_key == 'id':
+        edges = [(int(s), int(t)) for s, t in edges]
+    if not recompute:
+        positions = load_layout(edges, cache_dir, (algorithm,), node_key)
+        if positions is not None:
+            return positions
+
+    instrumentation.cache_lookup('layout_cache', 0, 1)
+    with instrumentation.stage(f'graph_layout.{algorithm}'):
+        positions = LAYOUT_ALGORITHMS[algorithm](edges)
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    with open(layout_path(edges, cache_dir, algorithm, node_key), 'w') as output:
+        output.write(json.dumps({node: [float(x), float(y)] for node, (x, y) in positions.items()}))
+
+    return positions
@@ -1,26 +1,26 @@
 #Copyright (C) Systems & Technology Research
 #Use of this software is subject to the restrictions in license.txt
 #Distribution A: Approved for Public Release, Distribution Unlimited
-import os
 import sys
-import traceback
-import requests
-import json
-import time
+import asyncio
 
-from bs4 import BeautifulSoup
 from scholarmetrics import hindex
 from Bio import Entrez
-from ratelimit import limits, sleep_and_retry
 import threading
 import _thread as thread
 from tqdm import tqdm
 
+from eutils_client import EutilsClient, run_sync, TOOL
+import instrumentation
+import eutils_parse
+from h_index_finder.h_index_store import HIndexStore, DEFAULT_H_INDEX_STORE_PATH
 
-tool = "biopython"
+
+tool = TOOL
 Entrez.tool = tool
-Entrez.sleep_between_tries = 60
-Entrez.max_tries = 5
+
+# Number of authors whose results are committed to the h-index store at once
+COMMIT_BATCH_SIZE = 100
 
 
 def quit_function(fn_name):
@@ -49,31 +49,19 @@ def exit_after(s):
     return outer
 
 
-def get_links_ids(pmids):
+async def get_links_ids(client, pmids):
     link_db = {}
+    if len(pmids) == 0:
+        return link_db
 
-    while True:
-        try:
-            links = Entrez.elink(dbfrom="pubmed", cmd='neighbor_score', id=pmids, linkname="pubmed_pmc_refs")
-
-            record = Entrez.read(links)
-            break
-        except:
-            print("Error... Waiting 2 Minutes before re-trying")
-
-            print('-' * 60)
-            traceback.print_exc(file=sys.stdout)
-            print('-' * 60)
-
-            time.sleep(120)
+    links = await client.elink(dbfrom="pubmed", cmd='neighbor_score', id=pmids, linkname="pubmed_pmc_refs")
 
-    for rr in record:
-        id_list = {int(i) for i in rr[u'IdList']}
-        link_set_db = rr[u'LinkSetDb']
-        if len(link_set_db) > 0:
-            for link in link_set_db[0][u'Link']:
-                l_score = int(link[u'Score'])
-                l_id = int(link[u'Id'])
+    for rr in eutils_parse.elink_linksets(links):
+        id_list = {int(i) for i in rr['ids']}
+        if rr['links'] is not None:
+            for link_id, link_score in zip(rr['links'], rr['scores']):
+                l_score = int(link_score)
+                l_id = int(link_id)
 
                 if l_score not in id_list:
                     print("ERROR: score doesn't match id set")
@@ -86,88 +74,160 @@ def get_links_ids(pmids):
     return link_db
 
 
-@sleep_and_retry
-@limits(calls=30, period=10)
-def pull_url(author, email, apikey=None):
-    if apikey is not None:
-        req = f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=pubmed&datetype=pdat&mindate=1990' \
-          f'&maxdate=2020&retmax=500&tool={tool}&term={author}&email={email}&apikey={apikey}'
-    else:
-        req = f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=pubmed&datetype=pdat&mindate=1990' \
-              f'&maxdate=2020&retmax=500&tool={tool}&term={author}&email={email}'
+# Rate limiting and retries are handled by the shared EutilsClient
+async def pull_url(client, author):
+    return await client.esearch(db='pubmed', datetype='pdat', mindate=1990, maxdate=2020, retmax=500, term=author, retmode='json')
+
+
+def calculate_h_index(df_authors, db_path, api_key=None, email=None, refresh_policy=None):
+    return run_sync(calculate_h_index_async(df_authors, db_path, api_key, email, refresh_policy))
+
+
+async def calculate_h_index_async(df_authors, db_path, api_key=None, email=None, refresh_policy=None):
+    h_index_store = HIndexStore(db_path)
+    try:
+        async with EutilsClient(email or Entrez.email, api_key) as client:
+            return await collect_h_indexes(client, df_authors, h_index_store, refresh_policy)
+    finally:
+        h_index_store.close()
+
+
+# esearch the pmids of an author
+async def search_author_pmids(client, author):
+    page = await pull_url(client, author)
+
+    return eutils_parse.esearch_ids(page)
+
+
+# esearch the pmids of an author once it is within window.size authors of the commit cursor
+'''
+window is released by _commit_h_indexes as authors are committed, so searches only run a few authors
+ahead of the elinks and commits instead of all taking their rate limit slots first
+'''
+async def search_in_window(client, author, window):
+    await window.acquire()
+    return await search_author_pmids(client, author)
+
 
-    while True:
-        try:
-            return requests.get(req)
-        except:
-            print("Error... Waiting 1 Minute before re-trying")
+# elink the citations of the pmids of an author that were not retrieved for an earlier author
+'''
+plan: future of (author_pmids, depends), set by plan_links once the esearch of the author is done.
+depends: tasks of the earlier authors sharing pmids with this one. Only their results can remove pmids
+from this author's request, so waiting for them gives the same request as processing authors one by one.
+'''
+async def link_author_pmids(client, plan):
+    author_pmids, depends = await plan
 
-            print('-' * 60)
-            traceback.print_exc(file=sys.stdout)
-            print('-' * 60)
+    retrieved_before = set()
+    for retrieved in await asyncio.gather(*depends):
+        retrieved_before.update(retrieved.keys())
 
-            time.sleep(60)
-            continue
+    return await get_links_ids(client, [int(pmid) for pmid in author_pmids if int(pmid) not in retrieved_before])
 
 
-def calculate_h_index(df_authors, db_path, has_key=False):
+# Resolve the plan of every elink (in author order) as soon as the esearch results it depends on are in
+'''
+The dependencies of an author are only known once the esearches of all earlier authors are done, so the
+searches are awaited in order. If one fails, the plans left are failed too, so no elink waits forever.
+'''
+async def plan_links(link_authors, searches, plans, links):
+    pmid_2_links = dict()
+    try:
+        for author, plan, link in zip(link_authors, plans, links):
+            with instrumentation.stage('h_index_finder.esearch'):
+                author_pmids = await searches[author]
+            depends = {id(earlier): earlier for pmid in author_pmids for earlier in pmid_2_links.get(pmid, [])}
+            plan.set_result((author_pmids, list(depends.values())))
+            for pmid in set(author_pmids):
+                pmid_2_links.setdefault(pmid, []).append(link)
+    except BaseException as e:
+        for plan in plans:
+            if not plan.done():
+                if isinstance(e, asyncio.CancelledError):
+                    plan.cancel()
+                else:
+                    plan.set_exception(e)
+        # other errors reach the caller through the elinks
+        if isinstance(e, asyncio.CancelledError):
+            raise
+
+
+async def collect_h_indexes(client, df_authors, h_index_store, refresh_policy=None):
     # Collect three stats: (i) author name and his/her h-index, (ii) citation list of each pmid, and (iii) author pmids
 
-    author_2_hindex = dict()
     author_2_hindex_return = dict()
-    pmid_2_cite = dict()
-    author_2_pmids = dict()
-    h_index_db = dict()
 
-    with open(db_path) as h_index_db_file:
-        h_index_db = json.load(h_index_db_file)
-    
-    for name in tqdm(df_authors):
+    # point lookups of the requested authors only, stale ones are computed again
+    requested_authors = {name[1:] if name[0] == ' ' else name for name in df_authors}
+    stale_authors = set()
+    if refresh_policy is not None:
+        stale_authors = h_index_store.stale(refresh_policy, requested_authors)
+        print(f'Refreshing {len(stale_authors)} stale h-indexes ({refresh_policy})')
+    stored_h_indices = h_index_store.get_h_indices(requested_authors - stale_authors)
+
+    # Decide what to do for every author: use the database, call the API or give up (-1)
+    authors = []
+    for name in df_authors:
 
         if name[0] == ' ':
             author = name[1:] # + ' ' + surname
         else:
             author = name # + ' ' + surname
 
-        author_pmids = []
-
-
-        # First check if the name already exists in our db, if 0, then try again
+        # First check if the name already exists in our db (and is not stale)
         call_api_flag = True
 
-        if author in h_index_db['h_indices']:
-            h_index = h_index_db['h_indices'][author]
-            # print(f"{author} found in current database ({db_path}) with a value of {h_index}")
-            if h_index != 0:
-                # print(f"{author} found in current database ({db_path}) with a value of {h_index}")
-                author_2_hindex_return[author] = h_index
-                call_api_flag = False
-            else:
-                # print(f"{author} found in current database ({db_path}) with a value of {h_index} ... retrying API call")
-                
-                # BELOW IS JUST FOR DEMO!!!
-                #TODO
-                author_2_hindex_return[author] = h_index
-                call_api_flag = False
+        if author in stored_h_indices:
+            # zero h-indexes are kept as well, they are retried with RefreshPolicy(retry_zero=True)
+            call_api_flag = False
+        elif author in stale_authors:
+            print(f"{author} is stale in current database ({h_index_store.db_path}) ... retrying API call")
         else:
-            print(f"{author} not found in current database ({db_path})")
+            print(f"{author} not found in current database ({h_index_store.db_path})")
         # This ensures that we are not checking short and very common names which takes forever to collect information
-        if len(author) > 5 and call_api_flag:
-            if has_key:
-                page = pull_url(author, Entrez.email, Entrez.api_key)
-            else:
-                page = pull_url(author, Entrez.email)
+        authors.append((author, len(author) > 5 and call_api_flag, call_api_flag))
+
+    # 1. esearch the authors in order, at most max_in_flight of them ahead of the last committed author
+    # 2. elink every author as soon as its own esearch and the elinks of the earlier authors it shares pmids with are done
+    loop = asyncio.get_running_loop()
+    link_authors = [author for author, use_api, _ in authors if use_api]
+    # waiters of an asyncio.Semaphore are woken in order, so the searches start in author order
+    window = asyncio.Semaphore(client.max_in_flight)
+    searches = {author: asyncio.ensure_future(search_in_window(client, author, window)) for author in dict.fromkeys(link_authors)}
+    plans = [loop.create_future() for _ in link_authors]
+    links = [asyncio.ensure_future(link_author_pmids(client, plan)) for plan in plans]
+    planner = asyncio.ensure_future(plan_links(link_authors, searches, plans, links))
+    tasks = list(searches.values()) + links + [planner]
+
+    try:
+        await _commit_h_indexes(authors, searches, links, window, stored_h_indices, h_index_store, author_2_hindex_return)
+    finally:
+        # if a request failed, stop the others (results committed so far are kept in the store)
+        for task in tasks:
+            task.cancel()
 
-            soup = BeautifulSoup(page.content, 'xml')
+    return author_2_hindex_return
 
-            ids = soup.find_all('Id', {})
 
-            for id_ in ids:
-                author_pmids.append(id_.get_text())
-            author_2_pmids[author] = author_pmids
+# 3. h-indexes in the order of the authors, committed to the store every COMMIT_BATCH_SIZE authors
+'''
+Runs while later authors are still being searched and linked: every author done moves the search window
+(see search_in_window) one author further, so a failure only loses the uncommitted batch
+'''
+async def _commit_h_indexes(authors, searches, links, window, stored_h_indices, h_index_store, author_2_hindex_return):
+    links = iter(tqdm(links))
+    searched = set()
+    author_2_hindex, author_2_pmids, pmid_2_cite = dict(), dict(), dict()
+    for i, (author, use_api, call_api_flag) in enumerate(authors):
+        if use_api:
             citations = []
 
-            retrieved = get_links_ids([int(pmid) for pmid in author_pmids if int(pmid) not in pmid_2_cite.keys()])
+            with instrumentation.stage('h_index_finder.elink'):
+                retrieved = await next(links)
+            author_2_pmids[author] = searches[author].result()
+            if author not in searched:
+                searched.add(author)
+                window.release()
 
             for pmid in retrieved.keys():
                 link_list = []
@@ -181,36 +241,44 @@ def calculate_h_index(df_authors, db_path, has_key=False):
         elif call_api_flag:
             author_2_hindex[author] = -1
             author_2_hindex_return[author] = -1
+        else:
+            author_2_hindex_return[author] = stored_h_indices[author]
+
+        if (i + 1) % COMMIT_BATCH_SIZE == 0 or i + 1 == len(authors):
+            h_index_store.put_many(author_2_hindex, author_2_pmids, pmid_2_cite)
+            author_2_hindex, author_2_pmids, pmid_2_cite = dict(), dict(), dict()
 
-    h_index_db['h_indices'].update(author_2_hindex)
-    h_index_db['pmids'].update(author_2_pmids)
-    h_index_db['citations'].update(pmid_2_cite)
-
-    #TODO: make changes to path to overwrite current file
-    with open(os.path.join(os.path.dirname(__file__), f'./data/author_h_indexes.json'), 'w') as output:
-        output.write(json.dumps({
-            'h_indices': h_index_db['h_indices'],
-            'pmids': h_index_db['pmids'],
-            'citations': h_index_db['citations']
-        }))
-    
-    return author_2_hindex_return
-    
 
 # START HERE: Public Function
 '''
 Args:
 email (string) -> valid email address for api calls
 author_list (list) -> valid list of author names in the format "name surname"
-db_path (string) -> optional path to current h_index database
+db_path (string) -> optional path to the h_index store (see h_index_store.py), created from the legacy
+                    data/author_h_indexes.json database the first time. A path to a legacy .json database
+                    is migrated into a .sqlite store next to it
+refresh_policy (RefreshPolicy) -> optional policy for computing stored h-indexes again (default: never)
+metrics_path (string) -> optional path of a json report of the run (API calls, cache hits, see instrumentation.py)
 
 Return:
 author_2_hindex_return (dict) -> key: author name, value: h_index for authors requested in author_list
 '''
-def find_h_index(email, author_list, api_key=None, db_path=os.path.join(os.path.dirname(__file__), './data/author_h_indexes.json')):
+def find_h_index(email, author_list, api_key=None, db_path=DEFAULT_H_INDEX_STORE_PATH, refresh_policy=None, metrics_path=None):
     Entrez.email = email
-    if api_key:
-        Entrez.api_key = api_key
-        return calculate_h_index(author_list, db_path, True)
-    else:
-        return calculate_h_index(author_list, db_path)
+    with instrumentation.run('find_h_index', metrics_path):
+        return calculate_h_index(author_list, db_path, api_key, email, refresh_policy)
+
+
+# Compute again every stale h-index of the store, in bulk
+'''
+Returns the refreshed author_2_hindex mapping
+'''
+def refresh_h_indexes(email, refresh_policy, api_key=None, db_path=DEFAULT_H_INDEX_STORE_PATH):
+    h_index_store = HIndexStore(db_path)
+    try:
+        stale_authors = h_index_store.stale(refresh_policy)
+    finally:
+        h_index_store.close()
+
+    print(f'Refreshing {len(stale_authors)} stale h-indexes in {h_index_store.db_path}')
+    return find_h_index(email, sorted(stale_authors), api_key, db_path, refresh_policy)
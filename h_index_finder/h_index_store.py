@@ -0,0 +1,158 @@
+#Copyright (C) Systems & Technology Research
+#Use of this software is subject to the restrictions in license.txt
+#Distribution A: Approved for Public Release, Distribution Unlimited
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import instrumentation
+from pmid_store import add_refresh_columns
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+DEFAULT_H_INDEX_STORE_PATH = os.path.join(DATA_DIR, 'author_h_indexes.sqlite')
+
+# JSON database used before the SQLite store, migrated into the store once
+LEGACY_JSON_PATH = os.path.join(DATA_DIR, 'author_h_indexes.json')
+
+# SQLite limits the number of variables in one statement
+MAX_QUERY_VARIABLES = 900
+
+
+# Persistent h-index database
+'''
+Holds the three stats collected by h_index_finder.py in indexed SQLite tables:
+h_indices: author -> h-index
+author_pmids: author -> list of pmids (as returned by esearch)
+citations: pmid -> list of citing pmids
+
+Authors are looked up one batch at a time instead of loading the whole database, and results are
+upserted and committed batch by batch as they are collected, so a crash only loses the current batch.
+Each h-index records when it was computed and how many times it was looked up, see
+refresh_policy.RefreshPolicy for when h-indexes are computed again.
+
+The first time a store is opened, the legacy JSON database (if there is one) is copied into it.
+A db_path ending in .json names a legacy JSON database (db_path used to point at one): the store is then
+the .sqlite file next to it, created from that JSON database.
+'''
+class HIndexStore:
+
+    def __init__(self, db_path=DEFAULT_H_INDEX_STORE_PATH, json_path=LEGACY_JSON_PATH):
+        if db_path.endswith('.json'):
+            json_path = db_path
+            db_path = db_path[:-len('.json')] + '.sqlite'
+        self.db_path = db_path
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir != '' and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=60)
+        # WAL lets readers keep working while another run is writing
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS h_indices (author TEXT PRIMARY KEY, h_index INTEGER NOT NULL, '
+                          'fetched_at REAL, use_count INTEGER NOT NULL DEFAULT 0)')
+        add_refresh_columns(self.conn, 'h_indices')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS author_pmids (author TEXT PRIMARY KEY, pmids TEXT NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS citations (pmid INTEGER PRIMARY KEY, citers TEXT NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self.conn.commit()
+
+        if json_path is not None:
+            self.migrate_json(json_path)
+
+    # Copy a JSON database ({'h_indices': ..., 'pmids': ..., 'citations': ...}) into the store, only once
+    def migrate_json(self, json_path):
+        with self.lock:
+            migrated = self.conn.execute("SELECT value FROM meta WHERE key = 'migrated_json'").fetchone()
+        if migrated is not None or not os.path.exists(json_path):
+            return
+
+        print(f'Migrating h-index database {json_path} to {self.db_path}')
+        with open(json_path) as h_index_db_file:
+            h_index_db = json.load(h_index_db_file)
+
+        with self.lock:
+            self._upsert(h_index_db.get('h_indices', {}), h_index_db.get('pmids', {}), h_index_db.get('citations', {}))
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_json', ?)", (json_path,))
+            self.conn.commit()
+
+    def _select(self, query, keys, count_use=False):
+        rows = []
+        for start in range(0, len(keys), MAX_QUERY_VARIABLES):
+            chunk = keys[start:start + MAX_QUERY_VARIABLES]
+            placeholders = ','.join('?' * len(chunk))
+            with self.lock:
+                rows.extend(self.conn.execute(query.format(placeholders), chunk).fetchall())
+                if count_use:
+                    self.conn.execute(f'UPDATE h_indices SET use_count = use_count + 1 WHERE author IN ({placeholders})', chunk)
+                    self.conn.commit()
+        return rows
+
+    # Returns a dictionary author -> h-index for the authors found in the store
+    def get_h_indices(self, authors):
+        authors = list(authors)
+        h_indices = dict(self._select('SELECT author, h_index FROM h_indices WHERE author IN ({})', authors, count_use=True))
+        instrumentation.cache_lookup('h_index_store', len(h_indices), len(authors) - len(h_indices))
+        return h_indices
+
+    # The n most used authors of the store
+    def most_used(self, n):
+        with self.lock:
+            rows = self.conn.execute('SELECT author FROM h_indices WHERE use_count > 0 ORDER BY use_count DESC LIMIT ?', (n,)).fetchall()
+        return [row[0] for row in rows]
+
+    # Stale authors according to a RefreshPolicy, among authors (all authors of the store if None)
+    '''
+    refresh_top_n always refers to the most used authors of the whole store, also when authors is given
+    '''
+    def stale(self, policy, authors=None):
+        top_keys = None
+        if authors is None:
+            with self.lock:
+                rows = self.conn.execute('SELECT author, fetched_at, use_count, h_index FROM h_indices').fetchall()
+        else:
+            authors = list(authors)
+            rows = self._select('SELECT author, fetched_at, use_count, h_index FROM h_indices WHERE author IN ({})', authors)
+            if policy.refresh_top_n > 0:
+                top_keys = set(self.most_used(policy.refresh_top_n)).intersection(authors)
+
+        return policy.stale_keys(((author, fetched_at, use_count, h_index == 0) for author, fetched_at, use_count, h_index in rows),
+                                 top_keys=top_keys)
+
+    # Returns a dictionary author -> list of pmids for the authors found in the store
+    def get_author_pmids(self, authors):
+        rows = self._select('SELECT author, pmids FROM author_pmids WHERE author IN ({})', list(authors))
+        return {author: json.loads(pmids) for author, pmids in rows}
+
+    # Returns a dictionary pmid (int) -> list of citing pmids for the pmids found in the store
+    def get_citations(self, pmids):
+        rows = self._select('SELECT pmid, citers FROM citations WHERE pmid IN ({})', [int(pmid) for pmid in pmids])
+        return {pmid: json.loads(citers) for pmid, citers in rows}
+
+    def _upsert(self, author_2_hindex, author_2_pmids, pmid_2_cite):
+        fetched_at = time.time()
+        self.conn.executemany('INSERT INTO h_indices (author, h_index, fetched_at) VALUES (?, ?, ?) '
+                              'ON CONFLICT(author) DO UPDATE SET h_index = excluded.h_index, fetched_at = excluded.fetched_at',
+                              [(author, h_index, fetched_at) for author, h_index in author_2_hindex.items()])
+        self.conn.executemany('INSERT OR REPLACE INTO author_pmids (author, pmids) VALUES (?, ?)',
+                              [(author, json.dumps(pmids)) for author, pmids in author_2_pmids.items()])
+        self.conn.executemany('INSERT OR REPLACE INTO citations (pmid, citers) VALUES (?, ?)',
+                              [(int(pmid), json.dumps(citers)) for pmid, citers in pmid_2_cite.items()])
+
+    # Insert or replace a batch of results and commit them
+    def put_many(self, author_2_hindex=None, author_2_pmids=None, pmid_2_cite=None):
+        with self.lock:
+            self._upsert(author_2_hindex or {}, author_2_pmids or {}, pmid_2_cite or {})
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM h_indices').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,189 @@
+#Copyright (C) Systems & Technology Research
+#Use of this software is subject to the restrictions in license.txt
+#Distribution A: Approved for Public Release, Distribution Unlimited
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+'''
+Per-run metrics of the pipeline (edge_weight, batch_edge_weights, h_index_finder, get_pmids, plot_subgraph)
+
+A run collects:
+stages: wall time and number of calls of every named stage (e.g. 'edge_weight.collect_NCBI')
+metrics: counters and totals by metric and key, e.g.
+         api_calls / api_retries / api_seconds / api_bytes / retry_sleep_seconds: by E-utility ('efetch', 'elink', ...)
+         rate_limit_sleep_seconds: time spent waiting for the shared NCBI rate limit
+         cache_hits / cache_misses: by cache ('pmid_store', 'h_index_store', 'kg_cache', 'layout_cache')
+peak_rss_bytes: peak resident memory of the process (and of its finished child processes)
+
+Usage:
+    with instrumentation.run('my_subgraph', 'my_subgraph/my_subgraph_metrics.json'):
+        with instrumentation.stage('edge_weight.collect_NCBI'):
+            ...
+        instrumentation.count('api_calls', 'efetch')
+
+The current run is held in a context variable, so concurrent runs in different threads (or asyncio tasks)
+are kept apart. A run started inside another run is added to the outer run when it ends. Outside of a run,
+stage() and count() only notify the hooks.
+
+Hooks (add_hook) are called for every event as hook(event, name, key, value) and can forward them to a
+metrics collector (statsd, Prometheus...):
+    ('stage', stage name, None, seconds)
+    ('count', metric, key, value)
+    ('report', run name, None, report dictionary), when a run ends
+Hooks are called from the thread that recorded the event and should return quickly.
+'''
+
+
+_current_run = contextvars.ContextVar('instrumentation_run', default=None)
+
+_hooks = []
+
+
+def add_hook(hook):
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def _emit(event, name, key, value):
+    for hook in list(_hooks):
+        hook(event, name, key, value)
+
+
+# Metrics collected by one run
+class RunMetrics:
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.wall_seconds = None
+        self.stages = dict()
+        self.metrics = dict()
+        self.lock = threading.Lock()
+
+    def add_stage(self, name, seconds, calls=1):
+        with self.lock:
+            stage = self.stages.setdefault(name, {'seconds': 0., 'calls': 0})
+            stage['seconds'] += seconds
+            stage['calls'] += calls
+
+    def add(self, metric, key, value=1):
+        with self.lock:
+            values = self.metrics.setdefault(metric, dict())
+            values[key] = values.get(key, 0) + value
+
+    # Add the stages and metrics of another run (a run nested in this one)
+    def merge(self, other):
+        for name, stage in other.stages.items():
+            self.add_stage(name, stage['seconds'], stage['calls'])
+        for metric, values in other.metrics.items():
+            for key, value in values.items():
+                self.add(metric, key, value)
+
+    def finish(self):
+        self.wall_seconds = time.perf_counter() - self.start
+
+    def report(self):
+        with self.lock:
+            return {
+                'name': self.name,
+                'started_at': self.started_at,
+                'wall_seconds': self.wall_seconds if self.wall_seconds is not None else time.perf_counter() - self.start,
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'metrics': {metric: dict(values) for metric, values in self.metrics.items()},
+                'peak_rss_bytes': peak_rss_bytes(),
+                'peak_rss_children_bytes': peak_rss_bytes(children=True),
+            }
+
+
+# Peak resident memory of this process (or of its terminated children) in bytes, None if unknown
+'''
+This is the peak over the life of the process, not of a single run
+'''
+def peak_rss_bytes(children=False):
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return usage.ru_maxrss
+    return usage.ru_maxrss * 1024
+
+
+def current_run():
+    return _current_run.get()
+
+
+# Collect the metrics of everything run inside the with block
+'''
+The report is written to report_path as json (if given) and passed to the hooks when the block ends.
+Yields the RunMetrics of the run.
+'''
+@contextlib.contextmanager
+def run(name, report_path=None):
+    parent = _current_run.get()
+    metrics = RunMetrics(name)
+    token = _current_run.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_run.reset(token)
+        metrics.finish()
+        if parent is not None:
+            parent.merge(metrics)
+
+        report = metrics.report()
+        if report_path is not None:
+            write_report(report, report_path)
+        _emit('report', name, None, report)
+
+
+def write_report(report, report_path):
+    report_dir = os.path.dirname(report_path)
+    if report_dir != '' and not os.path.exists(report_dir):
+        os.makedirs(report_dir)
+    with open(f'{report_path}.tmp', 'w') as output:
+        output.write(json.dumps(report, indent=1))
+    os.replace(f'{report_path}.tmp', report_path)
+
+
+# Time the with block as one call of the stage name
+@contextlib.contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics = _current_run.get()
+        if metrics is not None:
+            metrics.add_stage(name, seconds)
+        _emit('stage', name, None, seconds)
+
+
+# Add value to the metric of a key (e.g. count('api_calls', 'efetch'))
+def count(metric, key, value=1):
+    metrics = _current_run.get()
+    if metrics is not None:
+        metrics.add(metric, key, value)
+    _emit('count', metric, key, value)
+
+
+# Record the hits and misses of one lookup of a cache
+def cache_lookup(cache, hits, misses):
+    count('cache_hits', cache, hits)
+    count('cache_misses', cache, misses)
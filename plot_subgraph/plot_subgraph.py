@@ -8,10 +8,13 @@ import holoviews as hv
 from holoviews.operation.datashader import bundle_graph
 from colorcet import kb, kr
 import numpy as np
-import networkx as nx
 import pandas as pd
 import os
 
+import graph_layout
+import instrumentation
+import edge_tables
+
 # also requires selenium
 # conda install -c conda-forge firefox geckodriver
 
@@ -50,21 +53,11 @@ def make_plot(weight_field):
 # I read in a csv of edges with different edge weights for every edge. Ideally, Cem will also write each node (left-edge->right) as a seperate column.  
 # ### Create a nodes dataframe
 
-def plot_subgraph(csv_path, rel_name):
-    global edges_plot
-    global nodes_plot
-    global node_type_size_dict
-    global labels
-
+# Edges and nodes dataframes from the csv, nodes are told apart by name only
+def read_csv_data(csv_path):
     with open(csv_path, 'r') as w:
         data = pd.read_csv(w)
 
-    if not (os.path.exists(f'./{rel_name}')):
-        os.mkdir(f'./{rel_name}')
-    
-    if not (os.path.exists(f'./{rel_name}/subgraphs')):
-        os.mkdir(f'./{rel_name}/subgraphs')
-    
     #this is since I have CSV that does not explicitly specify node types
     data["left"] = data.Edge.apply(lambda a: a.split("-->")[0])
     data["right"] = data.Edge.apply(lambda a: a.split("-->")[1])
@@ -77,15 +70,78 @@ def plot_subgraph(csv_path, rel_name):
     #also temporary type should be in the csv
     nodes["type"] = nodes.name.apply(lambda a: "Chem/Gene" if a in data.left.values else "Disease")
 
+    return data, nodes
+
+# Edges and nodes dataframes from the tables written by edge_weight.py (see edge_tables.py)
+'''
+Edges are matched to nodes by node id, so parallel edges are all drawn and the node type is its category
+'''
+def read_table_data(edges_table, nodes_table):
+    data = edges_table.to_pandas()
+    nodes = nodes_table.to_pandas()
+
+    # nodes of the edges only, indexed 0..n-1
+    nodes = nodes[nodes.node_id.isin(np.union1d(data.source.values, data.target.values))].reset_index(drop=True)
+    node_index = pd.Series(np.arange(len(nodes)), index=nodes.node_id.values)
+    data["left_index"] = node_index.loc[data.source.values].values
+    data["right_index"] = node_index.loc[data.target.values].values
+    data["left"] = nodes.name.values[data.left_index.values]
+    data["right"] = nodes.name.values[data.right_index.values]
 
-    # ### Create NetworkX Graph
-    # Make a directed graph from a list of edges.  
-    # Also let's compute node layout as well... layout is just position of every node on the canvas
+    nodes = pd.DataFrame({"index": np.arange(len(nodes)), "node_id": nodes.node_id.values, "name": nodes.name.values,
+                          "type": nodes.category.astype(str).values})
 
-    graph = nx.DiGraph()
-    graph.add_edges_from(data.loc[:,["left_index","right_index"]].values)
-    layout = nx.layout.fruchterman_reingold_layout(graph.to_undirected(),.5)
-    layout = pd.DataFrame(layout,index=["x","y"]).T.sort_index()
+    return data, nodes
+
+# Stage timings and layout cache hits are written to metrics_path as json if given (see instrumentation.py)
+'''
+If edge_weight.py wrote edge and node tables next to the csv, they are read instead of the csv
+'''
+def plot_subgraph(csv_path, rel_name, layout_dir=None, metrics_path=None):
+    with instrumentation.run('plot_subgraph', metrics_path):
+        _plot_subgraph(csv_path, rel_name, layout_dir)
+
+
+def _plot_subgraph(csv_path, rel_name, layout_dir):
+    global edges_plot
+    global nodes_plot
+    global node_type_size_dict
+    global labels
+
+    with instrumentation.stage('plot_subgraph.read_data'):
+        tables = edge_tables.read_edge_tables(os.path.dirname(csv_path), os.path.splitext(os.path.basename(csv_path))[0])
+        if tables is not None:
+            data, nodes = read_table_data(*tables)
+        else:
+            data, nodes = read_csv_data(csv_path)
+
+    # nodes are told apart by id with the tables, by name with the csv
+    if tables is not None:
+        node_key, edges, node_keys = 'id', list(zip(data.source.tolist(), data.target.tolist())), nodes.node_id.tolist()
+    else:
+        node_key, edges, node_keys = 'name', list(zip(data.left, data.right)), nodes.name.tolist()
+    nodes = nodes.drop(columns=["node_id"], errors="ignore")
+
+    if not (os.path.exists(f'./{rel_name}')):
+        os.mkdir(f'./{rel_name}')
+    
+    if not (os.path.exists(f'./{rel_name}/subgraphs')):
+        os.mkdir(f'./{rel_name}/subgraphs')
+
+    # ### Node Layout
+    # Layout is just position of every node on the canvas.
+    # Reuse the layout cached by edge_weight.py for this edge set (ForceAtlas2) if there is one,
+    # otherwise compute (and cache) a Fruchterman-Reingold layout
+
+    if layout_dir is None:
+        layout_dir = f'./{rel_name}/layouts'
+
+    with instrumentation.stage('plot_subgraph.layout'):
+        positions = graph_layout.load_layout(edges, layout_dir, node_key=node_key)
+        if positions is None:
+            positions = graph_layout.get_layout(edges, layout_dir, 'fruchterman_reingold', node_key=node_key)
+
+    layout = pd.DataFrame([positions[node] for node in node_keys], columns=["x","y"])
     nodes = pd.concat([nodes,layout],axis=1)
 
 
@@ -95,8 +151,11 @@ def plot_subgraph(csv_path, rel_name):
     hv.extension("bokeh")
 
 
+    # weight columns of the data (csvs of older runs have fewer)
+    weights = [w for w in ["Original_Weight","Boltzmann_Citation_Weight","Publication_Year_Weight","Publication_Year_and_Citation_Weight", "H_Index_Weight", "Unique_Citation_Weight"] if w in data.columns]
+
     nodes_plot = hv.Nodes(nodes,kdims=["x","y","index"],vdims=["name","type"]).opts(show_legend=True)
-    edges_plot = hv.Graph((data,nodes_plot,paths),kdims=["left_index","right_index"],vdims=["Original_Weight","Boltzmann_Citation_Weight","Publication_Year_Weight","Publication_Year_and_Citation_Weight", "H_Index_Weight"])
+    edges_plot = hv.Graph((data,nodes_plot,paths),kdims=["left_index","right_index"],vdims=weights)
     # edges_plot = bundle_graph(edges_plot)
 
 
@@ -104,19 +163,20 @@ def plot_subgraph(csv_path, rel_name):
 
     weight_field = "Boltzmann_Citation_Weight"
 
-    weights = ["Original_Weight","Boltzmann_Citation_Weight","Publication_Year_Weight","Publication_Year_and_Citation_Weight", "H_Index_Weight"]
-
     # need to change this
-    node_type_size_dict = {"Chem/Gene":15,"Disease":30}
+    node_type_size_dict = {node_type: 30 if node_type == "Disease" else 15 for node_type in nodes.type.unique()}
 
-    out = hv.HoloMap({w: make_plot(w) for w in weights},kdims = "weight_type")
+    with instrumentation.stage('plot_subgraph.render'):
+        out = hv.HoloMap({w: make_plot(w) for w in weights},kdims = "weight_type")
 
 
     print('Saving Subgraphs to file...')
 
-    hv.save(out,f"./{rel_name}/subgraphs/{rel_name}_subgraph.html")
+    with instrumentation.stage('plot_subgraph.save_html'):
+        hv.save(out,f"./{rel_name}/subgraphs/{rel_name}_subgraph.html")
 
-    hv.save(out,f"./{rel_name}/subgraphs/{rel_name}_img1.gif")
+    with instrumentation.stage('plot_subgraph.save_gif'):
+        hv.save(out,f"./{rel_name}/subgraphs/{rel_name}_img1.gif")
 
 
     # ![Subgraph](imgs/img1.gif)
@@ -126,7 +186,9 @@ def plot_subgraph(csv_path, rel_name):
 
     out2 = out.opts(width=600,height=600).layout("weight_type").cols(2)
 
-    hv.save(out2,f"./{rel_name}/subgraphs/{rel_name}_img2.png")
-    hv.save(out2,f"./{rel_name}/subgraphs/{rel_name}_subgraph_side_by_side.html")
+    with instrumentation.stage('plot_subgraph.save_png'):
+        hv.save(out2,f"./{rel_name}/subgraphs/{rel_name}_img2.png")
+    with instrumentation.stage('plot_subgraph.save_html'):
+        hv.save(out2,f"./{rel_name}/subgraphs/{rel_name}_subgraph_side_by_side.html")
 
     # ![Side by Side](imgs/img2.png)
@@ -0,0 +1,289 @@
+#Copyright (C) Systems & Technology Research
+#Use of this software is subject to the restrictions in license.txt
+#Distribution A: Approved for Public Release, Distribution Unlimited
+import hashlib
+import json
+import os
+import shutil
+from collections.abc import Mapping
+
+import numpy as np
+
+
+PMID_METADATA_VERSION = 1
+
+# Keys of a pmid_dict entry (edge_weight.build_pmid_entry), in the order entries are rebuilt with
+ENTRY_KEYS = ('pmcid_number', 'pmcid', 'authors', 'affiliations', 'grants', 'pub_date', 'citations')
+
+# Year of pmids without a publication date
+NO_YEAR = -1
+
+ARRAYS = ('year', 'author_ptr', 'author_ids', 'citer_ptr', 'citers')
+
+
+# Compact, array backed pmid_dict
+'''
+The fields the weights are computed from are held in numpy arrays aligned with pmids:
+year: publication year (int32, NO_YEAR if unknown)
+author_ids: ids of the authors of every pmid in a CSR structure, the authors of pmid i are
+            authors[author_ids[author_ptr[i]:author_ptr[i+1]]] (every author name is stored once)
+citers: citing pmids (int32) of every pmid in a CSR structure, citers[citer_ptr[i]:citer_ptr[i+1]]
+
+The other fields (affiliations, grants, pub_date, pmcid) are only needed to rebuild entries, they are
+kept apart and loaded on first use.
+
+On disk this is a folder of .npy files (memory mapped when loaded) plus json files for pmids, author
+names and the other fields, see save / load.
+
+A PmidMetadata is a read-only Mapping pmid -> pmid_dict entry, entries are rebuilt on access.
+'''
+class PmidMetadata(Mapping):
+
+    def __init__(self, pmids, authors, arrays, extras=None, extras_path=None):
+        self.pmids = pmids
+        self.authors = authors
+        self.year = arrays['year']
+        self.author_ptr = arrays['author_ptr']
+        self.author_ids = arrays['author_ids']
+        self.citer_ptr = arrays['citer_ptr']
+        self.citers = arrays['citers']
+        self._extras = extras
+        self.extras_path = extras_path
+        self._pmid_index = None
+
+    # Compact form of a pmid_dict
+    @classmethod
+    def from_pmid_dict(cls, pmid_dict):
+        pmids = list(pmid_dict.keys())
+        year = np.full(len(pmids), NO_YEAR, dtype=np.int32)
+        author_index = dict()
+        author_ids, author_ptr = [], [0]
+        citers, citer_ptr = [], [0]
+        extras = dict()
+
+        for i, pmid in enumerate(pmids):
+            entry = pmid_dict[pmid]
+            if entry['pub_date'] != '':
+                year[i] = int(entry['pub_date'][:4])
+
+            for author in entry['authors']:
+                author_ids.append(author_index.setdefault(author, len(author_index)))
+            author_ptr.append(len(author_ids))
+
+            # pmids without citations have '' instead of a list
+            citations = entry['citations']
+            citers.extend(int(citer) for citer in citations)
+            citer_ptr.append(len(citers))
+
+            extra = {key: value for key, value in entry.items() if key not in ('authors', 'citations')}
+            if not isinstance(citations, list):
+                extra['citations'] = citations
+            extras[pmid] = extra
+
+        arrays = {
+            'year': year,
+            'author_ptr': np.asarray(author_ptr, dtype=np.int64),
+            'author_ids': np.asarray(author_ids, dtype=np.int32),
+            'citer_ptr': np.asarray(citer_ptr, dtype=np.int64),
+            'citers': np.asarray(citers, dtype=np.int32),
+        }
+        return cls(pmids, list(author_index.keys()), arrays, extras)
+
+    # Compact form of several PmidMetadata, for pmids of a later part the last part holding them wins
+    '''
+    pmids: pmids to keep, in this order (pmids that no part holds are left out); all pmids of the parts if None
+    Arrays are gathered without rebuilding entries, author names are interned again over the kept pmids.
+    '''
+    @classmethod
+    def concat(cls, parts, pmids=None):
+        owner = dict()
+        for p, part in enumerate(parts):
+            owner.update(dict.fromkeys(part.pmids, p))
+        if pmids is None:
+            pmids = list(owner.keys())
+        else:
+            pmids = [pmid for pmid in pmids if pmid in owner]
+
+        n = len(pmids)
+        part_of = np.fromiter((owner[pmid] for pmid in pmids), dtype=np.int64, count=n)
+        row_of = np.fromiter((parts[owner[pmid]].pmid_index[pmid] for pmid in pmids), dtype=np.int64, count=n)
+
+        year = np.full(n, NO_YEAR, dtype=np.int32)
+        n_authors = np.zeros(n, dtype=np.int64)
+        n_citers = np.zeros(n, dtype=np.int64)
+        for p, part in enumerate(parts):
+            out = np.nonzero(part_of == p)[0]
+            rows = row_of[out]
+            year[out] = part.year[rows]
+            n_authors[out] = part.author_ptr[rows + 1] - part.author_ptr[rows]
+            n_citers[out] = part.citer_ptr[rows + 1] - part.citer_ptr[rows]
+        author_ptr = np.concatenate(([0], np.cumsum(n_authors))).astype(np.int64)
+        citer_ptr = np.concatenate(([0], np.cumsum(n_citers))).astype(np.int64)
+
+        author_index = dict()
+        author_ids = np.empty(author_ptr[-1], dtype=np.int32)
+        citers = np.empty(citer_ptr[-1], dtype=np.int32)
+        extras = dict()
+        for p, part in enumerate(parts):
+            out = np.nonzero(part_of == p)[0]
+            if len(out) == 0:
+                continue
+            rows = row_of[out]
+            part_authors = part.author_ids[_csr_positions(part.author_ptr, rows)]
+            # intern the authors of the kept pmids only
+            used = np.unique(part_authors)
+            global_ids = np.full(len(part.authors), -1, dtype=np.int32)
+            global_ids[used] = [author_index.setdefault(part.authors[a], len(author_index)) for a in used]
+            author_ids[_csr_positions(author_ptr, out)] = global_ids[part_authors]
+            citers[_csr_positions(citer_ptr, out)] = part.citers[_csr_positions(part.citer_ptr, rows)]
+            part_extras = part.extras
+            for i in out:
+                extras[pmids[i]] = part_extras[pmids[i]]
+
+        arrays = {'year': year, 'author_ptr': author_ptr, 'author_ids': author_ids, 'citer_ptr': citer_ptr, 'citers': citers}
+        return cls(pmids, list(author_index.keys()), arrays, extras)
+
+    # Write the compact form to the folder path (replacing an existing one)
+    def save(self, path):
+        tmp_path = f'{path}.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        for name in ARRAYS:
+            np.save(os.path.join(tmp_path, f'{name}.npy'), getattr(self, name))
+        for name, value in (('pmids', self.pmids), ('authors', self.authors), ('extras', self.extras)):
+            with open(os.path.join(tmp_path, f'{name}.json'), 'w') as output:
+                output.write(json.dumps(value))
+        # manifest last, so an interrupted write is not picked up as complete
+        with open(os.path.join(tmp_path, 'manifest.json'), 'w') as output:
+            output.write(json.dumps({'version': PMID_METADATA_VERSION, 'n_pmids': len(self.pmids)}))
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+
+    # Load a compact form written by save, None if there is no complete one at path
+    @classmethod
+    def load(cls, path):
+        manifest_path = os.path.join(path, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as f:
+            if json.load(f).get('version') != PMID_METADATA_VERSION:
+                return None
+
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in ARRAYS}
+        with open(os.path.join(path, 'pmids.json')) as f:
+            pmids = json.load(f)
+        with open(os.path.join(path, 'authors.json')) as f:
+            authors = json.load(f)
+        return cls(pmids, authors, arrays, extras_path=os.path.join(path, 'extras.json'))
+
+    # Fields other than authors and citations, loaded on first use
+    @property
+    def extras(self):
+        if self._extras is None:
+            with open(self.extras_path) as f:
+                self._extras = json.load(f)
+        return self._extras
+
+    @property
+    def pmid_index(self):
+        if self._pmid_index is None:
+            self._pmid_index = {pmid: i for i, pmid in enumerate(self.pmids)}
+        return self._pmid_index
+
+    # Position of every pmid of a list, -1 for pmids that are not in the metadata
+    def positions(self, pmids):
+        pmid_index = self.pmid_index
+        return np.fromiter((pmid_index.get(pmid, -1) for pmid in pmids), dtype=np.int64, count=len(pmids))
+
+    # Number of citing pmids of every pmid
+    def n_citations(self):
+        return np.diff(self.citer_ptr)
+
+    # Maximum over the authors of every pmid of a per-author array (initial for pmids without authors)
+    def max_over_authors(self, author_values, initial):
+        out = np.full(len(self.pmids), initial, dtype=np.float64)
+        entry_pmid = np.repeat(np.arange(len(self.pmids)), np.diff(self.author_ptr))
+        np.maximum.at(out, entry_pmid, author_values[self.author_ids])
+        return out
+
+    # Authors of every pmid in order, with repeats (as listed by the entries)
+    def author_list(self):
+        return [self.authors[a] for a in self.author_ids]
+
+    # Short hash of the fields the weights are computed from (year, authors, citers) of a pmid
+    def fingerprint(self, pmid):
+        i = self.pmid_index[pmid]
+        h = hashlib.sha1(str(int(self.year[i])).encode('utf-8'))
+        h.update('\n'.join(self.authors[a] for a in self.author_ids[self.author_ptr[i]:self.author_ptr[i + 1]]).encode('utf-8'))
+        h.update(np.ascontiguousarray(self.citers[self.citer_ptr[i]:self.citer_ptr[i + 1]], dtype='<i4').tobytes())
+        return h.hexdigest()[:16]
+
+    # Per-author array of h-indexes (default for authors without one)
+    def author_h_indexes(self, author_2_h_index, default=-1):
+        return np.fromiter((author_2_h_index.get(author, default) for author in self.authors), dtype=np.float64,
+                           count=len(self.authors))
+
+    def __getitem__(self, pmid):
+        i = self.pmid_index[pmid]
+        extra = self.extras[pmid]
+        fields = dict(extra)
+        fields['authors'] = [self.authors[a] for a in self.author_ids[self.author_ptr[i]:self.author_ptr[i + 1]]]
+        if 'citations' not in extra:
+            fields['citations'] = [str(citer) for citer in self.citers[self.citer_ptr[i]:self.citer_ptr[i + 1]]]
+
+        entry = {key: fields.pop(key) for key in ENTRY_KEYS if key in fields}
+        entry.update(fields)
+        return entry
+
+    def __contains__(self, pmid):
+        return pmid in self.pmid_index
+
+    def __iter__(self):
+        return iter(self.pmids)
+
+    def __len__(self):
+        return len(self.pmids)
+
+
+# Positions in a CSR values array of the entries of rows, in row order
+def _csr_positions(ptr, rows):
+    starts = np.asarray(ptr[rows], dtype=np.int64)
+    lengths = np.asarray(ptr[rows + 1], dtype=np.int64) - starts
+    out_starts = np.cumsum(lengths) - lengths
+    return np.repeat(starts - out_starts, lengths) + np.arange(lengths.sum(), dtype=np.int64)
+
+
+# Collects pmid_dict batches into compact parts as they arrive
+'''
+Takes the place of the pmid_dict of edge_weight.collect_pmid_metadata (update, pop, in), so fetched
+entries are only held as dictionaries one batch at a time. build() merges the parts into one PmidMetadata.
+'''
+class PmidMetadataBuilder:
+
+    def __init__(self):
+        self.parts = []
+        self.pmids = dict()
+
+    def update(self, entries):
+        if len(entries) == 0:
+            return
+        self.parts.append(PmidMetadata.from_pmid_dict(entries))
+        self.pmids.update(dict.fromkeys(entries))
+
+    # Drop a pmid (the entry is not returned, it is not kept as a dictionary)
+    def pop(self, pmid, default=None):
+        self.pmids.pop(pmid, None)
+        return default
+
+    def __contains__(self, pmid):
+        return pmid in self.pmids
+
+    def __len__(self):
+        return len(self.pmids)
+
+    def build(self):
+        return PmidMetadata.concat(self.parts, list(self.pmids.keys()))
@@ -0,0 +1,189 @@
+#Copyright (C) Systems & Technology Research
+#Use of this software is subject to the restrictions in license.txt
+#Distribution A: Approved for Public Release, Distribution Unlimited
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import instrumentation
+
+
+DEFAULT_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'pmid_metadata.sqlite')
+
+# SQLite limits the number of variables in one statement
+MAX_QUERY_VARIABLES = 900
+
+
+# Add the fetched_at / use_count columns used by RefreshPolicy to a table created without them
+'''
+Rows that were stored before fetched_at existed are stamped with the current time
+'''
+def add_refresh_columns(conn, table):
+    columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    if 'fetched_at' not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN fetched_at REAL')
+        conn.execute(f'UPDATE {table} SET fetched_at = ?', (time.time(),))
+    if 'use_count' not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN use_count INTEGER NOT NULL DEFAULT 0')
+
+
+# Persistent PMID metadata store shared by all subgraphs
+'''
+Holds one pmid_dict entry per pmid (as produced by edge_weight.collect_NCBI) in a SQLite table
+indexed by pmid, so any subgraph can look up the pmids it needs and only fetch the missing ones
+from NCBI. Entries are committed batch by batch as they are fetched.
+
+Each entry records when it was fetched and how many runs used it (count_uses), see
+refresh_policy.RefreshPolicy for when entries are fetched again.
+
+One store can be shared by several EdgeWeightCalculators running in different threads, the
+connection is guarded by a lock.
+'''
+class PmidStore:
+
+    def __init__(self, db_path=DEFAULT_STORE_PATH):
+        self.db_path = db_path
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir != '' and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL lets readers keep working while another run is writing
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS pmid_metadata (pmid TEXT PRIMARY KEY, record TEXT NOT NULL, '
+                          'fetched_at REAL, use_count INTEGER NOT NULL DEFAULT 0)')
+        add_refresh_columns(self.conn, 'pmid_metadata')
+        self.conn.commit()
+
+    # Returns a dictionary pmid -> pmid_dict entry for the pmids found in the store
+    def get_many(self, pmids):
+        found = dict()
+        pmids = [str(pmid) for pmid in pmids]
+        for start in range(0, len(pmids), MAX_QUERY_VARIABLES):
+            chunk = pmids[start:start + MAX_QUERY_VARIABLES]
+            placeholders = ','.join('?' * len(chunk))
+            with self.lock:
+                rows = self.conn.execute(f'SELECT pmid, record FROM pmid_metadata WHERE pmid IN ({placeholders})', chunk).fetchall()
+            for pmid, record in rows:
+                found[pmid] = json.loads(record)
+        instrumentation.cache_lookup('pmid_store', len(found), len(pmids) - len(found))
+        return found
+
+    # Insert or replace entries from a dictionary pmid -> pmid_dict entry and commit them
+    def put_many(self, entries):
+        fetched_at = time.time()
+        rows = [(str(pmid), json.dumps(entry), fetched_at) for pmid, entry in entries.items()]
+        with self.lock:
+            self.conn.executemany('INSERT INTO pmid_metadata (pmid, record, fetched_at) VALUES (?, ?, ?) '
+                                  'ON CONFLICT(pmid) DO UPDATE SET record = excluded.record, fetched_at = excluded.fetched_at', rows)
+            self.conn.commit()
+
+    # Count one use of every stored pmid in pmids (once per run that reads them, wherever it reads them from)
+    def count_uses(self, pmids):
+        pmids = [str(pmid) for pmid in pmids]
+        with self.lock:
+            for start in range(0, len(pmids), MAX_QUERY_VARIABLES):
+                chunk = pmids[start:start + MAX_QUERY_VARIABLES]
+                placeholders = ','.join('?' * len(chunk))
+                self.conn.execute(f'UPDATE pmid_metadata SET use_count = use_count + 1 WHERE pmid IN ({placeholders})', chunk)
+            self.conn.commit()
+
+    # The n most used pmids of the store
+    def most_used(self, n):
+        with self.lock:
+            rows = self.conn.execute('SELECT pmid FROM pmid_metadata WHERE use_count > 0 ORDER BY use_count DESC LIMIT ?', (n,)).fetchall()
+        return [row[0] for row in rows]
+
+    # Stale pmids according to a RefreshPolicy, among pmids (all pmids of the store if None)
+    '''
+    refresh_top_n always refers to the most used pmids of the whole store, also when pmids is given
+    '''
+    def stale(self, policy, pmids=None):
+        columns = 'pmid, fetched_at, use_count' + (', record' if policy.retry_zero else '')
+        top_keys = None
+        if pmids is None:
+            with self.lock:
+                rows = self.conn.execute(f'SELECT {columns} FROM pmid_metadata').fetchall()
+        else:
+            rows = []
+            pmids = [str(pmid) for pmid in pmids]
+            if policy.refresh_top_n > 0:
+                top_keys = set(self.most_used(policy.refresh_top_n)).intersection(pmids)
+            for start in range(0, len(pmids), MAX_QUERY_VARIABLES):
+                chunk = pmids[start:start + MAX_QUERY_VARIABLES]
+                placeholders = ','.join('?' * len(chunk))
+                with self.lock:
+                    rows.extend(self.conn.execute(f'SELECT {columns} FROM pmid_metadata WHERE pmid IN ({placeholders})', chunk).fetchall())
+
+        # zero: no citing pmids
+        return policy.stale_keys(((row[0], row[1], row[2], policy.retry_zero and len(json.loads(row[3])['citations']) == 0)
+                                  for row in rows), top_keys=top_keys)
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM pmid_metadata').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# Append-only journal of fetched pmid_dict entries
+'''
+Every batch fetched from NCBI is appended as JSON lines ([pmid, entry]) and flushed to disk before the
+next one arrives, so a run that is interrupted (NCBI outage, killed job) can replay the journal and
+only fetch the remaining pmids. A partially written last line (crash in the middle of a write) is
+dropped when the journal is replayed.
+'''
+class PmidJournal:
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    # Returns the entries of the journal and drops a partially written last line
+    def replay(self):
+        entries = dict()
+        if not os.path.exists(self.path):
+            return entries
+
+        valid_size = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    pmid, entry = json.loads(line)
+                except ValueError:
+                    break
+                entries[pmid] = entry
+                valid_size += len(line)
+
+        if valid_size < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_size)
+
+        return entries
+
+    # Append entries from a dictionary pmid -> pmid_dict entry and flush them to disk
+    def append(self, entries):
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+        self.file.write(''.join(json.dumps([pmid, entry]) + '\n' for pmid, entry in entries.items()))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    # Delete the journal, once its entries are written to the compact PMID metadata
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,64 @@
+#Copyright (C) Systems & Technology Research
+#Use of this software is subject to the restrictions in license.txt
+#Distribution A: Approved for Public Release, Distribution Unlimited
+import time
+
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+# When cached NCBI results (PmidStore, HIndexStore) are fetched again
+'''
+Every store entry carries the time it was fetched and the number of times it was used. An entry is
+stale, and re-queried instead of read from the store, if any of these is true:
+
+max_age: it was fetched more than max_age days ago (None: entries never expire)
+retry_zero: its value is zero (pmid without citations, author with an h-index of 0)
+refresh_top_n: it is one of the refresh_top_n most used entries (so the entries that matter most are
+               refreshed on every pass)
+
+The default policy never refreshes anything, which is how the stores behaved before.
+'''
+class RefreshPolicy:
+
+    def __init__(self, max_age=None, retry_zero=False, refresh_top_n=0):
+        self.max_age = max_age
+        self.retry_zero = retry_zero
+        self.refresh_top_n = refresh_top_n
+
+    # Entries fetched before this time are stale (None if entries never expire)
+    def cutoff(self, now=None):
+        if self.max_age is None:
+            return None
+        if now is None:
+            now = time.time()
+        return now - self.max_age * SECONDS_PER_DAY
+
+    # Keys of the stale entries among rows of (key, fetched_at, use_count, is_zero)
+    '''
+    rows that are only part of a store are ranked against each other, so a store passes the keys among rows
+    that are in its own refresh_top_n most used entries as top_keys instead
+    '''
+    def stale_keys(self, rows, now=None, top_keys=None):
+        cutoff = self.cutoff(now)
+
+        stale = set()
+        used = []
+        for key, fetched_at, use_count, is_zero in rows:
+            if cutoff is not None and (fetched_at is None or fetched_at < cutoff):
+                stale.add(key)
+            elif self.retry_zero and is_zero:
+                stale.add(key)
+            if use_count > 0:
+                used.append((use_count, key))
+
+        if top_keys is not None:
+            stale.update(top_keys)
+        elif self.refresh_top_n > 0:
+            used.sort(key=lambda item: item[0], reverse=True)
+            stale.update(key for _, key in used[:self.refresh_top_n])
+
+        return stale
+
+    def __repr__(self):
+        return f'RefreshPolicy(max_age={self.max_age}, retry_zero={self.retry_zero}, refresh_top_n={self.refresh_top_n})'
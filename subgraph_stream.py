@@ -0,0 +1,199 @@
+#Copyright (C) Systems & Technology Research
+#Use of this software is subject to the restrictions in license.txt
+#Distribution A: Approved for Public Release, Distribution Unlimited
+import itertools
+import json
+
+import ijson
+
+import weight_engine
+
+
+'''
+Streaming access to subgraph json files, without loading the whole document
+
+A subgraph json is an object whose categories, nodes and links lists are read one item at a time
+with ijson. Only the items of the current list are built as python objects, so memory is bounded by
+what the consumer keeps (e.g. a weight_engine.SubgraphIndex) and not by the size of the document.
+'''
+
+LIST_SECTIONS = ('categories', 'nodes', 'links')
+
+
+# Events of the top-level members of a subgraph json file object (opened in binary mode)
+'''
+Yields, in document order:
+('value', key, value) for a top-level member other than the LIST_SECTIONS lists
+('start', key, None), then ('item', key, item) for every item, then ('end', key, None) for a LIST_SECTIONS list
+'''
+def iter_subgraph(f):
+    events = ijson.basic_parse(f, use_float=True)
+    event, _ = next(events)
+    if event != 'start_map':
+        raise ValueError('A subgraph json must be an object')
+
+    for event, key in events:
+        if event == 'end_map':
+            return
+
+        event, value = next(events)
+        if key in LIST_SECTIONS and event == 'start_array':
+            yield 'start', key, None
+            for event, value in events:
+                if event == 'end_array':
+                    break
+                yield 'item', key, _build(event, value, events)
+            yield 'end', key, None
+        else:
+            yield 'value', key, _build(event, value, events)
+
+
+# Python object of the json value starting with (event, value)
+'''
+Same result as ijson.ObjectBuilder, built inline since this runs for every event of the document
+'''
+def _build(event, value, events):
+    if event == 'start_map':
+        obj = dict()
+    elif event == 'start_array':
+        obj = list()
+    else:
+        return value
+
+    # containers obj is nested in, with the key of obj in each
+    parents = []
+    key = None
+    for event, value in events:
+        if event == 'map_key':
+            key = value
+        elif event == 'start_map' or event == 'start_array':
+            child = dict() if event == 'start_map' else list()
+            if type(obj) is dict:
+                obj[key] = child
+            else:
+                obj.append(child)
+            parents.append((obj, key))
+            obj = child
+        elif event == 'end_map' or event == 'end_array':
+            if len(parents) == 0:
+                return obj
+            obj, key = parents.pop()
+        elif type(obj) is dict:
+            obj[key] = value
+        else:
+            obj.append(value)
+
+
+# iter_subgraph events, with the links held back until the lists they are resolved against are known
+'''
+Iterating yields the iter_subgraph events in document order, and the items of the categories and nodes
+lists are collected in self.categories and self.nodes. The first link is only yielded once the lists in
+sections (the ones the caller resolves links against) have ended. BLENDER subgraphs list nodes before
+links and nothing is held back; otherwise the events after the first link are buffered until these
+lists end, so callers should only require the lists they actually need.
+'''
+class SubgraphStream:
+
+    def __init__(self, f, sections=('categories', 'nodes')):
+        self.f = f
+        self.sections = sections
+        self.categories = []
+        self.nodes = []
+
+    def __iter__(self):
+        required = set(self.sections)
+        buffered = None
+
+        for kind, key, value in iter_subgraph(self.f):
+            if kind == 'item' and key == 'categories':
+                self.categories.append(value)
+            elif kind == 'item' and key == 'nodes':
+                self.nodes.append(value)
+            elif kind == 'end':
+                required.discard(key)
+
+            if buffered is None and kind == 'item' and key == 'links' and len(required) > 0:
+                buffered = []
+            if buffered is not None:
+                buffered.append((kind, key, value))
+                if len(required) > 0:
+                    continue
+                yield from buffered
+                buffered = None
+            else:
+                yield kind, key, value
+
+        # a document without one of the required lists
+        if buffered is not None:
+            yield from buffered
+
+    # Names of the categories (category index -> name)
+    def category_names(self):
+        return [category['name'] for category in self.categories]
+
+
+# Read a subgraph json file into its weight_engine.SubgraphIndex without loading the links
+'''
+Links are streamed into the index one at a time and are not kept. Only the nodes are waited for, a
+subgraph without categories or with categories after its links is not buffered.
+
+Returns:
+subgraph: dictionary of the top-level members of the json other than links (categories and nodes included)
+index: weight_engine.SubgraphIndex of the subgraph
+'''
+def read_subgraph_index(json_path):
+    subgraph = dict()
+    with open(json_path, 'rb') as f:
+        stream = SubgraphStream(f, sections=('nodes',))
+
+        def links():
+            for kind, key, value in stream:
+                if kind == 'value':
+                    subgraph[key] = value
+                elif kind == 'start' and key != 'links':
+                    subgraph[key] = getattr(stream, key)
+                elif kind == 'item' and key == 'links':
+                    yield value
+
+        # nodes are complete once the first link is read
+        links = links()
+        first = next(links, None)
+        index = weight_engine.SubgraphIndex(stream.nodes, [] if first is None else itertools.chain([first], links))
+        # top-level members after the links
+        for _ in links:
+            pass
+
+    return subgraph, index
+
+
+# Write a subgraph json from iter_subgraph events, byte for byte as json.dumps writes the same object
+class SubgraphWriter:
+
+    def __init__(self, output):
+        self.output = output
+        self.n_members = 0
+        self.n_items = 0
+
+    def _member(self, key):
+        self.output.write('{' if self.n_members == 0 else ', ')
+        self.output.write(json.dumps(key) + ': ')
+        self.n_members += 1
+
+    def write(self, kind, key, value):
+        if kind == 'value':
+            self._member(key)
+            self.output.write(json.dumps(value))
+        elif kind == 'start':
+            self._member(key)
+            self.output.write('[')
+            self.n_items = 0
+        elif kind == 'item':
+            if self.n_items > 0:
+                self.output.write(', ')
+            self.output.write(json.dumps(value))
+            self.n_items += 1
+        elif kind == 'end':
+            self.output.write(']')
+
+    def close(self):
+        self.output.write('{}' if self.n_members == 0 else '}')
@@ -0,0 +1,435 @@
+#Copyright (C) Systems & Technology Research
+#Use of this software is subject to the restrictions in license.txt
+#Distribution A: Approved for Public Release, Distribution Unlimited
+from array import array
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from pmid_metadata import PmidMetadata, NO_YEAR
+
+
+# Year the publication weight is measured from
+REFERENCE_YEAR = 2020
+
+# Parameters of the Boltzmann weights and their defaults
+'''
+year_mid, year_tau: Boltzmann function of the age of the newest paper (publication year weight)
+citation_mid, citation_tau: Boltzmann function of the citation count (publication year and citation weight)
+h_index_mid, h_index_tau: Boltzmann function of the highest author h-index (h-index weight)
+alpha: share of the publication year weight in the publication year and citation weight
+reference_year: year the age of papers is measured from
+'''
+WEIGHT_PARAMETERS = {
+    'year_mid': 10., 'year_tau': 3.,
+    'citation_mid': 15., 'citation_tau': 3.,
+    'h_index_mid': 20., 'h_index_tau': 2.,
+    'alpha': .5,
+    'reference_year': REFERENCE_YEAR,
+}
+
+# Blotzman Function
+def boltzman(x, xmid, tau):
+    return 1. / (1. + np.exp(-(x-xmid)/tau))
+
+
+# Get the pmid part of an edgetype string ("relation\nsource:pmid1,pmid2,")
+def edge_pmid_string(edgetype):
+    parts = edgetype.split(':')
+    if len(parts) < 2:
+        return ''
+    return parts[1]
+
+
+# Index of a subgraph built with one pass over its links
+'''
+Edges reference pmids through a CSR structure: the pmids of edge i are
+pmids[edge_pmids[edge_ptr[i]:edge_ptr[i+1]]]
+
+Attributes:
+node_ids, node_names, node_categories: lists indexed by node position in the json
+edge_source, edge_target: node positions of each edge
+edge_has_pmids: True if the edge has a (possibly empty) pmid list in its edgetype
+edge_n_tokens: number of comma separated entries in the pmid list (trailing empty entries included)
+pmids: unique pmids in order of first appearance
+all_pmids: pmids longer than one character, the pmids that are collected from NCBI
+
+The pmid lists of the edgetypes are not kept: the CSR structure and edge_n_tokens are all the weights
+depend on. Edge names (edge_keys) and pmid lists (edge_pmid_keys) are derived from them when needed.
+
+links can be any iterable of link dictionaries (e.g. a stream of links, see subgraph_stream.py), it is
+read once and the links are not kept.
+'''
+class SubgraphIndex:
+
+    def __init__(self, nodes, links):
+        self.node_ids = [node['id'] for node in nodes]
+        self.node_names = [node['name'] for node in nodes]
+        self.node_categories = [node['category'] for node in nodes]
+
+        # typed arrays, so no python object is kept per edge or per pmid entry
+        pmid_index = dict()
+        edge_source, edge_target = array('q'), array('q')
+        edge_has_pmids, edge_n_tokens = array('b'), array('q')
+        edge_ptr = array('q', [0])
+        edge_pmids = array('q')
+
+        for link in links:
+            edge_source.append(link['source'])
+            edge_target.append(link['target'])
+
+            pmid_string = edge_pmid_string(link['edgetype'])
+            if pmid_string != '':
+                tokens = pmid_string.split(',')
+                edge_has_pmids.append(True)
+                edge_n_tokens.append(len(tokens))
+                for pmid in tokens:
+                    if pmid == '':
+                        continue
+                    if pmid not in pmid_index:
+                        pmid_index[pmid] = len(pmid_index)
+                    edge_pmids.append(pmid_index[pmid])
+            else:
+                edge_has_pmids.append(False)
+                edge_n_tokens.append(0)
+            edge_ptr.append(len(edge_pmids))
+
+        self._set_edges(pmid_index, np.frombuffer(edge_source, dtype=np.int64), np.frombuffer(edge_target, dtype=np.int64),
+                        np.frombuffer(edge_has_pmids, dtype=bool), np.frombuffer(edge_n_tokens, dtype=np.int64),
+                        np.frombuffer(edge_ptr, dtype=np.int64), np.frombuffer(edge_pmids, dtype=np.int64))
+
+    def _set_edges(self, pmid_index, edge_source, edge_target, edge_has_pmids, edge_n_tokens, edge_ptr, edge_pmids):
+        self.pmid_index = pmid_index
+        self.pmids = list(pmid_index.keys())
+        self.all_pmids = [pmid for pmid in self.pmids if len(pmid) > 1]
+
+        self.edge_source = edge_source
+        self.edge_target = edge_target
+        self.edge_has_pmids = edge_has_pmids
+        self.edge_n_tokens = edge_n_tokens
+        self.edge_ptr = edge_ptr
+        self.edge_pmids = edge_pmids
+
+        # edge of every entry of edge_pmids, used for segment reductions
+        self.entry_edge = np.repeat(np.arange(self.n_edges), np.diff(self.edge_ptr))
+
+    @property
+    def n_edges(self):
+        return len(self.edge_source)
+
+    # "source name-->target name" of each edge, as used in the csv
+    @property
+    def edge_keys(self):
+        names = self.node_names
+        return [names[s] + '-->' + names[t] for s, t in zip(self.edge_source.tolist(), self.edge_target.tolist())]
+
+    # pmid list of each edge as a comma separated string, without the empty entries of its edgetype
+    def edge_pmid_keys(self):
+        pmids = self.pmids
+        edge_ptr = self.edge_ptr.tolist()
+        for i in range(self.n_edges):
+            yield ','.join([pmids[j] for j in self.edge_pmids[edge_ptr[i]:edge_ptr[i + 1]].tolist()])
+
+    # Index of a subset of the edges (list of edge positions), over the same nodes
+    '''
+    Built from slices of the CSR structure, pmids are renumbered in order of first appearance in the subset
+    '''
+    def subset(self, edges):
+        edges = np.asarray(edges, dtype=np.int64)
+        starts = self.edge_ptr[edges]
+        lengths = self.edge_ptr[edges + 1] - starts
+
+        edge_ptr = np.zeros(len(edges) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=edge_ptr[1:])
+        entries = self.edge_pmids[np.repeat(starts - edge_ptr[:-1], lengths) + np.arange(edge_ptr[-1])]
+
+        used, first, inverse = np.unique(entries, return_index=True, return_inverse=True)
+        order = np.argsort(first, kind='stable')
+        renumber = np.empty(len(used), dtype=np.int64)
+        renumber[order] = np.arange(len(used))
+
+        index = SubgraphIndex([], [])
+        index.node_ids = self.node_ids
+        index.node_names = self.node_names
+        index.node_categories = self.node_categories
+        index._set_edges({self.pmids[j]: k for k, j in enumerate(used[order].tolist())}, self.edge_source[edges],
+                         self.edge_target[edges], self.edge_has_pmids[edges], self.edge_n_tokens[edges], edge_ptr,
+                         renumber[inverse.ravel()])
+        return index
+
+    # Sum a per-pmid array over the pmids of every edge
+    def segment_sum(self, values):
+        return np.bincount(self.entry_edge, weights=values[self.edge_pmids], minlength=self.n_edges)
+
+    # Maximum of a per-pmid array over the pmids of every edge (initial for edges without pmids)
+    def segment_max(self, values, initial):
+        out = np.full(self.n_edges, initial, dtype=np.float64)
+        np.maximum.at(out, self.entry_edge, values[self.edge_pmids])
+        return out
+
+    # Sparse edge x pmid incidence matrix (entries count how often a pmid is listed for an edge)
+    def incidence_matrix(self):
+        return sp.csr_matrix((np.ones(len(self.edge_pmids), dtype=np.int32), self.edge_pmids, self.edge_ptr),
+                             shape=(self.n_edges, len(self.pmids)))
+
+    # Value of a per-pmid array at the last pmid of every edge (initial for edges without pmids)
+    def segment_last(self, values, initial):
+        out = np.full(self.n_edges, initial, dtype=np.float64)
+        has_entries = np.diff(self.edge_ptr) > 0
+        out[has_entries] = values[self.edge_pmids[self.edge_ptr[1:][has_entries] - 1]]
+        return out
+
+
+# Per-pmid arrays aligned with index.pmids
+'''
+year: publication year (-inf if unknown)
+n_citations: number of citing pmids
+citers: sparse pmid x citing paper matrix (one nonzero per citing pmid)
+max_h_index: highest h-index of the paper's authors (-1 if unknown), only if author_2_h_index is given
+
+pmid_dict is a dictionary pmid -> entry or a PmidMetadata, whose arrays are used directly
+'''
+def pmid_arrays(index, pmid_dict, author_2_h_index=None):
+    if isinstance(pmid_dict, PmidMetadata):
+        return metadata_pmid_arrays(index, pmid_dict, author_2_h_index)
+
+    # citing papers are gathered from the compact form of the entries of the subgraph
+    entries = {pmid: pmid_dict[pmid] for pmid in index.pmids if pmid_dict.get(pmid) is not None}
+    citers = citer_matrix(index, PmidMetadata.from_pmid_dict(entries))
+
+    n_pmids = len(index.pmids)
+    year = np.full(n_pmids, -np.inf)
+    n_citations = np.zeros(n_pmids)
+    max_h_index = np.full(n_pmids, -1.)
+
+    for i, pmid in enumerate(index.pmids):
+        entry = pmid_dict.get(pmid)
+        if entry is None:
+            continue
+        if entry['pub_date'] != '':
+            year[i] = int(entry['pub_date'][:4])
+        n_citations[i] = len(entry['citations'])
+        if author_2_h_index is not None:
+            for author in entry['authors']:
+                h_index = author_2_h_index.get(author, -1)
+                if h_index > max_h_index[i]:
+                    max_h_index[i] = h_index
+
+    arrays = {'year': year, 'n_citations': n_citations, 'citers': citers}
+    if author_2_h_index is not None:
+        arrays['max_h_index'] = max_h_index
+    return arrays
+
+
+# Sparse matrix with a row per pmid of the index and a column per citing paper, nonzero if the paper cites the pmid
+'''
+Citing pmids are renumbered to 0..n-1 (only the papers citing the subgraph), rows of pmids without
+metadata are empty
+'''
+def citer_matrix(index, metadata):
+    positions = metadata.positions(index.pmids)
+    found = positions >= 0
+
+    starts = np.zeros(len(index.pmids), dtype=np.int64)
+    lengths = np.zeros(len(index.pmids), dtype=np.int64)
+    starts[found] = metadata.citer_ptr[positions[found]]
+    lengths[found] = metadata.citer_ptr[positions[found] + 1] - starts[found]
+
+    indptr = np.zeros(len(index.pmids) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    gather = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+    citer_ids, columns = np.unique(metadata.citers[gather], return_inverse=True)
+
+    return sp.csr_matrix((np.ones(len(columns), dtype=np.int32), columns.astype(np.int32), indptr),
+                         shape=(len(index.pmids), len(citer_ids)))
+
+
+# pmid_arrays of a PmidMetadata, gathered from its arrays
+def metadata_pmid_arrays(index, metadata, author_2_h_index=None):
+    positions = metadata.positions(index.pmids)
+    found = positions >= 0
+    found_positions = positions[found]
+
+    year = np.full(len(index.pmids), -np.inf)
+    found_year = metadata.year[found_positions]
+    year[found] = np.where(found_year == NO_YEAR, -np.inf, found_year)
+
+    n_citations = np.zeros(len(index.pmids))
+    n_citations[found] = metadata.n_citations()[found_positions]
+
+    arrays = {'year': year, 'n_citations': n_citations, 'citers': citer_matrix(index, metadata)}
+    if author_2_h_index is not None:
+        max_h_index = np.full(len(index.pmids), -1.)
+        max_h_index[found] = metadata.max_over_authors(metadata.author_h_indexes(author_2_h_index), -1.)[found_positions]
+        arrays['max_h_index'] = max_h_index
+    return arrays
+
+
+# Largest citation list in pmid_dict, single citations are not counted (as in the original calculation)
+def max_citation_length(pmid_dict):
+    if isinstance(pmid_dict, PmidMetadata):
+        n_citations = pmid_dict.n_citations()
+        return int(n_citations[n_citations > 1].max(initial=0))
+
+    max_length_citations = 0
+    for entry in pmid_dict.values():
+        if len(entry['citations']) > 1 and len(entry['citations']) > max_length_citations:
+            max_length_citations = len(entry['citations'])
+    return max_length_citations
+
+
+# Raw per-edge statistics the weights are computed from
+'''
+citation_sum: number of citations of all pmids of the edge
+unique_citers: number of distinct papers citing any pmid of the edge (a paper citing several pmids of the
+               edge counts once), the nonzeros of every row of incidence x citers
+newest_year: publication year of the newest pmid of the edge (-inf if unknown)
+last_max_h_index: highest author h-index of the last pmid of the edge (-1 if unknown), only if
+                  arrays has max_h_index
+
+The statistics of an edge only depend on its own pmids, the subgraph-wide normalizers (number of pmids,
+longest citation list) are applied by the weight functions.
+'''
+def edge_stats(index, arrays):
+    stats = {
+        'citation_sum': index.segment_sum(arrays['n_citations']),
+        'unique_citers': np.diff((index.incidence_matrix() @ arrays['citers']).indptr).astype(np.float64),
+        'newest_year': index.segment_max(arrays['year'], -np.inf),
+    }
+    if 'max_h_index' in arrays:
+        stats['last_max_h_index'] = index.segment_last(arrays['max_h_index'], -1.)
+    return stats
+
+
+# Edge Weights
+'''
+Each function returns one weight per edge of the index, edges without pmids get a weight of 0
+'''
+
+# number of pmids of an edge normalized by the number of pmids in the subgraph
+def original_weights(index):
+    n_pmids = max(len(index.all_pmids), 1)
+    return np.where(index.edge_has_pmids, index.edge_n_tokens / n_pmids, 0.)
+
+# number of citations of an edge normalized by max # of citations
+def citation_weights(index, stats, max_length_citations):
+    return stats['citation_sum'] / (max_length_citations + 1)
+
+# number of distinct papers citing an edge normalized like the citation weight
+def unique_citation_weights(index, stats, max_length_citations):
+    return stats['unique_citers'] / (max_length_citations + 1)
+
+# Boltzmann curves of the weights, shared by the weight functions and sweep_weights (any broadcastable shapes)
+def publication_year_curve(newest_year, mid, tau, reference_year):
+    return (1 - boltzman(reference_year - newest_year, mid, tau)) / (1 - boltzman(0, mid, tau))
+
+def citation_count_curve(citation_sum, mid, tau):
+    return 1 - boltzman(1 + citation_sum, mid, tau)
+
+# publication year of the newest paper of an edge mapped to a Boltzmann function
+def publication_weights(index, stats, mid=10, tau=3, reference_year=REFERENCE_YEAR):
+    w = publication_year_curve(stats['newest_year'], mid, tau, reference_year)
+    return np.where(index.edge_has_pmids, w, 0.)
+
+# publication year weight and Boltzmann citation count mixed by alpha (equally weighted by default)
+def publication_citation_weights(index, stats, alpha=.5, year_mid=10, year_tau=3, citation_mid=15, citation_tau=3,
+                                 reference_year=REFERENCE_YEAR):
+    w = publication_weights(index, stats, year_mid, year_tau, reference_year) * alpha + \
+        citation_count_curve(stats['citation_sum'], citation_mid, citation_tau) * (1 - alpha)
+    return np.where(index.edge_has_pmids, w, 0.)
+
+# highest author h-index mapped to a Boltzmann function
+'''
+As in the original per-edge loop, the maximum is taken over the authors of the last pmid of the edge
+'''
+def h_index_weights(index, stats, mid=20, tau=2):
+    return np.where(index.edge_has_pmids, boltzman(stats['last_max_h_index'], mid, tau), 0.)
+
+
+# Compute all weight columns from the raw per-edge statistics
+def weights_from_stats(index, stats, max_length_citations):
+    return {
+        'Original_Weight': original_weights(index),
+        'Boltzmann_Citation_Weight': citation_weights(index, stats, max_length_citations),
+        'Publication_Year_Weight': publication_weights(index, stats),
+        'Publication_Year_and_Citation_Weight': publication_citation_weights(index, stats),
+        'H_Index_Weight': h_index_weights(index, stats),
+        'Unique_Citation_Weight': unique_citation_weights(index, stats, max_length_citations),
+    }
+
+
+# Parameter Sweeps
+'''
+The Boltzmann weights only depend on the raw edge statistics (edge_stats) and WEIGHT_PARAMETERS, so
+they can be computed for many parameter settings at once from already collected metadata.
+'''
+
+# Parameter combinations of the cartesian product of grids of WEIGHT_PARAMETERS
+'''
+grids: parameter name -> value or list of values, parameters that are not given keep their default
+Returns a dictionary parameter name -> array of its value in every combination
+'''
+def parameter_grid(**grids):
+    unknown = set(grids) - set(WEIGHT_PARAMETERS)
+    if len(unknown) > 0:
+        raise ValueError(f'Unknown weight parameters: {sorted(unknown)}')
+
+    values = [np.atleast_1d(np.asarray(grids.get(name, default), dtype=np.float64)) for name, default in WEIGHT_PARAMETERS.items()]
+    mesh = np.meshgrid(*values, indexing='ij')
+    return {name: grid.ravel() for name, grid in zip(WEIGHT_PARAMETERS, mesh)}
+
+# Publication year, publication year and citation, and h-index weights for every parameter combination, as arrays of shape (edges, combinations)
+'''
+params: parameter name -> array with one value per combination (e.g. from parameter_grid), missing
+        parameters keep their default
+Column j of every array equals the weight computed with the parameters of combination j. The h-index
+weight is only computed if stats has last_max_h_index. Each array holds edges x combinations float64
+values, so very large sweeps should be split into chunks of combinations.
+'''
+def sweep_weights(index, stats, params):
+    n_combinations = max([len(np.atleast_1d(values)) for values in params.values()] + [1])
+    p = {name: np.broadcast_to(np.asarray(params.get(name, default), dtype=np.float64), (n_combinations,))
+         for name, default in WEIGHT_PARAMETERS.items()}
+    has_pmids = index.edge_has_pmids[:, None]
+
+    publication = np.where(has_pmids, _sweep_curve(lambda mid, tau, reference_year: publication_year_curve(
+        stats['newest_year'][:, None], mid, tau, reference_year), p['year_mid'], p['year_tau'], p['reference_year']), 0.)
+    citation = _sweep_curve(lambda mid, tau: citation_count_curve(stats['citation_sum'][:, None], mid, tau),
+                            p['citation_mid'], p['citation_tau'])
+    alpha = p['alpha'][None, :]
+    weights = {
+        'Publication_Year_Weight': publication,
+        'Publication_Year_and_Citation_Weight': np.where(has_pmids, publication * alpha + citation * (1 - alpha), 0.),
+    }
+    if 'last_max_h_index' in stats:
+        weights['H_Index_Weight'] = np.where(has_pmids, _sweep_curve(lambda mid, tau: boltzman(
+            stats['last_max_h_index'][:, None], mid, tau), p['h_index_mid'], p['h_index_tau']), 0.)
+    return weights
+
+# Evaluate curve(*params) (edges x combinations) once per distinct combination of its own parameters
+'''
+Every curve depends on two or three of the parameters, so in a grid most combinations repeat the same
+values; the exponentials are computed for the distinct ones and their columns gathered.
+'''
+def _sweep_curve(curve, *params):
+    distinct, inverse = np.unique(np.stack(params, axis=1), axis=0, return_inverse=True)
+    values = curve(*(distinct[:, i][None, :] for i in range(len(params))))
+    return values[:, inverse.ravel()]
+
+
+# Dataframe with one row per edge name
+'''
+Edges with the same "source-->target" name share a row: the row is placed at the first such edge and
+holds the weights of the last one, the same as when weights are collected in dictionaries keyed by name
+'''
+def weights_dataframe(index, weights):
+    df = pd.DataFrame({'Edge': index.edge_keys})
+    for column, values in weights.items():
+        df[column] = values
+    return df.groupby('Edge', sort=False).last().reset_index()
+
+
+# Dictionary edge name -> weight, as returned by the get_*_weights functions of edge_weight.py
+def weights_dict(index, values):
+    return {key: float(w) for key, w in zip(index.edge_keys, values)}